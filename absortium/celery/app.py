@@ -4,6 +4,7 @@ __author__ = 'andrew.shvv@gmail.com'
 
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 from django.conf import settings
 
 # set the default Django settings module for the 'celery' program.
@@ -41,4 +42,22 @@ if settings.MODE in ['frontend', 'integration']:
 # Using a string here means the worker will not have to
 # pickle the object when using Windows.
 app.config_from_object('django.conf:settings')
+
+# Queues depend on the available pairs, so they can't be declared in settings.
+from absortium.celery.routers import PAIR_QUEUES
+
+app.conf.CELERY_QUEUES = settings.CELERY_QUEUES + PAIR_QUEUES
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+@worker_process_init.connect
+def load_books(*args, **kwargs):
+    """
+        Rebuild resident order books from the db on worker start, rather than on the first order.
+    """
+    from absortium import constants
+    from absortium.engine import book
+
+    if settings.MATCHING_ENGINE == constants.MATCHING_ENGINE_BOOK:
+        book.load_all()
+        logger.debug("Order books are loaded")
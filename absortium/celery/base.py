@@ -1,11 +1,77 @@
 __author__ = 'andrew.shvv@gmail.com'
 
+import random
+import time
+from collections import Counter
+
 from celery import Task
+from django.db import connection
 
+from absortium import constants
+from absortium.celery.routers import get_task_pair
 from core.utils.logging import getPrettyLogger
 
 logger = getPrettyLogger(__name__)
 
+"""
+    Tasks which fail on the db error (deadlock, lock timeout, statement timeout) are retried with the exponential
+    backoff and jitter rather than with the fixed countdown, so that the retries of the tasks which failed together
+    don't come back together. Every retry of the task which is routed to the pair queue raises the contention of the
+    pair, and retries of the contended pair are slowed down more - contention decays with time.
+
+    Pair tasks are processed by exactly one worker process (see 'routers'), so contention is counted in the process.
+    Every retry is logged with the count of the retries of the task in the process and the contention of its pair.
+"""
+
+# task name -> count of retries
+retries = Counter()
+
+
+class Contention():
+    def __init__(self, half_life=constants.CELERY_CONTENTION_HALF_LIFE):
+        self.half_life = half_life
+        self.scores = {}
+
+    def get(self, pair, now=None):
+        if pair not in self.scores:
+            return 0
+
+        now = time.monotonic() if now is None else now
+        score, updated = self.scores[pair]
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def add(self, pair, now=None):
+        now = time.monotonic() if now is None else now
+        self.scores[pair] = (self.get(pair, now) + 1, now)
+
+    def clear(self):
+        self.scores.clear()
+
+
+contention = Contention()
+
+
+def backoff(retry, score=0, rand=random.random):
+    """
+        Countdown before the retry with the given number: exponential, capped, multiplied by the contention of the
+        pair and jittered in the upper half (so the countdown never falls to zero).
+    """
+    countdown = constants.CELERY_RETRY_COUNTDOWN * 2 ** min(retry, 32)
+    countdown = min(countdown, constants.CELERY_RETRY_MAX_COUNTDOWN)
+    countdown *= 1 + min(score, constants.CELERY_CONTENTION_MAX_SCORE)
+    return countdown / 2 * (1 + rand())
+
+
+def set_timeouts():
+    """
+        Make the db fail fast rather than wait on locks. Timeouts are set for the current transaction only, so they
+        apply to the order tasks (which call it inside of their transaction) and not to the long periodic tasks
+        which use the same connection.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL lock_timeout = %s; SET LOCAL statement_timeout = %s',
+                       [constants.DB_LOCK_TIMEOUT, constants.DB_STATEMENT_TIMEOUT])
+
 
 class DBTask(Task):
     """
@@ -13,6 +79,25 @@ class DBTask(Task):
     """
     abstract = True
 
+    def retry_db(self, exc):
+        """
+            Retry the task which failed on the db error with the backoff, use as 'raise self.retry_db(e)'.
+        """
+        pair = get_task_pair(self.name, self.request.kwargs or {})
+
+        if pair is not None:
+            contention.add(pair)
+
+        retries[self.name] += 1
+
+        score = contention.get(pair) if pair is not None else 0
+        countdown = backoff(self.request.retries, score)
+
+        logger.warning("Task '{}' is retried in {:.2f}s (retries in the process: {}, contention of '{}': {:.1f}): {}"
+                       .format(self.name, countdown, retries[self.name], pair, score, exc))
+
+        return self.retry(exc=exc, countdown=countdown)
+
     def on_retry(self, exc, task_id, args, kwargs, einfo):
         pass
         # connection.close()
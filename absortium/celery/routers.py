@@ -0,0 +1,81 @@
+__author__ = 'andrew.shvv@gmail.com'
+
+from kombu import Exchange, Queue
+
+from absortium import constants
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+"""
+    Every order task goes to the queue of its pair, every such queue should be consumed by exactly one worker process:
+
+        $ celery worker -A absortium -Q absortium_btc_eth --concurrency=1
+        $ celery worker -A absortium -Q absortium
+
+    So matching within a pair never contends with itself, and different pairs are processed in parallel.
+"""
+
+ORDER_TASKS = [
+    'absortium.celery.tasks.create_order',
+    'absortium.celery.tasks.create_orders',
+    'absortium.celery.tasks.cancel_order',
+    'absortium.celery.tasks.cancel_orders',
+    'absortium.celery.tasks.update_order',
+    'absortium.celery.tasks.lock_order',
+    'absortium.celery.tasks.unlock_order',
+    'absortium.celery.tasks.approve_order',
+]
+
+
+def get_pair_queue(pair):
+    return constants.CELERY_PAIR_QUEUE.format(pair=pair)
+
+
+PAIR_QUEUES = tuple(Queue(get_pair_queue(pair), Exchange(get_pair_queue(pair)), routing_key=get_pair_queue(pair))
+                    for pair in constants.AVAILABLE_CURRENCY_PAIRS)
+
+
+def get_pair(kwargs):
+    """
+        Pair is given either explicitly (for tasks which work with existent order) or in the order data. Explicit
+        'None' means that task is not bound to the one pair.
+    """
+    if 'pair' in kwargs:
+        pair = kwargs['pair']
+    else:
+        data = kwargs.get('data') or {}
+        pair = data.get('pair', constants.PAIR_BTC_ETH)
+
+    if pair is None:
+        return None
+
+    return str(pair).lower()
+
+
+def get_task_pair(task, kwargs):
+    """
+        Pair of the queue which the task is routed to, None if task goes to the default queue.
+    """
+    if task in ORDER_TASKS:
+        pair = get_pair(kwargs)
+
+        # Malformed pair will be rejected by the task itself
+        if pair in constants.AVAILABLE_CURRENCY_PAIRS:
+            return pair
+
+    return None
+
+
+class PairRouter:
+    def route_for_task(self, task, args=None, kwargs=None, *extra, **options):
+        pair = get_task_pair(task, kwargs or {})
+
+        if pair is not None:
+            queue = get_pair_queue(pair)
+            return {
+                'queue': queue,
+                'routing_key': queue
+            }
+
+        return None
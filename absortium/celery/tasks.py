@@ -14,16 +14,22 @@ from django.db.utils import OperationalError
 
 from absortium import constants
 from absortium.wallet.pool import AccountPool
-from absortium.celery.base import get_base_class
+from absortium.celery.base import get_base_class, set_timeouts
 from absortium.crossbarhttp import publishment
-from absortium.exceptions import AlreadyExistError, LockFailureError, UnlockFailureError, UpdateFailureError
-from absortium.model.locks import lockorder
-from absortium.model.models import Account, Order, MarketInfo
+from absortium.engine import book
+from absortium.exceptions import AlreadyExistError, LockFailureError, NotEnoughMoneyError, UnlockFailureError, \
+    UpdateFailureError
+from absortium.model import flush
+from absortium.model.flush import orders_flushed
+from absortium.model.locks import lockaccounts, lockorder
+from absortium.model.models import Account, Order, MarketInfo, Trade, Candle
 from absortium.serializers import \
     OrderSerializer, \
     WithdrawSerializer, \
     DepositSerializer, \
-    AccountSerializer
+    AccountSerializer, \
+    order_serializer, \
+    account_serializer
 from core.utils.logging import getPrettyLogger
 
 logger = getPrettyLogger(__name__)
@@ -46,8 +52,8 @@ def do_deposit(self, *args, **kwargs):
     try:
         with transaction.atomic():
             return do()
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+    except OperationalError as e:
+        raise self.retry_db(e)
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
@@ -67,8 +73,8 @@ def do_withdrawal(self, *args, **kwargs):
     try:
         with transaction.atomic():
             return do()
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+    except OperationalError as e:
+        raise self.retry_db(e)
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
@@ -84,14 +90,117 @@ def create_order(self, *args, **kwargs):
         raise ValidationError("Total amount lower than {}".format(constants.ORDER_MIN_TOTAL_AMOUNT))
 
     try:
-        with publishment.atomic():
-            with transaction.atomic():
+        with book.atomic():
+            with publishment.atomic():
+                with transaction.atomic():
+                    set_timeouts()
+
+                    with flush.atomic():
+                        with lockorder(order=order):
+                            order.freeze_money()
+                            history = order.process()
+
+                    return order_serializer.serialize_many(history)
+
+    except OperationalError as e:
+        raise self.retry_db(e)
+
+
+def batch_error(e):
+    return {
+        'error': e.detail,
+        'error_id': getattr(e, 'error_id', constants.ERROR_VALIDATION)
+    }
+
+
+def batch_order(data, pair, **kwargs):
+    """
+        Deserialize and validate the order of the batch, it is used by the web tier before the batch is enqueued
+        and by the 'create_orders' task itself.
+    """
+    serializer = OrderSerializer(data=dict(data))
+    serializer.is_valid(raise_exception=True)
+    order = serializer.object(**kwargs)
+
+    if order.pair != pair:
+        raise ValidationError("All orders of the batch should have the same pair")
+
+    if order.total < constants.ORDER_MIN_TOTAL_AMOUNT:
+        raise ValidationError("Total amount lower than {}".format(constants.ORDER_MIN_TOTAL_AMOUNT))
+
+    return order
+
+
+@shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
+def create_orders(self, *args, **kwargs):
+    """
+        Create several orders of the one user and pair in one transaction: accounts are locked once, orders are
+        processed one by one and all changes (frozen money, fills) are flushed once for the whole batch.
+
+        Orders are validated by the web tier, 'errors' contains validation error of the order with the same index
+        (or None). If 'continue_on_error' is set, order which can't be created (validation, not enough money) gives
+        the error in its result rather than abort the whole batch.
+    """
+    user_pk = kwargs['user_pk']
+    pair = kwargs['pair']
+    continue_on_error = kwargs.get('continue_on_error', False)
+    errors = kwargs.get('errors') or [None] * len(kwargs['data'])
+
+    orders = []
+    for data, error in zip(kwargs['data'], errors):
+        if error is None:
+            orders.append(batch_order(data, pair, owner_id=user_pk))
+        else:
+            orders.append(error)
+
+    def do():
+        results = []
+
+        primary, secondary = pair.split("_")
+
+        with flush.atomic():
+            accounts = lockaccounts(owner_id=user_pk, currencies=[primary, secondary])
+
+            for order in orders:
+                if isinstance(order, dict):
+                    results.append(order)
+                    continue
+
+                order.from_account = accounts[order.from_currency]
+                order.to_account = accounts[order.to_currency]
+
+                # Accounts are shared by all orders of the batch, they contain funds which were frozen and got by
+                # previous orders.
+                if order.from_account.amount < order.from_amount:
+                    e = NotEnoughMoneyError("Not enough money for order creation/update")
+
+                    if not continue_on_error:
+                        raise e
+
+                    results.append(batch_error(e))
+                    continue
+
+                # Counter-orders which were changed by the previous orders of the batch are not written yet, the
+                # matching pass takes them from the flush block (see 'flush.order').
                 with lockorder(order=order):
                     order.freeze_money()
-                    return [OrderSerializer(e).data for e in order.process()]
+                    history = order.process()
 
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+                results.append(history)
+
+        # Orders get their ids on flush
+        return [result if isinstance(result, dict) else {'history': order_serializer.serialize_many(result)}
+                for result in results]
+
+    try:
+        with book.atomic():
+            with publishment.atomic():
+                with transaction.atomic():
+                    set_timeouts()
+                    return do()
+
+    except OperationalError as e:
+        raise self.retry_db(e)
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
@@ -107,16 +216,91 @@ def cancel_order(self, *args, **kwargs):
                 order.unfreeze_money()
                 order.status = constants.ORDER_CANCELED
 
-                return OrderSerializer(order).data
+                return order_serializer.serialize(order)
             else:
                 raise ValidationError("Order already canceled")
 
     try:
-        with publishment.atomic():
-            with transaction.atomic():
-                return do()
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+        with book.atomic():
+            with publishment.atomic():
+                with transaction.atomic():
+                    set_timeouts()
+                    return do()
+    except OperationalError as e:
+        raise self.retry_db(e)
+
+
+@shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
+def cancel_orders(self, *args, **kwargs):
+    """
+        Cancel all open orders of the user and pair which suit the filters: orders are canceled with one update and
+        money is unfrozen with one update per account. Orders which wait for approve are not canceled, because their
+        opposite orders should be changed as well (see 'cancel_order').
+
+        Task works with the one pair only - it goes to the queue of the pair as the other order tasks (see
+        'routers'), orders of all pairs are canceled by one task per pair.
+    """
+    user_pk = kwargs['user_pk']
+    pair = kwargs['pair']
+    filters = kwargs.get('filters') or {}
+
+    def do():
+        fields = {
+            'owner_id': user_pk,
+            'pair': pair,
+            'status__in': constants.ORDER_CANCELABLE_STATUSES,
+        }
+
+        if filters.get('type') is not None:
+            fields.update(type=filters['type'])
+
+        if filters.get('price_min') is not None:
+            fields.update(price__gte=decimal.Decimal(filters['price_min']))
+
+        if filters.get('price_max') is not None:
+            fields.update(price__lte=decimal.Decimal(filters['price_max']))
+
+        # Orders are locked before the accounts, in the same order as by the other order tasks (see 'lockorder')
+        orders = list(Order.locks(**fields).order_by('pk'))
+        if not orders:
+            return []
+
+        accounts = lockaccounts(owner_id=user_pk, currencies=pair.split("_"))
+
+        amounts = {}
+        for order in orders:
+            amounts[order.from_currency] = amounts.get(order.from_currency, 0) + order.from_amount
+            order.status = constants.ORDER_CANCELED
+
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(status=constants.ORDER_CANCELED)
+
+        for currency, amount in amounts.items():
+            account = accounts[currency]
+            account.amount += amount
+            account.frozen -= amount
+            Account.update(pk=account.pk, amount=account.amount, frozen=account.frozen)
+
+        # Update doesn't send 'post_save', books and offers are notified as after flush.
+        orders_flushed.send(sender=Order, orders=orders)
+
+        return order_serializer.serialize_many(orders)
+
+    try:
+        with book.atomic():
+            with publishment.atomic():
+                with transaction.atomic():
+                    set_timeouts()
+                    return do()
+    except OperationalError as e:
+        raise self.retry_db(e)
+
+
+@shared_task
+def join_results(results):
+    """
+        Concatenate the lists which were returned by the tasks of the group.
+    """
+    return [item for result in results for item in result]
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
@@ -128,36 +312,42 @@ def lock_order(self, *args, **kwargs):
             order.status = constants.ORDER_LOCKED
             order.save()
 
-            return OrderSerializer(order).data
+            return order_serializer.serialize(order)
         else:
             raise LockFailureError("Can't lock order in status {}".format(order.status))
 
     try:
-        with publishment.atomic():
-            with transaction.atomic():
-                return do()
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+        with book.atomic():
+            with publishment.atomic():
+                with transaction.atomic():
+                    set_timeouts()
+                    return do()
+    except OperationalError as e:
+        raise self.retry_db(e)
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
 def unlock_order(self, *args, **kwargs):
     def do():
-        with lockorder(pk=kwargs['order_pk']) as order:
-            if order.status == constants.ORDER_LOCKED:
-                order.status = constants.ORDER_INIT
+        with flush.atomic():
+            with lockorder(pk=kwargs['order_pk']) as order:
+                if order.status == constants.ORDER_LOCKED:
+                    order.status = constants.ORDER_INIT
+                    history = order.process()
 
-                return [OrderSerializer(e).data for e in order.process()]
+                else:
+                    raise UnlockFailureError("Can't unlock not locked order")
 
-            else:
-                raise UnlockFailureError("Can't unlock not locked order")
+        return order_serializer.serialize_many(history)
 
     try:
-        with publishment.atomic():
-            with transaction.atomic():
-                return do()
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+        with book.atomic():
+            with publishment.atomic():
+                with transaction.atomic():
+                    set_timeouts()
+                    return do()
+    except OperationalError as e:
+        raise self.retry_db(e)
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
@@ -175,13 +365,15 @@ def approve_order(self, *args, **kwargs):
                     else:
                         order.merge(opposite)
 
-        return OrderSerializer(order).data
+        return order_serializer.serialize(order)
 
     try:
-        with transaction.atomic():
-            return do()
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+        with book.atomic():
+            with transaction.atomic():
+                set_timeouts()
+                return do()
+    except OperationalError as e:
+        raise self.retry_db(e)
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
@@ -204,15 +396,17 @@ def update_order(self, *args, **kwargs):
             else:
                 raise UpdateFailureError("Can't update orders in status '{}'".format(order.status))
 
-        return OrderSerializer(order).data
+        return order_serializer.serialize(order)
 
     try:
-        with publishment.atomic():
-            with transaction.atomic():
-                return do()
+        with book.atomic():
+            with publishment.atomic():
+                with transaction.atomic():
+                    set_timeouts()
+                    return do()
 
-    except OperationalError:
-        raise self.retry(countdown=constants.CELERY_RETRY_COUNTDOWN)
+    except OperationalError as e:
+        raise self.retry_db(e)
 
 
 @shared_task(bind=True, max_retries=constants.CELERY_MAX_RETRIES, base=get_base_class())
@@ -228,60 +422,50 @@ def create_account(self, *args, **kwargs):
 
         try:
             obj = Account.objects.filter(owner_id=user_pk, currency=currency).all()[0]
-            data = AccountSerializer(obj).data
+            data = account_serializer.serialize(obj)
             raise AlreadyExistError(data)
 
         except IndexError:
             with transaction.atomic():
                 account = AccountPool(currency).assign_account(user_pk=user_pk)
-                return AccountSerializer(account).data
+                return account_serializer.serialize(account)
 
 
 @shared_task(bind=True, base=get_base_class())
 def calculate_market_info(self, *args, **kwargs):
-    with publishment.atomic():
-        with transaction.atomic():
+    """
+        24h stats are read from the 1m candles (see 'Candle'), so the cost of the task doesn't depend on the trading
+        volume. Candle is counted only if it is started inside of the window.
+    """
+    day_ago = timezone.now() - timedelta(hours=constants.MARKET_INFO_DELTA)
+    stats = Candle.stats(since=day_ago)
 
-            for pair in constants.AVAILABLE_CURRENCY_PAIRS:
-                info = MarketInfo()
-                info.pair = pair
-
-                # 1. Get orders for the last 24h.
-                day_ago = timezone.now() - timedelta(hours=constants.MARKET_INFO_DELTA)
-                orders_24h = Order.objects.filter(status=constants.ORDER_COMPLETED,
-                                                  pair=pair,
-                                                  created__gte=day_ago).all()
+    with publishment.atomic():
+        for pair in constants.AVAILABLE_CURRENCY_PAIRS:
+            info = MarketInfo()
+            info.pair = pair
 
-                rate_24h_max = 0
-                rate_24h_min = 0
-                volume_24h = 0
-                if orders_24h:
-                    rates = [order.price for order in orders_24h]
+            info.rate_24h_max, info.rate_24h_min, volume = stats.get(pair, (0, 0, 0))
 
-                    # 2. Get max rate.
-                    rate_24h_max = max(rates)
+            # Public volume is the sum of the completed orders, every trade completes two orders with its total
+            info.volume_24h = 2 * volume
 
-                    # 3. Get min rate.
-                    rate_24h_min = min(rates)
+            # Average price of the last trades
+            prices = list(Trade.objects.filter(pair=pair)
+                          .values_list('price', flat=True)[:constants.MARKET_INFO_COUNT_OF_EXCHANGES])
 
-                    # 4. Calculate the market volume.
-                    volume_24h = sum((order.total for order in orders_24h))
+            info.rate = sum(prices) / len(prices) if prices else 0
+            info.save()
 
-                info.rate_24h_max = rate_24h_max
-                info.rate_24h_min = rate_24h_min
-                info.volume_24h = volume_24h
 
-                # 5. Get the last completed orders
-                last_orders = Order.objects.filter(status=constants.ORDER_COMPLETED,
-                                                   pair=pair).all()[:constants.MARKET_INFO_COUNT_OF_EXCHANGES]
+@shared_task(bind=True, base=get_base_class())
+def rollup_candles(self, *args, **kwargs):
+    Candle.rollup_all()
 
-                average_price = 0
-                if last_orders:
-                    # 6. Calculate average price
-                    average_price = sum([order.price for order in last_orders]) / len(last_orders)
 
-                info.rate = average_price
-                info.save()
+@shared_task(bind=True, base=get_base_class())
+def downsample_market_info(self, *args, **kwargs):
+    return MarketInfo.downsample(timezone.now())
 
 
 @shared_task(bind=True, base=get_base_class())
@@ -297,3 +481,19 @@ def pregenerate_accounts(self, *args, **kwargs):
                 account = pool.create_account()
                 account.save()
                 count -= 1
+
+
+@shared_task(bind=True, base=get_base_class())
+def fold_balances(self, *args, **kwargs):
+    """
+        Fold the balance journal into the account snapshots, accounts which are locked right now are skipped - they
+        will be folded by the lock owner or by the next run.
+    """
+    with transaction.atomic():
+        accounts = Account.objects.raw('SELECT * FROM absortium_account '
+                                       'WHERE id IN (SELECT DISTINCT account_id FROM absortium_balanceentry) '
+                                       'ORDER BY id '
+                                       'LIMIT %s '
+                                       'FOR UPDATE SKIP LOCKED', [constants.BALANCE_FOLD_BATCH_SIZE])
+
+        Account.fold(list(accounts))
@@ -19,6 +19,12 @@ AVAILABLE_ORDER_STATUSES = [
     ORDER_LOCKED
 ]
 
+# Orders in these statuses are in the book (offers).
+ORDER_OPEN_STATUSES = [
+    ORDER_INIT,
+    ORDER_PENDING
+]
+
 ORDER_SELL = 'sell'
 ORDER_BUY = 'buy'
 AVAILABLE_ORDER_TYPES = [
@@ -38,8 +44,42 @@ AVAILABLE_CURRENCIES = [
     ETH
 ]
 
+MATCHING_ENGINE_SQL = 'sql'
+MATCHING_ENGINE_BOOK = 'book'
+AVAILABLE_MATCHING_ENGINES = [
+    MATCHING_ENGINE_SQL,
+    MATCHING_ENGINE_BOOK
+]
+
+# How many opposite orders are claimed by one select in 'sql' matching engine.
+ORDER_MATCHING_BATCH_SIZE = 10
+
+# How many orders may be created by one batch request.
+ORDER_BATCH_MAX_SIZE = 100
+
+# Orders in these statuses are canceled by the mass cancel.
+ORDER_CANCELABLE_STATUSES = [
+    ORDER_INIT,
+    ORDER_PENDING,
+    ORDER_LOCKED
+]
+
+# How many accounts are folded by one run of the balance journal compaction.
+BALANCE_FOLD_BATCH_SIZE = 100
+
+CELERY_PAIR_QUEUE = 'absortium_{pair}'
+# Retries of the tasks which failed on the db error, see 'absortium.celery.base'. Countdown (seconds) grows
+# exponentially from CELERY_RETRY_COUNTDOWN up to CELERY_RETRY_MAX_COUNTDOWN and is multiplied by the contention of
+# the pair (count of the recent retries, halved every CELERY_CONTENTION_HALF_LIFE seconds).
 CELERY_RETRY_COUNTDOWN = 0.1
-CELERY_MAX_RETRIES = 1000
+CELERY_RETRY_MAX_COUNTDOWN = 5
+CELERY_CONTENTION_HALF_LIFE = 10
+CELERY_CONTENTION_MAX_SCORE = 10
+CELERY_MAX_RETRIES = 50
+
+# Milliseconds, tasks fail (and retry) rather than wait on the locks.
+DB_LOCK_TIMEOUT = 2000
+DB_STATEMENT_TIMEOUT = 10000
 
 POLONIEX_OFFER_MODIFIED = "orderBookModify"
 POLONIEX_OFFER_REMOVED = "orderBookRemove"
@@ -59,6 +99,61 @@ USERNAME_LENGTH = 30
 MARKET_INFO_DELTA = 24
 MARKET_INFO_COUNT_OF_EXCHANGES = 10
 
+# Max number of market info snapshots which could be returned by one request.
+MARKET_INFO_MAX_COUNT = 1000
+
+# Market info retention: snapshots older than the age (hours) are downsampled to the last snapshot of the pair in
+# every period (seconds). Snapshots are deleted by batches of MARKET_INFO_RETENTION_BATCH_SIZE.
+MARKET_INFO_RETENTION = [
+    (24, 60 * 60),
+    (30 * 24, 24 * 60 * 60),
+]
+MARKET_INFO_RETENTION_BATCH_SIZE = 1000
+
+CANDLE_1M = '1m'
+CANDLE_5M = '5m'
+CANDLE_1H = '1h'
+CANDLE_1D = '1d'
+
+# Candle resolutions and their length in seconds, in the order of rollup - 1m candles are filled from the trades,
+# every next resolution is calculated from the previous one.
+CANDLE_RESOLUTIONS = [
+    (CANDLE_1M, 60),
+    (CANDLE_5M, 5 * 60),
+    (CANDLE_1H, 60 * 60),
+    (CANDLE_1D, 24 * 60 * 60),
+]
+AVAILABLE_CANDLE_RESOLUTIONS = [resolution for resolution, _ in CANDLE_RESOLUTIONS]
+
+# Max number of the source candles of the pair which are rolled up by one run, so that the first run (or the run
+# after the long break) doesn't recalculate the whole history with one statement. Should be more than the number of
+# the source candles in one target period.
+CANDLE_ROLLUP_BATCH_SIZE = 1000
+
+# Max number of candles which could be returned by one request.
+CANDLES_MAX_COUNT = 1000
+
+# Crossbar HTTP bridge client: seconds to connect/to wait for the response, max number of kept connections.
+ROUTER_CONNECT_TIMEOUT = 1
+ROUTER_READ_TIMEOUT = 5
+ROUTER_POOL_SIZE = 10
+
+# Publications outbox: how many publications dispatcher takes at once, seconds after which the publication which
+# can't be sent is dropped, seconds to wait when outbox is empty, max seconds to wait when router fails (wait is
+# doubled on every failed dispatch).
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_AGE = 10 * 60
+OUTBOX_IDLE_SLEEP = 0.1
+OUTBOX_MAX_SLEEP = 30
+
+# Offers responses are cached until the sequence of the pair is changed (but not longer than timeout, seconds).
+OFFERS_CACHE_KEY = "offers_{pair}_{type}_{depth}"
+OFFERS_SNAPSHOT_CACHE_KEY = "offers_snapshot_{pair}"
+OFFERS_CACHE_TIMEOUT = 60
+
+# Max number of the levels of the one side which could be requested from the offers endpoint.
+OFFERS_MAX_DEPTH = 1000
+
 TOPIC_OFFERS = "offers_{pair}_{type}"
 TOPIC_HISTORY = "history_{pair}_{type}"
 TOPIC_MARKET_INFO = "marketinfo"
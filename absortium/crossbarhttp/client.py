@@ -3,10 +3,14 @@ import datetime
 import hashlib
 import hmac
 import json
+import threading
 from random import randint
-from urllib.error import HTTPError, URLError
 from urllib.parse import urlencode
-from urllib.request import Request, urlopen
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from absortium import constants
 
 
 class ClientBaseException(Exception):
@@ -59,13 +63,17 @@ class ClientCallRuntimeError(ClientBaseException):
 
 
 class Client(object):
-    def __init__(self, url, key=None, secret=None, verbose=False):
+    def __init__(self, url, key=None, secret=None, verbose=False,
+                 timeout=(constants.ROUTER_CONNECT_TIMEOUT, constants.ROUTER_READ_TIMEOUT),
+                 pool_size=constants.ROUTER_POOL_SIZE):
         """
-        Creates a client to connect to the HTTP bridge services
+        Creates a client to connect to the HTTP bridge services, connections are kept alive and reused
         :param url: The URL to connect to to access the Crossbar
         :param key: The key for the API calls
         :param secret: The secret for the API calls
         :param verbose: True if you want debug messages printed
+        :param timeout: The (connect, read) timeout in seconds
+        :param pool_size: The max number of the kept connections
         :return: Nothing
         """
         assert url is not None
@@ -74,7 +82,21 @@ class Client(object):
         self.key = key
         self.secret = secret
         self.verbose = verbose
+        self.timeout = timeout
+
         self.sequence = 1
+        self._sequence_lock = threading.Lock()
+
+        # Signature of every request starts with the key, so hmac state after the key is computed once
+        self._hmac = None
+        if key is not None and secret is not None:
+            self._hmac = hmac.new(to_bytes(secret), to_bytes(key), hashlib.sha256)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
 
     def publish(self, topic, *args, **kwargs):
         """
@@ -95,6 +117,14 @@ class Client(object):
         response = self._make_api_call("POST", self.url, json_params=params)
         return response["id"]
 
+    def publish_many(self, publications):
+        """
+        Publishes the list of (topic, kwargs) to the bridge service, HTTP bridge accepts one publication per request
+        :param publications: The list of (topic, kwargs)
+        :return: The IDs of the publishes
+        """
+        return [self.publish(topic, **kwargs) for topic, kwargs in publications]
+
     def call(self, procedure, *args, **kwargs):
         """
         Calls a procedure from the bridge service
@@ -126,7 +156,13 @@ class Client(object):
 
         return value
 
-    def _compute_signature(self, body):
+    def _next_sequence(self):
+        with self._sequence_lock:
+            sequence = self.sequence
+            self.sequence += 1
+            return sequence
+
+    def _compute_signature(self, body, sequence):
         """
         Computes the signature.
 
@@ -143,11 +179,10 @@ class Client(object):
         nonce = randint(0, 2 ** 53)
 
         # Compute signature: HMAC[SHA256]_{secret} (key | timestamp | seq | nonce | body) => signature
-        hm = hmac.new(self.secret, None, hashlib.sha256)
-        hm.update(self.key)
-        hm.update(timestamp)
-        hm.update(str(self.sequence))
-        hm.update(str(nonce))
+        hm = self._hmac.copy()
+        hm.update(to_bytes(timestamp))
+        hm.update(to_bytes(str(sequence)))
+        hm.update(to_bytes(str(nonce)))
         hm.update(body)
         signature = base64.urlsafe_b64encode(hm.digest())
 
@@ -164,22 +199,21 @@ class Client(object):
         if self.verbose is True:
             print("\ncrossbarhttp: Request: %s %s" % (method, url))
 
+        encoded_params = None
         if json_params is not None:
-            encoded_params = json.dumps(json_params)
-            encoded_params = encoded_params.encode()
-            headers = {'Content-Type': 'application/json'}
-        else:
-            encoded_params = None
-            headers = {}
+            encoded_params = json.dumps(json_params).encode()
 
         if encoded_params is not None and self.verbose is True:
-            print("crossbarhttp: Params: " + encoded_params)
+            print("crossbarhttp: Params: " + encoded_params.decode())
+
+        # TODO: I can't figure out what this is.  Guessing it is a number you increment on every exec
+        sequence = self._next_sequence()
 
-        if self.key is not None and self.secret is not None and encoded_params is not None:
-            signature, nonce, timestamp = self._compute_signature(encoded_params)
+        if self._hmac is not None and encoded_params is not None:
+            signature, nonce, timestamp = self._compute_signature(encoded_params, sequence)
             params = urlencode({
                 "timestamp": timestamp,
-                "seq": str(self.sequence),
+                "seq": str(sequence),
                 "nonce": nonce,
                 "signature": signature,
                 "key": self.key
@@ -188,44 +222,56 @@ class Client(object):
                 print("crossbarhttp: Signature Params: " + params)
             url += "?" + params
 
-        # TODO: I can't figure out what this is.  Guessing it is a number you increment on every exec
-        self.sequence += 1
-
         try:
-            request = Request(url, data=encoded_params, headers=headers)
-            request.get_method = lambda: method
-            response = urlopen(request).read().decode()
-            if self.verbose is True:
-                print("crossbarhttp: Response: " + response)
+            response = self.session.request(method, url, data=encoded_params, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ClientBadHost(str(e))
 
-            return json.loads(response)
+        if response.status_code == 400:
+            raise ClientMissingParams(response.reason)
+        elif response.status_code == 401:
+            raise ClientSignatureError(response.reason)
+        elif response.status_code >= 400:
+            raise ClientBadUrl("HTTP Error {}: {}".format(response.status_code, response.reason))
 
+        if self.verbose is True:
+            print("crossbarhttp: Response: " + response.text)
+
+        return response.json()
 
-        except HTTPError as e:
-            if e.code == 400:
-                raise ClientMissingParams(str(e))
-            elif e.code == 401:
-                raise ClientSignatureError(str(e))
-            else:
-                raise ClientBadUrl(str(e))
-        except URLError as e:
-            raise ClientBadHost(str(e))
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
 
 
 from django.conf import settings
 
 client = None
+client_lock = threading.Lock()
 
 
 def get_crossbar_client(*args, **kwargs):
-    url = settings.ROUTER_URL
-
+    """
+        Client which is used for the publications, outbox one if 'ROUTER_OUTBOX' is enabled.
+    """
     global client
     if client is None:
-        client = Client(url, *args, **kwargs)
+        with client_lock:
+            if client is None:
+                if settings.ROUTER_OUTBOX:
+                    from absortium.crossbarhttp.outbox import OutboxClient
+                    client = OutboxClient()
+                else:
+                    client = get_router_client(*args, **kwargs)
     return client
 
 
+def get_router_client(*args, **kwargs):
+    return Client(settings.ROUTER_URL, *args, **kwargs)
+
+
 def set_crossbar_client(c):
     global client
     client = c
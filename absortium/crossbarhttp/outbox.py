@@ -0,0 +1,93 @@
+__author__ = 'andrew.shvv@gmail.com'
+
+import json
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from absortium import constants
+from absortium.model.models import Publication
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+"""
+    Transactional outbox of the websocket publications:
+        1. 'OutboxClient' is used instead of the router client - publication is inserted in the current db
+        transaction, so it is sent only if changes are committed, and tasks don't wait for the router.
+        2. Dispatcher ('dispatchpublications' command) takes publications in the order of ids, sends them to the router
+        and deletes sent ones. Publication which failed is retried, and later publications of its topic wait for it.
+        While router fails, dispatcher waits longer and longer (see 'backoff'), publication which can't be sent for
+        OUTBOX_MAX_AGE is dropped.
+
+    Publications of one topic are written by one worker process (topics are per pair, pairs are per queue, see
+    'celery/routers.py' - every order task, including the mass cancel, goes to the queue of its pair), so ids of the
+    topic are committed in their order.
+
+    WARNING: Only one dispatcher should run, otherwise publications of the topic may be sent out of order. Dispatcher
+    takes the advisory lock, so the second one just waits.
+"""
+
+DISPATCHER_LOCK = 0x6f7574626f78
+
+
+class OutboxClient():
+    # Publications are written to the db, so they are written inside of the 'publishment.atomic' transaction.
+    transactional = True
+
+    def publish(self, topic, **publishment):
+        Publication(topic=topic, data=json.dumps(publishment, cls=DjangoJSONEncoder)).save()
+
+    def publish_many(self, publications):
+        Publication.objects.bulk_create([Publication(topic=topic, data=json.dumps(publishment, cls=DjangoJSONEncoder))
+                                         for topic, publishment in publications])
+
+
+def lock_dispatcher():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(%s)', [DISPATCHER_LOCK])
+
+
+def dispatch(client, size=constants.OUTBOX_BATCH_SIZE, now=None):
+    """
+        Send the next batch of publications with the router client, return count of the done (sent or dropped as
+        older than OUTBOX_MAX_AGE) and failed ones.
+    """
+    now = timezone.now() if now is None else now
+    publications = list(Publication.objects.order_by('pk')[:size])
+
+    sent = []
+    failed = []
+    blocked = set()
+
+    for publication in publications:
+        if publication.topic in blocked:
+            continue
+
+        try:
+            client.publish(publication.topic, **json.loads(publication.data))
+        except Exception as e:
+            logger.error("Publication {} to '{}' failed: {}".format(publication.pk, publication.topic, e))
+
+            if now - publication.created >= timedelta(seconds=constants.OUTBOX_MAX_AGE):
+                # Router is not the source of truth, client will detect the gap in the sequence and resync
+                sent.append(publication.pk)
+            else:
+                failed.append(publication.pk)
+                blocked.add(publication.topic)
+        else:
+            sent.append(publication.pk)
+
+    if sent:
+        Publication.objects.filter(pk__in=sent).delete()
+
+    return len(sent), len(failed)
+
+
+def backoff(failures):
+    """
+        Seconds to wait before the next dispatch after the given number of the failed dispatches in a row.
+    """
+    return min(constants.OUTBOX_IDLE_SLEEP * 2 ** min(failures, 32), constants.OUTBOX_MAX_SLEEP)
@@ -1,31 +1,140 @@
 __author__ = 'andrew.shvv@gmail.com'
 
+import sys
+
+from django.db import transaction
+
+from absortium import constants
 from absortium.crossbarhttp.client import set_crossbar_client, get_crossbar_client
+from absortium.model.models import BookSequence
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+"""
+    Publications which are made inside of the 'atomic' block are coalesced by the topic semantics:
+        1. Offers - only the last state of the price level matters, so the later publication of the same level
+        replaces the earlier one (in its place).
+        2. Everything else (history, market info) - appended as is.
+
+    Offers publications which are left after coalescing are numbered by the outermost block with the sequence of
+    their pair, inside of its transaction and without gaps, so that client may detect the missed publication and
+    resync with the snapshot.
+"""
+
+# topic prefix -> publication field which, together with the topic, identifies the replaceable publication
+COALESCED_TOPICS = {
+    constants.TOPIC_OFFERS.split('{')[0]: 'price',
+}
+
+
+def get_key(topic, publishment):
+    for prefix, field in COALESCED_TOPICS.items():
+        if topic.startswith(prefix) and field in publishment:
+            return topic, publishment[field]
+
+    return None
+
+
+def sequence(publications):
+    """
+        Set the next number of the pair sequence to every offers publication.
+    """
+    prefix = constants.TOPIC_OFFERS.split('{')[0]
+    offers = [publishment for topic, publishment in publications
+              if topic.startswith(prefix) and 'pair' in publishment]
+
+    counts = {}
+    for publishment in offers:
+        counts[publishment['pair']] = counts.get(publishment['pair'], 0) + 1
+
+    numbers = {pair: BookSequence.next(pair, count) for pair, count in sorted(counts.items())}
+
+    for publishment in offers:
+        publishment['sequence'] = numbers[publishment['pair']]
+        numbers[publishment['pair']] += 1
+
+
+def publish_many(client, publications):
+    """
+        Publish the list of (topic, publishment) with one call if client is able to do so.
+    """
+    if hasattr(client, 'publish_many'):
+        client.publish_many(publications)
+    else:
+        for topic, publishment in publications:
+            client.publish(topic, **publishment)
 
 
 class atomic:
     """
         Replace real client with mock one and consume all publishments which was made during block execution. Then
-        if exceptions was not raised - publish them with real client.
+        if exceptions was not raised - publish coalesced publishments with real client at once.
+
+        Outermost block is the db transaction as well, so that offers are numbered (see 'sequence') in the same
+        transaction as the changes they describe - failure of the numbering rolls back the changes, and nothing is
+        written after the changes are committed. If real client writes publications to the db (outbox), they are
+        committed together with the changes, otherwise they are sent after the commit and failure of the router
+        doesn't fail the committed block.
     """
 
-    topics = None
+    publications = None
+    keys = None
     client = None
+    transaction = None
 
     def __enter__(self):
-        self.topics = {}
+        self.publications = []
+        self.keys = {}
         self.client = get_crossbar_client()
+
+        if not isinstance(self.client, atomic):
+            self.transaction = transaction.atomic()
+            self.transaction.__enter__()
+
         set_crossbar_client(self)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None:
-            for topic, publishments in self.topics.items():
-                for publishment in publishments:
-                    self.client.publish(topic, **publishment)
-
         set_crossbar_client(self.client)
 
+        if self.transaction is None:
+            # Nested block, publications go to the outer one
+            if exc_type is None and self.publications:
+                publish_many(self.client, self.publications)
+            return
+
+        transactional = getattr(self.client, 'transactional', False)
+
+        try:
+            if exc_type is None and self.publications:
+                sequence(self.publications)
+
+                if transactional:
+                    publish_many(self.client, self.publications)
+        except Exception:
+            self.transaction.__exit__(*sys.exc_info())
+            raise
+
+        self.transaction.__exit__(exc_type, exc_val, exc_tb)
+
+        if exc_type is None and self.publications and not transactional:
+            try:
+                publish_many(self.client, self.publications)
+            except Exception as e:
+                # Router is not the source of truth, client will detect the gap in the sequence and resync
+                logger.error("Publications are not sent: {}".format(e))
+
     def publish(self, topic, **publishment):
-        if not topic in self.topics:
-            self.topics[topic] = []
-        self.topics[topic].append(publishment)
+        key = get_key(topic, publishment)
+
+        if key is not None and key in self.keys:
+            self.publications[self.keys[key]] = (topic, publishment)
+        else:
+            if key is not None:
+                self.keys[key] = len(self.publications)
+
+            self.publications.append((topic, publishment))
+
+    def publish_many(self, publications):
+        for topic, publishment in publications:
+            self.publish(topic, **publishment)
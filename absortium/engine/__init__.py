@@ -0,0 +1 @@
+__author__ = 'andrew.shvv@gmail.com'
@@ -0,0 +1,241 @@
+import bisect
+
+from absortium import constants
+from core.utils.logging import getLogger
+
+__author__ = 'andrew.shvv@gmail.com'
+
+logger = getLogger(__name__)
+
+"""
+    Resident order book: for every pair we keep all open ('init', 'pending') orders in memory as price levels with
+    time-priority queues, so that matching pass may find all counter-orders it needs without asking the db for them
+    one by one.
+
+    Book is only an index, db is still the source of truth:
+        1. Book is lazily built from 'absortium_order' on first access (or on worker start, see celery/app.py).
+        2. Every order save is reflected in the book by the 'order_post_save' signal.
+        3. If transaction fails inside the 'atomic' block, books which were changed inside it are dropped and will
+        be rebuilt on the next access.
+
+    WARNING: Book is consistent only if all matching of the pair is done in one process, otherwise use 'sql' engine.
+"""
+
+OPEN_STATUSES = constants.ORDER_OPEN_STATUSES
+
+
+class BookOrder:
+    __slots__ = ('pk', 'owner_id', 'type', 'price', 'amount', 'created')
+
+    def __init__(self, pk, owner_id, type, price, amount, created):
+        self.pk = pk
+        self.owner_id = owner_id
+        self.type = type
+        self.price = price
+        self.amount = amount
+        self.created = created
+
+    @property
+    def key(self):
+        return self.created, self.pk
+
+
+class Level:
+    """
+        Orders with the same price, ordered by creation time.
+    """
+
+    __slots__ = ('price', 'keys', 'orders')
+
+    def __init__(self, price):
+        self.price = price
+        self.keys = []
+        self.orders = {}
+
+    def add(self, order):
+        bisect.insort(self.keys, order.key)
+        self.orders[order.pk] = order
+
+    def remove(self, order):
+        i = bisect.bisect_left(self.keys, order.key)
+        del self.keys[i]
+        del self.orders[order.pk]
+
+    def __iter__(self):
+        for _, pk in self.keys:
+            yield self.orders[pk]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class Side:
+    """
+        All price levels of the one order type.
+    """
+
+    def __init__(self, order_type):
+        self.type = order_type
+        self.prices = []
+        self.levels = {}
+
+    def add(self, order):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = Level(order.price)
+            self.levels[order.price] = level
+            bisect.insort(self.prices, order.price)
+
+        level.add(order)
+
+    def remove(self, order):
+        level = self.levels[order.price]
+        level.remove(order)
+
+        if not len(level):
+            del self.levels[order.price]
+            del self.prices[bisect.bisect_left(self.prices, order.price)]
+
+    def crossing(self, price):
+        """
+            Iterate over levels which may be matched with order of the opposite type with given price, best level first:
+                sell side - from the lowest price up to the 'price'.
+                buy side - from the highest price down to the 'price'.
+        """
+        if self.type == constants.ORDER_SELL:
+            for i in range(bisect.bisect_right(self.prices, price)):
+                yield self.levels[self.prices[i]]
+
+        elif self.type == constants.ORDER_BUY:
+            for i in reversed(range(bisect.bisect_left(self.prices, price), len(self.prices))):
+                yield self.levels[self.prices[i]]
+
+
+class OrderBook:
+    def __init__(self, pair):
+        self.pair = pair
+        self.orders = {}
+        self.sides = {order_type: Side(order_type) for order_type in constants.AVAILABLE_ORDER_TYPES}
+
+    @staticmethod
+    def load(pair):
+        from absortium.model.models import Order
+
+        book = OrderBook(pair)
+
+        orders = Order.objects.filter(pair=pair, status__in=OPEN_STATUSES) \
+            .values_list('pk', 'owner_id', 'type', 'price', 'amount', 'created')
+
+        for values in orders:
+            book.add(BookOrder(*values))
+
+        logger.debug("Book '{}' is loaded with {} orders".format(pair, len(book)))
+        return book
+
+    def add(self, order):
+        self.orders[order.pk] = order
+        self.sides[order.type].add(order)
+
+    def remove(self, pk):
+        order = self.orders.pop(pk, None)
+        if order is not None:
+            self.sides[order.type].remove(order)
+
+    def sync(self, order):
+        """
+            Reflect the state of the saved 'Order' model instance in the book.
+        """
+        self.remove(order.pk)
+
+        if order.status in OPEN_STATUSES:
+            self.add(BookOrder(pk=order.pk,
+                               owner_id=order.owner_id,
+                               type=order.type,
+                               price=order.price,
+                               amount=order.amount,
+                               created=order.created))
+
+    def candidates(self, order, exclude=()):
+        """
+            Return primary keys of the counter-orders, in price-time priority, which are needed to fill the order.
+        """
+        pks = []
+        amount = 0
+
+        for level in self.sides[order.opposite_type].crossing(order.price):
+            for opposite in level:
+                if opposite.owner_id == order.owner_id or opposite.pk in exclude:
+                    continue
+
+                pks.append(opposite.pk)
+                amount += opposite.amount
+
+                if amount >= order.amount:
+                    return pks
+
+        return pks
+
+    def __len__(self):
+        return len(self.orders)
+
+
+books = {}
+guards = []
+
+
+def touch(pair):
+    for guard in guards:
+        guard.pairs.add(pair)
+
+
+def get_book(pair):
+    book = books.get(pair)
+
+    if book is None:
+        book = OrderBook.load(pair)
+        books[pair] = book
+
+    # Book might be loaded with uncommitted changes of the current transaction
+    touch(pair)
+    return book
+
+
+def sync(order):
+    book = books.get(order.pair)
+
+    if book is not None:
+        book.sync(order)
+        touch(order.pair)
+
+
+def invalidate(pair):
+    books.pop(pair, None)
+
+
+def load_all():
+    for pair in constants.AVAILABLE_CURRENCY_PAIRS:
+        books[pair] = OrderBook.load(pair)
+
+
+def clear():
+    books.clear()
+
+
+class atomic:
+    """
+        Drop books which were changed during block execution if exception was raised, because changes of the
+        rolled back transaction are already in them.
+    """
+
+    pairs = None
+
+    def __enter__(self):
+        self.pairs = set()
+        guards.append(self)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        guards.remove(self)
+
+        if exc_type is not None:
+            for pair in self.pairs:
+                invalidate(pair)
@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from absortium.model import ledger
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+__author__ = 'andrew.shvv@gmail.com'
+
+
+class Command(BaseCommand):
+    help = 'Verify that snapshot plus journal of every account is equal to the balance calculated from the orders, ' \
+           'trades, deposits and withdrawals, print mismatches as json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', type=int, action='append', default=None, help='Check only accounts of the user')
+
+    def handle(self, *args, **options):
+        mismatches = ledger.check(owner_ids=options['owner'])
+
+        self.stdout.write(json.dumps(mismatches, indent=4, sort_keys=True, default=str))
+
+        if mismatches:
+            raise CommandError("{} account(s) mismatch".format(len(mismatches)))
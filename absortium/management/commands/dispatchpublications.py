@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from absortium import constants
+from absortium.crossbarhttp import outbox
+from absortium.crossbarhttp.client import get_router_client
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+__author__ = 'andrew.shvv@gmail.com'
+
+
+class Command(BaseCommand):
+    help = 'Send publications from the outbox to the router, in order, until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=constants.OUTBOX_BATCH_SIZE,
+                            help='Number of publications taken from the outbox at once')
+        parser.add_argument('--once', action='store_true', help='Dispatch until nothing could be sent and exit')
+
+    def handle(self, *args, **options):
+        client = get_router_client()
+
+        outbox.lock_dispatcher()
+        logger.info("Dispatcher is started")
+
+        # Dispatches in a row which failed without sending anything
+        failures = 0
+
+        while True:
+            done, failed = outbox.dispatch(client, size=options['batch'])
+
+            if not done and options['once']:
+                break
+
+            if failed and not done:
+                failures += 1
+                time.sleep(outbox.backoff(failures))
+            else:
+                failures = 0
+
+                if failed or done < options['batch']:
+                    time.sleep(constants.OUTBOX_IDLE_SLEEP)
@@ -0,0 +1,214 @@
+import json
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from absortium import constants
+from absortium.celery import tasks
+from absortium.engine import book
+from absortium.management import inprocess
+from absortium.model.models import Order
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+__author__ = 'andrew.shvv@gmail.com'
+
+TICK = Decimal("0.00001")
+DEFAULT_BALANCE = Decimal("1000000")
+
+PRICE_UNIFORM = 'uniform'
+PRICE_NORMAL = 'normal'
+AVAILABLE_PRICE_DISTRIBUTIONS = [
+    PRICE_UNIFORM,
+    PRICE_NORMAL
+]
+
+
+class Flow():
+    """
+        Synthetic order flow: book is filled with 'depth' resting orders on both sides of the 'mid' price, then
+        orders are created (crossing the spread with the 'crossing' probability) and canceled at random.
+    """
+
+    def __init__(self, users, depth, crossing, cancel, distribution, mid, spread, width, seed):
+        self.users = users
+        self.depth = depth
+        self.crossing = crossing
+        self.cancel = cancel
+        self.distribution = distribution
+        self.mid = mid
+        self.spread = spread
+        self.width = width
+        self.random = random.Random(seed)
+
+        # pk -> user of orders which were not touched by matching yet
+        self.open = {}
+
+    def offset(self):
+        if self.distribution == PRICE_UNIFORM:
+            offset = self.random.uniform(0, self.width)
+        else:
+            offset = abs(self.random.gauss(0, self.width / 2))
+
+        return Decimal(offset).quantize(TICK)
+
+    def price(self, order_type, crossing):
+        """
+            Resting orders are put on the own side of the spread, crossing ones beyond the other side.
+        """
+        half = self.spread / 2
+
+        if (order_type == constants.ORDER_BUY) == crossing:
+            price = self.mid + half + self.offset()
+        else:
+            price = self.mid - half - self.offset()
+
+        return max(price, TICK)
+
+    def order(self, crossing):
+        order_type = self.random.choice(constants.AVAILABLE_ORDER_TYPES)
+        return {
+            'user': self.random.choice(self.users),
+            'data': {
+                'type': order_type,
+                'price': str(self.price(order_type, crossing)),
+                'amount': str(Decimal(self.random.uniform(0.1, 10)).quantize(TICK)),
+                'pair': constants.PAIR_BTC_ETH,
+            }
+        }
+
+    def initial(self):
+        for _ in range(self.depth * len(constants.AVAILABLE_ORDER_TYPES)):
+            yield self.order(crossing=False)
+
+    def next(self):
+        if self.open and self.random.random() < self.cancel:
+            pk = self.random.choice(list(self.open))
+            return 'cancel', {'order_pk': pk, 'user': self.open.pop(pk)}
+        else:
+            return 'create', self.order(crossing=self.random.random() < self.crossing)
+
+
+class Command(BaseCommand):
+    help = 'Drive create/cancel order tasks with the synthetic order flow in the current process and report ' \
+           'throughput, latency, sql statements and retries as json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Number of operations of the order flow')
+        parser.add_argument('--users', type=int, default=10, help='Number of users who send orders')
+        parser.add_argument('--depth', type=int, default=100, help='Resting orders on every side before the flow')
+        parser.add_argument('--crossing', type=float, default=0.3, help='Probability that order crosses the spread')
+        parser.add_argument('--cancel', type=float, default=0.1, help='Probability that operation is cancel')
+        parser.add_argument('--distribution', default=PRICE_UNIFORM, choices=AVAILABLE_PRICE_DISTRIBUTIONS,
+                            help='Distribution of the price distance from the spread')
+        parser.add_argument('--mid', default="0.05", help='Middle price of the book')
+        parser.add_argument('--spread', default="0.001", help='Distance between best buy and best sell')
+        parser.add_argument('--width', type=float, default=0.01, help='Width of the price distribution')
+        parser.add_argument('--engine', default=None, choices=constants.AVAILABLE_MATCHING_ENGINES,
+                            help='Matching engine, settings.MATCHING_ENGINE by default')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch db rather than drop it')
+        parser.add_argument('--output', default=None, help='File for the json report, stdout by default')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['crossing'] <= 1 or not 0 <= options['cancel'] <= 1:
+            raise CommandError("'crossing' and 'cancel' should be probabilities")
+
+        engine = options['engine'] or settings.MATCHING_ENGINE
+        router = inprocess.setup()
+
+        # Every task commits its own transaction, as it does in the worker, so the commit cost is measured and
+        # concurrent claims really contend - this is why the flow runs in the scratch db.
+        with override_settings(MATCHING_ENGINE=engine):
+            with inprocess.scratch(keep=options['keep']) as name:
+                book.clear()
+
+                try:
+                    report = self.run(router, options)
+                finally:
+                    book.clear()
+
+        logger.debug("Scratch db '{}' is {}".format(name, "kept" if options['keep'] else "dropped"))
+
+        report['config'] = {k: options[k] for k in ['orders', 'users', 'depth', 'crossing', 'cancel',
+                                                    'distribution', 'mid', 'spread', 'width', 'seed']}
+        report['config']['engine'] = engine
+        report['revision'] = inprocess.get_revision()
+
+        output = json.dumps(report, indent=4, sort_keys=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def create(self, flow, operation):
+        history = tasks.create_order.apply(kwargs={'data': operation['data'],
+                                                   'user_pk': operation['user'].pk}).get()
+
+        # The last one is the taker itself
+        fills = 0
+        for order in history[:-1]:
+            if order['status'] == constants.ORDER_COMPLETED:
+                fills += 1
+
+        last = history[-1]
+        if last['status'] == constants.ORDER_INIT:
+            flow.open[last['pk']] = operation['user']
+
+        return fills
+
+    def cancel(self, flow, operation):
+        order = Order.objects.get(pk=operation['order_pk'])
+        if order.status not in [constants.ORDER_INIT, constants.ORDER_PENDING]:
+            # Order was filled after it had got into the flow
+            return None
+
+        tasks.cancel_order.apply(kwargs={'order_pk': order.pk, 'pair': order.pair}).get()
+
+    def run(self, router, options):
+        users = [inprocess.create_user("benchmark_{}".format(i), amount=DEFAULT_BALANCE)
+                 for i in range(options['users'])]
+
+        flow = Flow(users=users,
+                    depth=options['depth'],
+                    crossing=options['crossing'],
+                    cancel=options['cancel'],
+                    distribution=options['distribution'],
+                    mid=Decimal(options['mid']),
+                    spread=Decimal(options['spread']),
+                    width=options['width'],
+                    seed=options['seed'])
+
+        for operation in flow.initial():
+            self.create(flow, operation)
+
+        router.count = 0
+        fills = 0
+
+        with inprocess.Recorder() as recorder:
+            for _ in range(options['orders']):
+                name, operation = flow.next()
+
+                if name == 'create':
+                    fills += recorder.call(name, self.create, flow, operation) or 0
+                else:
+                    recorder.call(name, self.cancel, flow, operation)
+
+        report = recorder.report()
+        created = len(recorder.latencies.get('create', []))
+
+        report.update({
+            'orders': created,
+            'orders_per_sec': created / report['seconds'],
+            'fills': fills,
+            'fills_per_sec': fills / report['seconds'],
+            'publications': router.count,
+        })
+
+        return report
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+from absortium.crossbarhttp.client import Client
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+__author__ = 'andrew.shvv@gmail.com'
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    """
+        Stand-in of the crossbar HTTP bridge: accept the publication and answer with its id, keep connection alive.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with self.server.lock:
+            self.server.count += 1
+            body = json.dumps({"id": self.server.count}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args, **kwargs):
+        pass
+
+
+class Router(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RouterHandler)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    @property
+    def url(self):
+        return "http://{}:{}/publish".format(*self.server_address)
+
+
+class UrlopenClient():
+    """
+        Client as it was before the connection pool, kept to compare with: new connection on every publication.
+    """
+
+    def __init__(self, url):
+        self.url = url
+
+    def publish(self, topic, *args, **kwargs):
+        body = json.dumps({"topic": topic, "args": args, "kwargs": kwargs}).encode()
+        request = Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        request.get_method = lambda: "POST"
+        return json.loads(urlopen(request).read().decode())["id"]
+
+
+class Command(BaseCommand):
+    help = 'Measure publications per second to the local stand-in router (new connection per publish vs pool)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--publications', type=int, default=2000, help='Number of publications in one run')
+        parser.add_argument('--threads', type=int, default=1, help='Number of threads which share one client')
+
+    def measure(self, client, publications, threads):
+        publishment = {"pair": "btc_eth", "type": "buy", "price": "0.05000000", "amount": "1.00000000",
+                       "total": "0.05000000"}
+
+        def run(n):
+            for _ in range(n):
+                client.publish("offers_btc_eth_buy", **publishment)
+
+        workers = [threading.Thread(target=run, args=(publications // threads,)) for _ in range(threads)]
+
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return (publications // threads * threads) / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        router = Router()
+        thread = threading.Thread(target=router.serve_forever, daemon=True)
+        thread.start()
+
+        try:
+            for name, client in [('urlopen', UrlopenClient(router.url)), ('pool', Client(router.url))]:
+                rate = self.measure(client, options['publications'], options['threads'])
+                self.stdout.write("{name:>10}: {rate:10.1f} publications/sec".format(name=name, rate=rate))
+        finally:
+            router.shutdown()
+            router.server_close()
@@ -0,0 +1,226 @@
+import json
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from absortium import constants
+from absortium.celery import tasks
+from absortium.engine import book
+from absortium.management import inprocess
+from absortium.model.models import Account, Order, Trade
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+__author__ = 'andrew.shvv@gmail.com'
+
+"""
+    Replay of the recorded order operations, one json object per line:
+
+        {"op": "deposit", "user": 1, "currency": "btc", "amount": "10"}
+        {"op": "create", "user": 1, "ref": "a", "data": {"type": "buy", "pair": "btc_eth", "price": "0.1", "amount": "1"}}
+        {"op": "update", "ref": "a", "data": {"price": "0.2", "amount": "1"}}
+        {"op": "lock", "ref": "a"}
+        {"op": "unlock", "ref": "a"}
+        {"op": "approve", "ref": "a"}
+        {"op": "cancel", "ref": "a"}
+
+    'user' is the id of the user in the recorded stream, users are created on the first appearance. 'ref' is the
+    id of the order in the recorded stream, it is bound to the order created by the 'create' operation with the same
+    'ref' (operations may also point to the order with 'order_pk').
+"""
+
+OP_DEPOSIT = 'deposit'
+OP_CREATE = 'create'
+OP_UPDATE = 'update'
+OP_LOCK = 'lock'
+OP_UNLOCK = 'unlock'
+OP_APPROVE = 'approve'
+OP_CANCEL = 'cancel'
+
+ORDER_TASKS = {
+    OP_UPDATE: tasks.update_order,
+    OP_LOCK: tasks.lock_order,
+    OP_UNLOCK: tasks.unlock_order,
+    OP_APPROVE: tasks.approve_order,
+    OP_CANCEL: tasks.cancel_order,
+}
+
+AVAILABLE_OPERATIONS = [OP_DEPOSIT, OP_CREATE] + list(ORDER_TASKS)
+
+
+class Replay():
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.users = {}
+        self.orders = {}
+
+        # Users of the kept replays stay in the db, so every replay has its own usernames
+        self.run = uuid.uuid4().hex[:8]
+
+    def get_user(self, user_id):
+        user = self.users.get(user_id)
+
+        if user is None:
+            user = inprocess.create_user("replay_{}_{}".format(self.run, user_id))
+            self.users[user_id] = user
+
+        return user
+
+    def get_order_pk(self, operation):
+        if 'order_pk' in operation:
+            return operation['order_pk']
+
+        try:
+            return self.orders[operation['ref']]
+        except KeyError:
+            raise CommandError("Unknown order reference '{}'".format(operation.get('ref')))
+
+    def deposit(self, operation):
+        user = self.get_user(operation['user'])
+
+        with transaction.atomic():
+            account = Account.lock(owner=user, currency=operation['currency'])
+            account.amount += Decimal(operation['amount'])
+            Account.update(pk=account.pk, amount=account.amount)
+
+    def create(self, operation):
+        user = self.get_user(operation['user'])
+        history = tasks.create_order.apply(kwargs={'data': dict(operation['data']), 'user_pk': user.pk}).get()
+
+        if 'ref' in operation:
+            self.orders[operation['ref']] = history[-1]['pk']
+
+    def order_task(self, name, operation):
+        pk = self.get_order_pk(operation)
+        order = Order.objects.get(pk=pk)
+
+        kwargs = {'order_pk': pk, 'pair': order.pair}
+        if name == OP_UPDATE:
+            kwargs['data'] = dict(operation['data'])
+
+        ORDER_TASKS[name].apply(kwargs=kwargs).get()
+
+    def apply(self, operation):
+        name = operation.get('op')
+
+        if name == OP_DEPOSIT:
+            self.recorder.call(name, self.deposit, operation)
+        elif name == OP_CREATE:
+            self.recorder.call(name, self.create, operation)
+        elif name in ORDER_TASKS:
+            self.recorder.call(name, self.order_task, name, operation)
+        else:
+            raise CommandError("Unknown operation '{}', should be one of {}".format(name, AVAILABLE_OPERATIONS))
+
+    def fills(self):
+        """
+            Trades of the replay without db ids, which depend on the sequences state: orders are identified by 'ref'
+            and by the index in the order of creation (orders made by splits have no 'ref'), trades by their index.
+        """
+        refs = {pk: ref for ref, pk in self.orders.items()}
+        owners = {user.pk: user_id for user_id, user in self.users.items()}
+
+        indexes = {pk: index for index, pk in
+                   enumerate(Order.objects.filter(owner_id__in=owners).order_by('pk').values_list('pk', flat=True))}
+
+        trades = Trade.objects.filter(taker__owner_id__in=owners) \
+            .select_related('maker', 'taker') \
+            .order_by('pk')
+
+        def order(o):
+            return {
+                'index': indexes[o.pk],
+                'ref': refs.get(o.pk),
+                'user': owners.get(o.owner_id),
+            }
+
+        return [{
+                    'index': index,
+                    'pair': trade.pair,
+                    'type': trade.side,
+                    'price': str(trade.price),
+                    'amount': str(trade.amount),
+                    'total': str(trade.total),
+                    'maker': order(trade.maker),
+                    'taker': order(trade.taker),
+                } for index, trade in enumerate(trades)]
+
+    def balances(self):
+        balances = {}
+
+        for user_id, user in self.users.items():
+            accounts = Account.objects.filter(owner=user)
+            balances[str(user_id)] = {account.currency: str(account.balance) for account in accounts}
+
+        return balances
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded order operations (ndjson) through the order tasks in the current process, ' \
+           'one by one, and write resulting fills, balances and throughput as json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='File with one json operation per line')
+        parser.add_argument('--engine', default=None, choices=constants.AVAILABLE_MATCHING_ENGINES,
+                            help='Matching engine, settings.MATCHING_ENGINE by default')
+        parser.add_argument('--keep', action='store_true', help='Commit replayed data rather than roll it back')
+        parser.add_argument('--output', default=None, help='File for the json result, stdout by default')
+
+    def read(self, path):
+        with open(path) as f:
+            for number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise CommandError("Line {}: {}".format(number, e))
+
+    def handle(self, *args, **options):
+        operations = list(self.read(options['log']))
+
+        engine = options['engine'] or settings.MATCHING_ENGINE
+        inprocess.setup()
+
+        with override_settings(MATCHING_ENGINE=engine):
+            with transaction.atomic():
+                book.clear()
+
+                with inprocess.Recorder() as recorder:
+                    replay = Replay(recorder)
+                    for operation in operations:
+                        replay.apply(operation)
+
+                result = {
+                    'fills': replay.fills(),
+                    'balances': replay.balances(),
+                }
+
+                if not options['keep']:
+                    transaction.set_rollback(True)
+
+        book.clear()
+
+        report = recorder.report()
+        report['operations_per_sec'] = len(operations) / report['seconds']
+
+        result.update({
+            'engine': engine,
+            'revision': inprocess.get_revision(),
+            'throughput': report,
+        })
+
+        output = json.dumps(result, indent=4, sort_keys=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,94 @@
+import timeit
+import tracemalloc
+from copy import deepcopy
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from absortium import constants
+from absortium.model.models import Account, Order
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+__author__ = 'andrew.shvv@gmail.com'
+
+
+def deepcopy_split(order, opposite):
+    """
+        'split' as it was before 'clone', kept to compare with.
+    """
+    fraction = deepcopy(order)
+    fraction.from_amount = opposite.to_amount
+    fraction.to_amount = opposite.from_amount
+    fraction.to_account = order.to_account
+    fraction.from_account = order.from_account
+    fraction.pk = None
+
+    order.from_amount -= opposite.to_amount
+    order.to_amount -= opposite.from_amount
+
+    return fraction, order
+
+
+def clone_split(order, opposite):
+    return order.split(opposite)
+
+
+def make_order(order_type, pk, amount):
+    order = Order(pk=pk,
+                  type=order_type,
+                  pair=constants.PAIR_BTC_ETH,
+                  price=Decimal("0.5"),
+                  amount=Decimal(amount),
+                  total=Decimal(amount) * Decimal("0.5"),
+                  status=constants.ORDER_PENDING,
+                  owner_id=1)
+
+    order.from_account = Account(pk=pk * 2, currency=order.from_currency, amount=Decimal("1000"), owner_id=1)
+    order.to_account = Account(pk=pk * 2 + 1, currency=order.to_currency, amount=Decimal("1000"), owner_id=1)
+    return order
+
+
+class Command(BaseCommand):
+    help = 'Measure time and memory allocated per fill by the order split (deepcopy vs clone)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fills', type=int, default=10000, help='Number of the fills in one run')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best one is reported')
+
+    def measure(self, split, fills, repeat):
+        def run():
+            order = make_order(constants.ORDER_BUY, pk=1, amount=str(fills + 1))
+            opposite = make_order(constants.ORDER_SELL, pk=2, amount="1")
+
+            # Fractions are kept, as matching pass keeps them in the history
+            fractions = []
+            for _ in range(fills):
+                fraction, order = split(order, opposite)
+                fractions.append(fraction)
+
+            return fractions
+
+        seconds = min(timeit.repeat(run, number=1, repeat=repeat))
+
+        tracemalloc.start()
+        try:
+            fractions = run()
+            allocated, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        del fractions
+        return seconds / fills, allocated / fills
+
+    def handle(self, *args, **options):
+        fills = options['fills']
+        repeat = options['repeat']
+
+        for name, split in [('deepcopy', deepcopy_split), ('clone', clone_split)]:
+            seconds, allocated = self.measure(split, fills, repeat)
+            self.stdout.write("{name:>10}: {time:8.2f} us/fill {memory:10.1f} bytes/fill".format(
+                name=name,
+                time=seconds * 10 ** 6,
+                memory=allocated))
@@ -0,0 +1,189 @@
+import subprocess
+import time
+from random import choice
+from string import ascii_letters, digits
+
+from celery.signals import task_retry
+from django.contrib.auth import get_user_model
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from absortium import celery_app, constants
+from absortium.crossbarhttp.client import set_crossbar_client
+from absortium.model.models import Account
+from absortium.wallet.base import set_wallet_client
+from core.utils.logging import getPrettyLogger
+
+logger = getPrettyLogger(__name__)
+
+__author__ = 'andrew.shvv@gmail.com'
+
+"""
+    Helpers for the commands which drive the exchange tasks in the current process (benchmarks, replays): celery is
+    switched to the eager mode, router and wallets are substituted with the clients which do nothing, so that only
+    matching and db are measured.
+
+    WARNING: Commands which use it write to the configured db, run them against the scratch one (see 'scratch').
+"""
+
+
+class NullRouterClient():
+    def __init__(self):
+        self.count = 0
+
+    def publish(self, topic, **publishment):
+        self.count += 1
+
+
+class NullWalletClient():
+    def create_address(self, *args, **kwargs):
+        return "".join([choice(ascii_letters + digits) for _ in range(30)])
+
+    def send(self, *args, **kwargs):
+        pass
+
+
+def setup():
+    """
+        Run celery tasks in the current process and substitute external services, return the router client
+        in order to count publications.
+    """
+    celery_app.conf.CELERY_ALWAYS_EAGER = True
+    celery_app.conf.CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
+
+    router = NullRouterClient()
+    set_crossbar_client(router)
+
+    for currency in constants.AVAILABLE_CURRENCIES:
+        set_wallet_client(currency, NullWalletClient())
+
+    return router
+
+
+class scratch():
+    """
+        Switch the default connection to the new scratch db (created as the test db, with migrations) for the time of
+        the block, so that tasks commit as they do in production. Db is dropped on exit unless 'keep' is given.
+    """
+
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.name = None
+
+    def __enter__(self):
+        self.name = connection.settings_dict['NAME']
+        return connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        connection.creation.destroy_test_db(self.name, verbosity=0, keepdb=self.keep)
+
+
+def create_user(username, amount=None):
+    """
+        Create user (accounts are created by the user signal) and put 'amount' on every account of the user.
+    """
+    User = get_user_model()
+    user = User(username=username)
+    user.save()
+
+    if amount is not None:
+        Account.objects.filter(owner=user).update(amount=amount)
+
+    return user
+
+
+def percentile(values, p):
+    if not values:
+        return None
+
+    values = sorted(values)
+    i = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[i]
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder():
+    """
+        Measure latency and count sql statements of the every operation, and count retries of the celery tasks.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.queries = {}
+        self.errors = {}
+        self.retries = 0
+        self.task_retries = {}
+        self.started = None
+        self.finished = None
+
+    def on_retry(self, sender=None, *args, **kwargs):
+        self.retries += 1
+
+        name = getattr(sender, 'name', None)
+        self.task_retries[name] = self.task_retries.get(name, 0) + 1
+
+    def __enter__(self):
+        task_retry.connect(self.on_retry, weak=False)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finished = time.perf_counter()
+        task_retry.disconnect(self.on_retry)
+
+    def call(self, name, func, *args, **kwargs):
+        """
+            Call 'func' and record it as operation with 'name', exceptions are counted rather than raised, except of
+            'CommandError' - it means that the input of the command is broken.
+        """
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except CommandError:
+                raise
+            except Exception as e:
+                result = None
+                errors = self.errors.setdefault(name, {})
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            finally:
+                self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+        self.queries[name] = self.queries.get(name, 0) + len(context.captured_queries)
+        return result
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def report(self):
+        all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+
+        def summary(latencies):
+            return {
+                'count': len(latencies),
+                'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+                'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+            }
+
+        operations = {}
+        for name, latencies in self.latencies.items():
+            operations[name] = summary(latencies)
+            operations[name]['queries'] = self.queries.get(name, 0)
+            operations[name]['errors'] = self.errors.get(name, {})
+
+        return {
+            'seconds': self.seconds,
+            'operations': operations,
+            'latency': summary(all_latencies),
+            'queries': sum(self.queries.values()),
+            'retries': self.retries,
+            'task_retries': self.task_retries,
+        }
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+"""
+    Partial indexes on the open ('init', 'pending') orders, one for every order type, which match the way the book is
+    searched: matching query (absortium.model.locks.get_opposites), offers list and offers notification.
+
+        sell orders are taken by the lowest price first - (pair, price ASC, created ASC, id ASC)
+        buy orders are taken by the highest price first - (pair, price DESC, created ASC, id ASC)
+
+    Completed/canceled orders are not in these indexes, so their size depends only on the book depth, not on the
+    orders history.
+"""
+
+OPEN_SELL_INDEX = "CREATE INDEX absortium_order_open_sell_idx " \
+                  "ON absortium_order (pair, price ASC, created ASC, id ASC) " \
+                  "WHERE status IN ('init', 'pending') AND type = 'sell'"
+
+OPEN_BUY_INDEX = "CREATE INDEX absortium_order_open_buy_idx " \
+                 "ON absortium_order (pair, price DESC, created ASC, id ASC) " \
+                 "WHERE status IN ('init', 'pending') AND type = 'buy'"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(OPEN_SELL_INDEX, "DROP INDEX absortium_order_open_sell_idx"),
+        migrations.RunSQL(OPEN_BUY_INDEX, "DROP INDEX absortium_order_open_buy_idx"),
+    ]
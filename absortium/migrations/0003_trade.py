@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+"""
+    Trades of the already matched orders are restored from the completed orders: every match left two completed
+    orders which are linked to each other, the one which was created later is the taker.
+"""
+
+BACKFILL = "INSERT INTO absortium_trade (pair, side, price, amount, total, created, maker_id, taker_id) " \
+           "SELECT t.pair, t.type, m.price, m.amount, m.total, t.created, m.id, t.id " \
+           "FROM absortium_order AS m JOIN absortium_order AS t ON t.link_id = m.id AND m.link_id = t.id " \
+           "WHERE m.status = 'completed' AND t.status = 'completed' AND (m.created, m.id) < (t.created, t.id)"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0002_order_open_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trade',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pair', models.CharField(max_length=8)),
+                ('side', models.CharField(max_length=5)),
+                ('price', models.DecimalField(decimal_places=8, max_digits=17)),
+                ('amount', models.DecimalField(decimal_places=8, max_digits=17)),
+                ('total', models.DecimalField(decimal_places=8, max_digits=17)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('maker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                            to='absortium.Order')),
+                ('taker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                            to='absortium.Order')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='trade',
+            index_together=set([('pair', 'created')]),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+"""
+    Money of the open orders was subtracted from 'amount' before, so 'amount' is already the available money and
+    'frozen' is restored as the sum of the open orders of the owner in the account currency.
+"""
+
+BACKFILL = "UPDATE absortium_account AS a SET frozen = f.amount " \
+           "FROM (SELECT owner_id, " \
+           "             CASE WHEN type = 'buy' THEN split_part(pair, '_', 1) ELSE split_part(pair, '_', 2) END " \
+           "             AS currency, " \
+           "             SUM(CASE WHEN type = 'buy' THEN total ELSE amount END) AS amount " \
+           "      FROM absortium_order " \
+           "      WHERE status IN ('init', 'pending', 'locked', 'approving', 'approved') " \
+           "      GROUP BY 1, 2) AS f " \
+           "WHERE a.owner_id = f.owner_id AND a.currency = f.currency"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0003_trade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='frozen',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=26),
+        ),
+        migrations.CreateModel(
+            name='BalanceEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=8, default=0, max_digits=26)),
+                ('frozen', models.DecimalField(decimal_places=8, default=0, max_digits=26)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries',
+                                              to='absortium.Account')),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
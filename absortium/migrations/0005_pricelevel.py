@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+"""
+    Levels of the already open orders are calculated from the orders once, after that they are changed by the order
+    deltas (see 'PriceLevel.apply').
+"""
+
+BACKFILL = "INSERT INTO absortium_pricelevel (pair, type, price, amount, total, order_count) " \
+           "SELECT pair, type, price, SUM(amount), SUM(total), COUNT(*) " \
+           "FROM absortium_order " \
+           "WHERE status IN ('init', 'pending') " \
+           "GROUP BY pair, type, price"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0004_account_frozen_balanceentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pair', models.CharField(max_length=8)),
+                ('type', models.CharField(max_length=5)),
+                ('price', models.DecimalField(decimal_places=8, max_digits=17)),
+                ('amount', models.DecimalField(decimal_places=8, default=0, max_digits=26)),
+                ('total', models.DecimalField(decimal_places=8, default=0, max_digits=26)),
+                ('order_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pricelevel',
+            unique_together=set([('pair', 'type', 'price')]),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0006_publication'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pair', models.CharField(max_length=8, unique=True)),
+                ('sequence', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+"""
+    Buckets of the already written trades are calculated from the trades once, after that they are changed by the
+    new trades (see 'TradeBucket.apply').
+"""
+
+BACKFILL = "INSERT INTO absortium_tradebucket (pair, minute, high, low, volume, count) " \
+           "SELECT pair, date_trunc('minute', created), MAX(price), MIN(price), SUM(total), COUNT(*) " \
+           "FROM absortium_trade " \
+           "GROUP BY pair, date_trunc('minute', created)"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0007_booksequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TradeBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pair', models.CharField(max_length=8)),
+                ('minute', models.DateTimeField()),
+                ('high', models.DecimalField(decimal_places=8, max_digits=17)),
+                ('low', models.DecimalField(decimal_places=8, max_digits=17)),
+                ('volume', models.DecimalField(decimal_places=8, max_digits=17)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='tradebucket',
+            unique_together=set([('pair', 'minute')]),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
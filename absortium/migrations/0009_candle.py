@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+"""
+    Trade buckets become the 1m candles: the table is extended with the resolution and the open/close/amount columns,
+    which are calculated for the existing buckets from the already written trades once, after that they are changed
+    by the new trades (see 'Candle.apply'). Coarser candles are filled by the first rollups.
+"""
+
+BACKFILL = "UPDATE absortium_candle AS c " \
+           "SET open = t.open, close = t.close, amount = t.amount " \
+           "FROM (SELECT pair, date_trunc('minute', created) AS start, " \
+           "(array_agg(price ORDER BY created, id))[1] AS open, " \
+           "(array_agg(price ORDER BY created DESC, id DESC))[1] AS close, " \
+           "SUM(amount) AS amount " \
+           "FROM absortium_trade " \
+           "GROUP BY pair, date_trunc('minute', created)) AS t " \
+           "WHERE c.pair = t.pair AND c.start = t.start"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0008_tradebucket'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='TradeBucket',
+            new_name='Candle',
+        ),
+        migrations.RenameField(
+            model_name='candle',
+            old_name='minute',
+            new_name='start',
+        ),
+        migrations.AddField(
+            model_name='candle',
+            name='resolution',
+            field=models.CharField(default='1m', max_length=2),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='candle',
+            name='open',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=17),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='candle',
+            name='close',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=17),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='candle',
+            name='amount',
+            field=models.DecimalField(decimal_places=8, default=0, max_digits=26),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='candle',
+            name='volume',
+            field=models.DecimalField(decimal_places=8, max_digits=26),
+        ),
+        migrations.AlterUniqueTogether(
+            name='candle',
+            unique_together=set([('pair', 'resolution', 'start')]),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0009_candle'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='marketinfo',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='marketinfo',
+            index_together=set([('pair', 'created')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('absortium', '0010_marketinfo_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownsampleMark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seconds', models.IntegerField(unique=True)),
+                ('boundary', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -4,7 +4,7 @@ import uuid
 
 from celery.exceptions import TimeoutError
 from celery.result import AsyncResult
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_201_CREATED
@@ -65,6 +65,42 @@ class CreateCeleryMixin():
         raise NotImplemented("You should implement 'create_in_celery' method")
 
 
+class BatchCreateCeleryMixin():
+    @list_route(methods=['post'])
+    def batch(self, request, *args, **kwargs):
+        async_result = self.batch_in_celery(request, *args, **kwargs)
+
+        try:
+            obj = async_result.get(timeout=10, propagate=True)
+            return Response(obj, status=HTTP_201_CREATED)
+        except TimeoutError:
+            data = {
+                "id": async_result.id
+            }
+            return Response(data, status=HTTP_204_NO_CONTENT)
+
+    def batch_in_celery(self, request, *args, **kwargs):
+        raise NotImplemented("You should implement 'batch_in_celery' method")
+
+
+class MassCancelCeleryMixin():
+    @list_route(methods=['post'])
+    def cancel(self, request, *args, **kwargs):
+        async_result = self.cancel_in_celery(request, *args, **kwargs)
+
+        try:
+            obj = async_result.get(timeout=10, propagate=True)
+            return Response(obj, status=HTTP_200_OK)
+        except TimeoutError:
+            data = {
+                "id": async_result.id
+            }
+            return Response(data, status=HTTP_204_NO_CONTENT)
+
+    def cancel_in_celery(self, request, *args, **kwargs):
+        raise NotImplemented("You should implement 'cancel_in_celery' method")
+
+
 class ApproveCeleryMixin():
     @detail_route(methods=['post'])
     def approve(self, request, *args, **kwargs):
@@ -1,7 +1,10 @@
+from django.conf import settings
+from django.db.models.base import ModelState
+
 from absortium import constants
 from absortium.exceptions import NotEnoughMoneyError
-from absortium.model import models
-from absortium.model.locks import get_opposites, lockorder
+from absortium.model import flush, models
+from absortium.model.locks import get_opposites, get_book_opposites, lockorder
 from core.utils.logging import getLogger
 
 __author__ = 'andrew.shvv@gmail.com'
@@ -23,29 +26,38 @@ def operation_wrapper(func):
 
 
 class OrderMixin():
+    def opposites(self):
+        if settings.MATCHING_ENGINE == constants.MATCHING_ENGINE_BOOK:
+            return get_book_opposites(self)
+        else:
+            return get_opposites(self)
+
     def process(self):
         order = self
+        order.taker = True
 
         history = []
 
-        for opposite in get_opposites(order):
-            with lockorder(order=opposite):
-                if order >= opposite:
-                    (fraction, order) = order - opposite
-
-                    if order is None:
-                        order = fraction
+        with flush.atomic():
+            for opposite in order.opposites():
+                # Accounts of the counterparty are not locked, their changes go to the journal
+                with lockorder(order=opposite, journal=True):
+                    if order >= opposite:
+                        (fraction, order) = order - opposite
+
+                        if order is None:
+                            order = fraction
+                            break
+                        else:
+                            history.append(fraction)
+
+                    elif order < opposite:
+                        """
+                            In this case order will be in the ORDER_COMPLETED status, so just break loop and
+                            than add order to the history
+                        """
+                        (_, opposite) = opposite - order
                         break
-                    else:
-                        history.append(fraction)
-
-                elif order < opposite:
-                    """
-                        In this case order will be in the ORDER_COMPLETED status, so just break loop and
-                        than add order to the history
-                    """
-                    (_, opposite) = opposite - order
-                    break
 
         return history + [order]
 
@@ -53,13 +65,30 @@ class OrderMixin():
         # Check that we have enough money
         if self.from_account.amount >= self.from_amount:
 
-            # Subtract money from account because it is locked by order
+            # Move money to the frozen part of account because it is locked by order
             self.from_account.amount -= self.from_amount
+            self.from_account.frozen += self.from_amount
         else:
             raise NotEnoughMoneyError("Not enough money for order creation/update")
 
     def unfreeze_money(self):
         self.from_account.amount += self.from_amount
+        self.from_account.frozen -= self.from_amount
+
+    def clone(self):
+        """
+            Shallow copy of the order which will be saved as the new row. Field values are immutable and accounts
+            should be shared with the original order anyway, so there is no need for deepcopy.
+        """
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__ = self.__dict__.copy()
+        clone._state = ModelState()
+        clone.pk = None
+        clone.saved_level = None
+
+        # Link of the original order is not the link of the clone
+        clone.__dict__.pop(self._meta.get_field('link').get_cache_name(), None)
+        return clone
 
     def split(self, opposite):
         """
@@ -71,13 +100,9 @@ class OrderMixin():
             fraction = order
             return fraction, None
         else:
-            from copy import deepcopy
-            fraction = deepcopy(order)
+            fraction = order.clone()
             fraction.from_amount = opposite.to_amount
             fraction.to_amount = opposite.from_amount
-            fraction.to_account = order.to_account
-            fraction.from_account = order.from_account
-            fraction.pk = None
 
             order.from_amount -= opposite.to_amount
             order.to_amount -= opposite.from_amount
@@ -87,12 +112,33 @@ class OrderMixin():
     def merge(self, opposite):
         fraction = self
 
+        # Frozen money of both orders goes to the other side
+        fraction.from_account.frozen -= fraction.from_amount
+        opposite.from_account.frozen -= opposite.from_amount
+
         fraction.to_account.amount += opposite.from_amount
         opposite.to_account.amount += opposite.to_amount
 
         fraction.status = constants.ORDER_COMPLETED
         opposite.status = constants.ORDER_COMPLETED
 
+        if fraction.is_taker(opposite):
+            maker, taker = opposite, fraction
+        else:
+            maker, taker = fraction, opposite
+
+        flush.save_trade(models.Trade.between(maker, taker, amount=opposite.amount, total=opposite.total))
+
+    def is_taker(self, opposite):
+        """
+            Order which is processed by the matching pass (and its fractions) is marked as taker, otherwise
+            (e.g. merge on approve) the order which was created later is the taker.
+        """
+        if self.taker or opposite.taker:
+            return self.taker
+
+        return (self.created, self.pk) > (opposite.created, opposite.pk)
+
     def __sub__(self, obj):
         if isinstance(obj, models.Order):
             opposite = obj
@@ -115,7 +161,7 @@ class OrderMixin():
                 fraction.merge(opposite)
 
             if order is not None:
-                fraction.save()
+                flush.save_order(fraction)
 
             return fraction, order
         else:
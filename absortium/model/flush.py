@@ -0,0 +1,209 @@
+from django.db import connection
+from django.dispatch import Signal
+
+from absortium.model import models
+from core.utils.logging import getLogger
+
+__author__ = 'andrew.shvv@gmail.com'
+
+logger = getLogger(__name__)
+
+"""
+    Matching pass changes a lot of rows - fractions of the orders, opposite orders and accounts of both sides. Rather
+    than write every change when it happens, 'atomic' block collects them and writes at the end:
+        1. New orders - ids are taken from the sequence with one select and orders are inserted with one insert.
+        2. Changed orders - one update.
+        3. Accounts - one update per locked account, no matter how many times it was changed. Changes of the
+        accounts which were not locked (see 'lockorder') are appended to the journal with one insert.
+        4. Trades - one insert, after orders, because trades refer to the new orders.
+        5. 'orders_flushed'/'trades_flushed' signals are sent once for all written orders/trades (rather than
+        'post_save' for every one).
+
+    Outside of the 'atomic' block every change is written immediately.
+
+    WARNING: Block should be inside the db transaction, because rows are written at the end of the block.
+"""
+
+orders_flushed = Signal(providing_args=["orders"])
+trades_flushed = Signal(providing_args=["trades"])
+
+collector = None
+
+
+class Collector:
+    def __init__(self):
+        self.orders = []
+        self.saved = {}
+        self.trades = []
+        self.accounts = {}
+        self.amounts = {}
+        self.changed = set()
+
+    def account(self, account):
+        """
+            Return the same account instance for the same row, otherwise changes made by one instance would be
+            overwritten by another which was selected before flush.
+        """
+        if account.pk in self.accounts:
+            return self.accounts[account.pk]
+
+        self.accounts[account.pk] = account
+        self.amounts[account.pk] = (account.amount, account.frozen)
+        return account
+
+    def save_account(self, account):
+        account = self.account(account)
+        self.changed.add(account.pk)
+
+    def order(self, order):
+        """
+            Return the changed instance of the same row if there is one - selected row doesn't contain changes
+            which were not written yet (e.g. counter-order which was filled by the previous order of the batch).
+        """
+        if order.pk is not None:
+            return self.saved.get(order.pk, order)
+        return order
+
+    def save_order(self, order):
+        if not any(o is order for o in self.orders):
+            self.orders.append(order)
+
+            if order.pk is not None:
+                self.saved[order.pk] = order
+
+    def save_trade(self, trade):
+        self.trades.append(trade)
+
+    def flush(self):
+        self.flush_accounts()
+        self.flush_orders()
+        self.flush_trades()
+
+    def flush_accounts(self):
+        entries = []
+
+        for pk in self.changed:
+            account = self.accounts[pk]
+
+            amount, frozen = self.amounts[pk]
+            if account.amount == amount and account.frozen == frozen:
+                continue
+
+            if account.journal:
+                entries.append(models.BalanceEntry(account_id=pk,
+                                                   amount=account.amount - amount,
+                                                   frozen=account.frozen - frozen))
+            else:
+                models.Account.update(pk=pk, amount=account.amount, frozen=account.frozen)
+
+        if entries:
+            models.BalanceEntry.objects.bulk_create(entries)
+
+    def flush_orders(self):
+        if not self.orders:
+            return
+
+        new = [order for order in self.orders if order.pk is None]
+        changed = [order for order in self.orders if order.pk is not None]
+
+        for order, pk in zip(new, models.Order.reserve_ids(len(new))):
+            order.pk = pk
+
+        # Links were set before the linked orders got their ids.
+        for order in self.orders:
+            resolve(order, 'link')
+
+        if new:
+            models.Order.objects.bulk_create(new)
+
+            for order in new:
+                order._state.adding = False
+                order._state.db = connection.alias
+
+        if changed:
+            models.Order.bulk_update(changed)
+
+        orders_flushed.send(sender=models.Order, orders=self.orders)
+
+    def flush_trades(self):
+        if not self.trades:
+            return
+
+        for trade in self.trades:
+            resolve(trade, 'maker')
+            resolve(trade, 'taker')
+
+        models.Trade.objects.bulk_create(self.trades)
+        trades_flushed.send(sender=models.Trade, trades=self.trades)
+
+
+def resolve(obj, name):
+    """
+        Set id of the foreign key from the related object, which might be saved after it was assigned.
+    """
+    related = getattr(obj, obj._meta.get_field(name).get_cache_name(), None)
+    if related is not None:
+        setattr(obj, obj._meta.get_field(name).attname, related.pk)
+
+
+def account(account):
+    if collector is not None:
+        return collector.account(account)
+    return account
+
+
+def order(order):
+    if collector is not None:
+        return collector.order(order)
+    return order
+
+
+def save_account(account):
+    if collector is not None:
+        collector.save_account(account)
+    else:
+        models.Account.update(pk=account.pk, amount=account.amount, frozen=account.frozen)
+
+
+def save_order(order):
+    if collector is not None:
+        collector.save_order(order)
+    else:
+        order.save()
+
+
+def save_trade(trade):
+    if collector is not None:
+        collector.save_trade(trade)
+    else:
+        resolve(trade, 'maker')
+        resolve(trade, 'taker')
+        trade.save()
+
+
+class atomic:
+    """
+        Collect all order/account/trade changes which were made during block execution and write them at once if
+        exception was not raised. Nested blocks are the part of the outer one.
+    """
+
+    owner = False
+
+    def __enter__(self):
+        global collector
+
+        if collector is None:
+            collector = Collector()
+            self.owner = True
+
+        return collector
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global collector
+
+        if self.owner:
+            c = collector
+            collector = None
+
+            if exc_type is None:
+                c.flush()
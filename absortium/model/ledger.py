@@ -0,0 +1,99 @@
+from django.db import connection
+
+from absortium import constants
+from core.utils.logging import getLogger
+
+__author__ = 'andrew.shvv@gmail.com'
+
+logger = getLogger(__name__)
+
+"""
+    Consistency check of the account balances: snapshot plus journal of every account is compared with the balance
+    which is calculated from the scratch:
+        1. Frozen - sum of the open orders of the owner in the account currency.
+        2. Total (available plus frozen) - deposits minus withdrawals plus the money got by trades minus the money
+        given by trades.
+
+    Money which was put on the accounts by hand (e.g. 'inprocess.create_user') is not covered by the deposits, so
+    such accounts are reported as well.
+"""
+
+OPEN_STATUSES = [
+    constants.ORDER_INIT,
+    constants.ORDER_PENDING,
+    constants.ORDER_LOCKED,
+    constants.ORDER_APPROVING,
+    constants.ORDER_APPROVED,
+]
+
+# Buyer of the trade is the taker if trade side is 'buy', otherwise the maker.
+# Buyer gives the 'total' in the primary currency and gets the 'amount' in the secondary one, seller vice versa.
+TRADE_MOVEMENTS = "SELECT o.owner_id, split_part(t.pair, '_', {index}), t.{field} * {sign} " \
+                  "FROM absortium_trade AS t " \
+                  "JOIN absortium_order AS o ON o.id = CASE WHEN t.side = '{side}' THEN t.taker_id ELSE t.maker_id END"
+
+MOVEMENTS = [
+    "SELECT owner_id, currency, amount FROM absortium_deposit",
+    "SELECT owner_id, currency, -amount FROM absortium_withdrawal",
+    TRADE_MOVEMENTS.format(index=1, field='total', sign=-1, side=constants.ORDER_BUY),
+    TRADE_MOVEMENTS.format(index=2, field='amount', sign=1, side=constants.ORDER_BUY),
+    TRADE_MOVEMENTS.format(index=1, field='total', sign=1, side=constants.ORDER_SELL),
+    TRADE_MOVEMENTS.format(index=2, field='amount', sign=-1, side=constants.ORDER_SELL),
+]
+
+FROZEN = "SELECT owner_id, " \
+         "CASE WHEN type = '{buy}' THEN split_part(pair, '_', 1) ELSE split_part(pair, '_', 2) END, " \
+         "CASE WHEN type = '{buy}' THEN total ELSE amount END " \
+         "FROM absortium_order " \
+         "WHERE status = ANY(%s)".format(buy=constants.ORDER_BUY)
+
+CHECK = "WITH " \
+        "journal AS (SELECT account_id, SUM(amount) AS amount, SUM(frozen) AS frozen " \
+        "            FROM absortium_balanceentry GROUP BY account_id), " \
+        "movements AS (SELECT m.owner_id, m.currency, SUM(m.amount) AS amount " \
+        "              FROM ({movements}) AS m (owner_id, currency, amount) GROUP BY m.owner_id, m.currency), " \
+        "frozen AS (SELECT f.owner_id, f.currency, SUM(f.amount) AS amount " \
+        "           FROM ({frozen}) AS f (owner_id, currency, amount) GROUP BY f.owner_id, f.currency) " \
+        "SELECT a.id, a.owner_id, a.currency, " \
+        "       a.amount + COALESCE(j.amount, 0), " \
+        "       a.frozen + COALESCE(j.frozen, 0), " \
+        "       COALESCE(m.amount, 0), " \
+        "       COALESCE(f.amount, 0) " \
+        "FROM absortium_account AS a " \
+        "LEFT JOIN journal AS j ON j.account_id = a.id " \
+        "LEFT JOIN movements AS m ON m.owner_id = a.owner_id AND m.currency = a.currency " \
+        "LEFT JOIN frozen AS f ON f.owner_id = a.owner_id AND f.currency = a.currency " \
+        "WHERE a.owner_id IS NOT NULL {where}" \
+        "ORDER BY a.id"
+
+
+def check(owner_ids=None):
+    """
+        Return the list of accounts which balance doesn't match with the orders, trades, deposits and withdrawals.
+    """
+    sql = CHECK.format(movements=" UNION ALL ".join(MOVEMENTS),
+                       frozen=FROZEN,
+                       where="AND a.owner_id = ANY(%s) " if owner_ids is not None else "")
+
+    params = [OPEN_STATUSES]
+    if owner_ids is not None:
+        params.append(list(owner_ids))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    mismatches = []
+    for pk, owner_id, currency, amount, frozen, expected_total, expected_frozen in rows:
+        if amount + frozen != expected_total or frozen != expected_frozen:
+            mismatches.append({
+                'pk': pk,
+                'owner': owner_id,
+                'currency': currency,
+                'amount': amount,
+                'frozen': frozen,
+                'expected_amount': expected_total - expected_frozen,
+                'expected_frozen': expected_frozen,
+            })
+
+    return mismatches
@@ -1,5 +1,6 @@
 from absortium import constants
-from absortium.model import models
+from absortium.engine import book
+from absortium.model import flush, models
 from core.utils.logging import getLogger
 
 __author__ = 'andrew.shvv@gmail.com'
@@ -8,7 +9,14 @@ logger = getLogger(__name__)
 
 
 class lockorder:
-    def __init__(self, pk=None, order=None):
+    """
+        'journal' - do not lock accounts of the order owner, their changes are appended to the journal on flush
+        (see 'Account'). Could be used only inside of the 'flush.atomic' block and only if the accounts are not
+        debited - e.g. for the counterparty of the matching pass, which only gets the money and loses the frozen one.
+    """
+
+    def __init__(self, pk=None, order=None, journal=False):
+        self.journal = journal
 
         if pk:
             self.order = models.Order.lock(pk=pk)
@@ -41,11 +49,22 @@ class lockorder:
 
             """
 
-            accounts = models.Account.locks(owner__pk=self.order.owner_id,
-                                            currency__in=[self.order.primary_currency,
-                                                          self.order.secondary_currency])
+            fields = {
+                'owner__pk': self.order.owner_id,
+                'currency__in': [self.order.primary_currency, self.order.secondary_currency]
+            }
+
+            if self.journal:
+                accounts = models.Account.objects.filter(**fields)
+                for account in accounts:
+                    account.journal = True
+            else:
+                accounts = models.Account.locks(**fields)
 
             for account in accounts:
+                # Inside of the flush block account might be already selected (and changed) by previous order
+                account = flush.account(account)
+
                 if account.currency == self.order.from_currency:
                     self.order.from_account = account
                 if account.currency == self.order.to_currency:
@@ -58,8 +77,8 @@ class lockorder:
             """
                 Account always should be updated even if order in 'init' state, because we subtract order amount from account.
             """
-            models.Account.update(pk=self.order.from_account.pk, amount=self.order.from_account.amount)
-            models.Account.update(pk=self.order.to_account.pk, amount=self.order.to_account.amount)
+            flush.save_account(self.order.from_account)
+            flush.save_account(self.order.to_account)
 
             c1 = self.status != self.order.status
             c2 = self.amount != self.order.amount
@@ -67,23 +86,70 @@ class lockorder:
             c4 = self.total != self.order.total
 
             if c1 or c2 or c3 or c4:
-                self.order.save()
+                flush.save_order(self.order)
+
+
+def preload_accounts(orders):
+    """
+        Select accounts of the all given orders with one select and assign them to the orders, so that 'lockorder'
+        doesn't select them one by one. Accounts are not locked - it is used for the counterparty orders of the
+        matching pass (see 'lockorder' journal mode).
+    """
+    orders = [order for order in orders if not order.from_account and not order.to_account]
+    if not orders:
+        return
+
+    owners = {order.owner_id for order in orders}
+    currencies = {currency for order in orders for currency in [order.primary_currency, order.secondary_currency]}
+
+    accounts = {}
+    for account in models.Account.objects.filter(owner_id__in=owners, currency__in=currencies).order_by('pk'):
+        account.journal = True
+
+        # Inside of the flush block account might be already selected (and changed) by previous order
+        account = flush.account(account)
+        accounts[(account.owner_id, account.currency)] = account
+
+    for order in orders:
+        order.from_account = accounts.get((order.owner_id, order.from_currency))
+        order.to_account = accounts.get((order.owner_id, order.to_currency))
+
+
+def lockaccounts(owner_id, currencies):
+    """
+        Lock accounts of the user in the given currencies with one select, return them by currency.
+    """
+    accounts = models.Account.locks(owner__pk=owner_id, currency__in=currencies)
+    return {account.currency: flush.account(account) for account in accounts}
+
+
+def changed(opposites):
+    """
+        Replace selected orders with their not written changes, if any (see 'flush.order'), and skip those which were
+        closed by them.
+    """
+    opposites = [flush.order(opposite) for opposite in opposites]
+    return [opposite for opposite in opposites if opposite.status in book.OPEN_STATUSES]
 
 
 class get_opposites:
     """
-        1. Search for opposite orders.
-        2. Block order with pg_try_advisory_xact_lock postgres lock.
+        1. Claim the next batch of opposite orders which suit our conditions (price, status, currency) and are not
+        locked by another transaction - with one 'FOR UPDATE SKIP LOCKED' select.
+        2. Select accounts of the whole batch with one select.
+        3. Give them one by one and go to the db again only when the batch is over.
     """
 
-    def __init__(self, order):
+    def __init__(self, order, size=constants.ORDER_MATCHING_BATCH_SIZE):
         self.order = order
-        self.times = 3
+        self.size = size
+        self.claimed = []
+        self.opposites = []
 
     def __iter__(self):
         return self
 
-    def __next__(self):
+    def query(self):
         if self.order.type == constants.ORDER_BUY:
             sign = "<="
             order = "ASC"
@@ -91,38 +157,78 @@ class get_opposites:
             sign = ">="
             order = "DESC"
 
-        while True:
-            try:
-                """
-                    Get first non-blocked order which suit out conditions (price, status, currency) and block it.
-                """
-                opposite = models.Order.objects.raw('SELECT * '
-                                                    'FROM absortium_order '
-                                                    'WHERE (status = %s OR status = %s) '
-                                                    'AND pg_try_advisory_xact_lock(id) '
-                                                    'AND price {sign} %s '
-                                                    'AND pair = %s '
-                                                    'AND type = %s '
-                                                    'AND owner_id <> %s '
-                                                    'ORDER BY price {order}, created ASC '
-                                                    'FOR UPDATE '
-                                                    'LIMIT 1 '.format(sign=sign, order=order),
-                                                    [constants.ORDER_PENDING, constants.ORDER_INIT,
-                                                     self.order.price,
-                                                     self.order.pair,
-                                                     self.order.opposite_type,
-                                                     self.order.owner_id])[0]
-
-            except IndexError:
-                """
-                    Very dirty hack; While orders selection might happen that all orders are locked,
-                    so we may end up with skipping the orders processing, in order to low the likelihood of such situation, do it
-                    3 times.
-                """
-                self.times -= 1
-                if self.times > 0:
-                    continue
-                else:
-                    raise StopIteration()
-
-            return opposite
+        sql = 'SELECT * ' \
+              'FROM absortium_order ' \
+              'WHERE (status = %s OR status = %s) ' \
+              'AND price {sign} %s ' \
+              'AND pair = %s ' \
+              'AND type = %s ' \
+              'AND owner_id <> %s ' \
+              'AND id <> ALL(%s) ' \
+              'ORDER BY price {order}, created ASC, id ASC ' \
+              'LIMIT %s ' \
+              'FOR UPDATE SKIP LOCKED'.format(sign=sign, order=order)
+
+        params = [constants.ORDER_PENDING, constants.ORDER_INIT,
+                  self.order.price,
+                  self.order.pair,
+                  self.order.opposite_type,
+                  self.order.owner_id,
+                  self.claimed,
+                  self.size]
+
+        return sql, params
+
+    def __next__(self):
+        while not self.opposites:
+            sql, params = self.query()
+            opposites = list(models.Order.objects.raw(sql, params))
+
+            if not opposites:
+                raise StopIteration()
+
+            self.claimed.extend([opposite.pk for opposite in opposites])
+            self.opposites = changed(opposites)
+            preload_accounts(self.opposites)
+
+        return self.opposites.pop(0)
+
+
+class get_book_opposites:
+    """
+        1. Take from the resident order book the counter-orders which are needed to fill the order.
+        2. Lock them with one select and return those which are still suit our conditions.
+        3. Select accounts of all of them with one select.
+    """
+
+    def __init__(self, order):
+        self.order = order
+        self.seen = set()
+        self.opposites = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.opposites:
+            pks = book.get_book(self.order.pair).candidates(self.order, exclude=self.seen)
+
+            if not pks:
+                raise StopIteration()
+
+            self.seen.update(pks)
+
+            if self.order.type == constants.ORDER_BUY:
+                price = {'price__lte': self.order.price}
+            elif self.order.type == constants.ORDER_SELL:
+                price = {'price__gte': self.order.price}
+
+            opposites = models.Order.locks(pk__in=pks,
+                                           status__in=book.OPEN_STATUSES,
+                                           **price).order_by('pk')
+
+            opposites = {opposite.pk: opposite for opposite in changed(opposites)}
+            self.opposites = [opposites[pk] for pk in pks if pk in opposites]
+            preload_accounts(self.opposites)
+
+        return self.opposites.pop(0)
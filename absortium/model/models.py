@@ -1,8 +1,12 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
 from absortium.exceptions import NotEnoughMoneyError
 from absortium.mixins.model import OrderMixin
 from absortium.wallet.base import get_wallet_client
 from django.conf import settings
-from django.db import models
+from django.db import connection, models
+from django.utils.timezone import utc
 
 from absortium import constants
 from core.utils.logging import getLogger
@@ -14,12 +18,22 @@ logger = getLogger(__name__)
 
 class Account(models.Model):
     """
-        Comment me!
+    'amount' - money which is available for the new orders and withdrawals.
+
+    'frozen' - money which is locked by the open orders of the owner.
+
+    Both columns are the snapshot: changes made by the counterparty matches are appended to the 'BalanceEntry' journal
+    without taking the account lock, and folded into the snapshot when account is locked (or by the periodic
+    'fold_balances' task). So the balance of the account is snapshot plus journal.
     """
     amount = models.DecimalField(max_digits=constants.ACCOUNT_MAX_DIGITS,
                                  decimal_places=constants.DECIMAL_PLACES,
                                  default=0)
 
+    frozen = models.DecimalField(max_digits=constants.ACCOUNT_MAX_DIGITS,
+                                 decimal_places=constants.DECIMAL_PLACES,
+                                 default=0)
+
     address = models.CharField(max_length=50)
 
     currency = models.CharField(max_length=calculate_len(constants.AVAILABLE_CURRENCIES))
@@ -31,13 +45,25 @@ class Account(models.Model):
         unique_together = ('currency', 'owner', 'address')
         ordering = ('-created',)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Account which was not locked, its changes should be appended to the journal
+        self.journal = False
+
     @staticmethod
     def lock(**kwargs):
-        return Account.objects.select_for_update().get(**kwargs)
+        account = Account.objects.select_for_update().get(**kwargs)
+        Account.fold([account])
+        return account
 
     @staticmethod
     def locks(**kwargs):
-        return Account.objects.select_for_update().filter(**kwargs)
+        # Accounts are always locked in the order of ids, so that two transactions which lock the same accounts
+        # can't deadlock on each other.
+        accounts = list(Account.objects.select_for_update().filter(**kwargs).order_by('pk'))
+        Account.fold(accounts)
+        return accounts
 
     @staticmethod
     def update(pk, **kwargs):
@@ -45,6 +71,87 @@ class Account(models.Model):
         # instances, and so the pre_save and post_save signals aren't emitted.
         Account.objects.filter(pk=pk).update(**kwargs)
 
+    @staticmethod
+    def fold(accounts):
+        """
+            Move the journal entries of the accounts into their snapshots with one statement, accounts should be
+            locked.
+        """
+        accounts = {account.pk: account for account in accounts}
+        if not accounts:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute('WITH e AS (DELETE FROM absortium_balanceentry WHERE account_id = ANY(%s) '
+                           'RETURNING account_id, amount, frozen) '
+                           'SELECT account_id, SUM(amount), SUM(frozen) FROM e GROUP BY account_id',
+                           [list(accounts)])
+            sums = cursor.fetchall()
+
+        for pk, amount, frozen in sums:
+            account = accounts[pk]
+            account.amount += amount
+            account.frozen += frozen
+            account.__dict__.pop('_pending', None)
+
+            if amount or frozen:
+                Account.update(pk=pk, amount=account.amount, frozen=account.frozen)
+
+    @staticmethod
+    def load_pending(accounts):
+        """
+            Sum the journal entries of the accounts with one grouped select, rather than with one select per account
+            (see 'pending').
+        """
+        accounts = {account.pk: account for account in accounts}
+        if not accounts:
+            return
+
+        sums = BalanceEntry.objects.filter(account_id__in=list(accounts)) \
+            .order_by() \
+            .values('account_id') \
+            .annotate(amount_sum=models.Sum('amount'), frozen_sum=models.Sum('frozen'))
+
+        for account in accounts.values():
+            account._pending = (0, 0)
+
+        for row in sums:
+            accounts[row['account_id']]._pending = (row['amount_sum'], row['frozen_sum'])
+
+    def pending(self):
+        """
+            Sum of the journal entries which are not folded yet.
+        """
+        if not hasattr(self, '_pending'):
+            Account.load_pending([self])
+
+        return self._pending
+
+    @property
+    def balance(self):
+        return self.amount + self.pending()[0]
+
+    @property
+    def frozen_balance(self):
+        return self.frozen + self.pending()[1]
+
+
+class BalanceEntry(models.Model):
+    """
+        Change of the account which was made without the account lock, see 'Account'.
+    """
+    account = models.ForeignKey('Account', related_name='entries')
+
+    amount = models.DecimalField(max_digits=constants.ACCOUNT_MAX_DIGITS,
+                                 decimal_places=constants.DECIMAL_PLACES,
+                                 default=0)
+
+    frozen = models.DecimalField(max_digits=constants.ACCOUNT_MAX_DIGITS,
+                                 decimal_places=constants.DECIMAL_PLACES,
+                                 default=0)
+
+    created = models.DateTimeField(auto_now_add=True)
+
 
 class Order(models.Model, OrderMixin):
     """
@@ -107,6 +214,26 @@ class Order(models.Model, OrderMixin):
         self.from_account = None
         self.to_account = None
 
+        # Set by the matching pass, see OrderMixin.is_taker
+        self.taker = False
+
+        # Contribution of the order to the price level as it is written in db, see 'PriceLevel.apply'
+        self.saved_level = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        order = super().from_db(db, field_names, values)
+        order.saved_level = order.level()
+        return order
+
+    def level(self):
+        """
+            Contribution of the order to the price level (pair, type, price, amount, total), None if order is not
+            in the book.
+        """
+        if self.status in constants.ORDER_OPEN_STATUSES:
+            return self.pair, self.type, self.price, self.amount, self.total
+
     @property
     def opposite_type(self):
         if self.type == constants.ORDER_BUY:
@@ -186,6 +313,349 @@ class Order(models.Model, OrderMixin):
     def update(pk, **kwargs):
         Order.objects.filter(pk=pk).update(**kwargs)
 
+    @staticmethod
+    def bulk_update(orders):
+        """
+            Write state of the orders with one update, rather than with one save() per order.
+        """
+        values = ", ".join(["(%s::integer, %s, %s::numeric, %s::numeric, %s::numeric, %s::integer)"] * len(orders))
+
+        params = []
+        for order in orders:
+            params.extend([order.pk, order.status, order.amount, order.total, order.price, order.link_id])
+
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE absortium_order AS o '
+                           'SET status = v.status, '
+                           'amount = v.amount, '
+                           'total = v.total, '
+                           'price = v.price, '
+                           'link_id = v.link_id '
+                           'FROM (VALUES {values}) AS v(id, status, amount, total, price, link_id) '
+                           'WHERE o.id = v.id'.format(values=values), params)
+
+    @staticmethod
+    def reserve_ids(n):
+        """
+            Take 'n' ids from the order id sequence with one select, so that orders may be linked before insert.
+        """
+        if n == 0:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(pg_get_serial_sequence('absortium_order', 'id')) "
+                           "FROM generate_series(1, %s)", [n])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PriceLevel(models.Model):
+    """
+    Sum of the open orders with the same pair, type and price - the offer. Levels are not calculated from the orders
+    on every request, but are changed by the deltas of the orders in the same transaction as the orders themselves
+    (see 'PriceLevel.apply'). Empty levels are deleted.
+    """
+
+    pair = models.CharField(max_length=calculate_len(constants.AVAILABLE_CURRENCY_PAIRS))
+
+    type = models.CharField(max_length=calculate_len(constants.AVAILABLE_ORDER_TYPES))
+
+    price = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                                decimal_places=constants.DECIMAL_PLACES)
+
+    amount = models.DecimalField(max_digits=constants.OFFER_MAX_DIGITS,
+                                 decimal_places=constants.DECIMAL_PLACES,
+                                 default=0)
+
+    total = models.DecimalField(max_digits=constants.OFFER_MAX_DIGITS,
+                                decimal_places=constants.DECIMAL_PLACES,
+                                default=0)
+
+    order_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('pair', 'type', 'price')
+
+    @staticmethod
+    def apply(orders):
+        """
+            Add difference between the current and the written state of the orders to their levels with one upsert,
+            return changed levels.
+        """
+        deltas = {}
+
+        for order in orders:
+            old, new = order.saved_level, order.level()
+            if old == new:
+                continue
+
+            for level, sign in [(old, -1), (new, 1)]:
+                if level is not None:
+                    pair, order_type, price, amount, total = level
+
+                    delta = deltas.setdefault((pair, order_type, Decimal(price)), [0, 0, 0])
+                    delta[0] += sign * Decimal(amount)
+                    delta[1] += sign * Decimal(total)
+                    delta[2] += sign
+
+            order.saved_level = new
+
+        if not deltas:
+            return []
+
+        values = ", ".join(["(%s, %s, %s::numeric, %s::numeric, %s::numeric, %s::integer)"] * len(deltas))
+
+        params = []
+        for key in sorted(deltas):
+            params.extend(list(key) + deltas[key])
+
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO absortium_pricelevel AS l (pair, type, price, amount, total, order_count) '
+                           'VALUES {values} '
+                           'ON CONFLICT (pair, type, price) DO UPDATE '
+                           'SET amount = l.amount + EXCLUDED.amount, '
+                           'total = l.total + EXCLUDED.total, '
+                           'order_count = l.order_count + EXCLUDED.order_count '
+                           'RETURNING id, pair, type, price, amount, total, order_count'.format(values=values),
+                           params)
+
+            levels = [PriceLevel(*row) for row in cursor.fetchall()]
+
+            empty = [level.pk for level in levels if level.order_count == 0]
+            if empty:
+                cursor.execute('DELETE FROM absortium_pricelevel WHERE id = ANY(%s)', [empty])
+
+        for level in levels:
+            if level.order_count == 0:
+                level.amount = 0
+                level.total = 0
+
+        return sorted(levels, key=lambda level: (level.pair, level.type, level.price))
+
+    @staticmethod
+    def snapshot(pair):
+        """
+            Levels of the pair and the sequence they reflect, read with one statement (so with one db snapshot).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COALESCE(s.sequence, 0), l.type, l.price, l.amount, l.total '
+                           'FROM (SELECT %s::varchar AS pair) AS p '
+                           'LEFT JOIN absortium_booksequence AS s ON s.pair = p.pair '
+                           'LEFT JOIN absortium_pricelevel AS l ON l.pair = p.pair '
+                           'ORDER BY l.type, l.price', [pair])
+            rows = cursor.fetchall()
+
+        levels = [PriceLevel(pair=pair, type=order_type, price=price, amount=amount, total=total)
+                  for _, order_type, price, amount, total in rows if order_type is not None]
+
+        return rows[0][0], levels
+
+
+class BookSequence(models.Model):
+    """
+    Number of the last published change of the pair offers (see 'publishment.sequence'), so that websocket client may
+    detect missed changes and resync with the snapshot which has the same number.
+    """
+
+    pair = models.CharField(max_length=calculate_len(constants.AVAILABLE_CURRENCY_PAIRS), unique=True)
+
+    sequence = models.BigIntegerField(default=0)
+
+    @staticmethod
+    def next(pair, count=1):
+        """
+            Take 'count' numbers of the pair with one statement, return the first one.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO absortium_booksequence AS s (pair, sequence) VALUES (%s, %s) '
+                           'ON CONFLICT (pair) DO UPDATE SET sequence = s.sequence + EXCLUDED.sequence '
+                           'RETURNING sequence', [pair, count])
+            return cursor.fetchone()[0] - count + 1
+
+    @staticmethod
+    def current(pair):
+        return BookSequence.objects.filter(pair=pair).values_list('sequence', flat=True).first() or 0
+
+
+class Trade(models.Model):
+    """
+    Append-only record of the one match between two orders, written by the matching engine.
+
+    'maker' - order which was resting in the book.
+
+    'taker' - order which came and was matched with the maker.
+
+    'side' - type of the taker order.
+
+    'price' - price of the maker order, 'amount'/'total' - exchanged amount of secondary/primary currency.
+    """
+
+    pair = models.CharField(max_length=calculate_len(constants.AVAILABLE_CURRENCY_PAIRS))
+
+    side = models.CharField(max_length=calculate_len(constants.AVAILABLE_ORDER_TYPES))
+
+    price = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                                decimal_places=constants.DECIMAL_PLACES)
+
+    amount = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                                 decimal_places=constants.DECIMAL_PLACES)
+
+    total = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                                decimal_places=constants.DECIMAL_PLACES)
+
+    maker = models.ForeignKey('Order', related_name='+')
+    taker = models.ForeignKey('Order', related_name='+')
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-created',)
+        index_together = [('pair', 'created')]
+
+    @staticmethod
+    def between(maker, taker, amount, total):
+        return Trade(pair=taker.pair,
+                     side=taker.type,
+                     price=maker.price,
+                     amount=amount,
+                     total=total,
+                     maker=maker,
+                     taker=taker)
+
+
+class Candle(models.Model):
+    """
+    OHLCV of the pair trades for the period which is started at 'start' and has the length of 'resolution'.
+
+    1m candles are changed in the same transaction as trades are written (see 'Candle.apply'), coarser candles are
+    rolled up from the candles of the previous resolution (see 'Candle.rollup'), never from the trades. 1m candles are
+    also used for the 24h market info, which is calculated from at most 1440 rows per pair rather than from the trades.
+
+    'amount'/'volume' - exchanged amount of secondary/primary currency.
+    """
+
+    pair = models.CharField(max_length=calculate_len(constants.AVAILABLE_CURRENCY_PAIRS))
+
+    resolution = models.CharField(max_length=calculate_len(constants.AVAILABLE_CANDLE_RESOLUTIONS))
+
+    start = models.DateTimeField()
+
+    open = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                               decimal_places=constants.DECIMAL_PLACES)
+
+    high = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                               decimal_places=constants.DECIMAL_PLACES)
+
+    low = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                              decimal_places=constants.DECIMAL_PLACES)
+
+    close = models.DecimalField(max_digits=constants.MAX_DIGITS,
+                                decimal_places=constants.DECIMAL_PLACES)
+
+    amount = models.DecimalField(max_digits=constants.OFFER_MAX_DIGITS,
+                                 decimal_places=constants.DECIMAL_PLACES)
+
+    volume = models.DecimalField(max_digits=constants.OFFER_MAX_DIGITS,
+                                 decimal_places=constants.DECIMAL_PLACES)
+
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('pair', 'resolution', 'start')
+
+    @staticmethod
+    def apply(trades):
+        """
+            Add written trades to their 1m candles with one upsert, trades should be in the order of creation.
+        """
+        candles = {}
+
+        for trade in trades:
+            key = (trade.pair, constants.CANDLE_1M, trade.created.replace(second=0, microsecond=0))
+            price, amount, total = Decimal(trade.price), Decimal(trade.amount), Decimal(trade.total)
+
+            if key in candles:
+                first, high, low, _, summed_amount, summed_total, count = candles[key]
+                candles[key] = [first, max(high, price), min(low, price), price, summed_amount + amount,
+                                summed_total + total, count + 1]
+            else:
+                candles[key] = [price, price, price, price, amount, total, 1]
+
+        if not candles:
+            return
+
+        values = ", ".join(["(%s, %s, %s, %s::numeric, %s::numeric, %s::numeric, %s::numeric, %s::numeric, "
+                            "%s::numeric, %s::integer)"] * len(candles))
+
+        params = []
+        for key in sorted(candles):
+            params.extend(list(key) + candles[key])
+
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO absortium_candle AS c '
+                           '(pair, resolution, start, open, high, low, close, amount, volume, count) '
+                           'VALUES {values} '
+                           'ON CONFLICT (pair, resolution, start) DO UPDATE '
+                           'SET high = GREATEST(c.high, EXCLUDED.high), '
+                           'low = LEAST(c.low, EXCLUDED.low), '
+                           'close = EXCLUDED.close, '
+                           'amount = c.amount + EXCLUDED.amount, '
+                           'volume = c.volume + EXCLUDED.volume, '
+                           'count = c.count + EXCLUDED.count'.format(values=values),
+                           params)
+
+    @staticmethod
+    def rollup(source, target, seconds, batch=constants.CANDLE_ROLLUP_BATCH_SIZE):
+        """
+            Calculate candles of the 'target' resolution from the candles of the 'source' resolution with one upsert.
+            Only periods starting from the last existing target candle of the pair are recalculated (the last one may
+            be not complete), so the cost doesn't depend on the history length and the missed runs are caught up.
+
+            Not more than 'batch' source candles of the pair are taken by one run, the rest of them are taken by the
+            next runs (the last period may be cut, it is recalculated by the next run as the last existing one).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO absortium_candle AS c '
+                           '(pair, resolution, start, open, high, low, close, amount, volume, count) '
+                           'SELECT s.pair, %s, '
+                           'to_timestamp(floor(extract(epoch FROM s.start) / %s) * %s) AS period_start, '
+                           '(array_agg(s.open ORDER BY s.start))[1], MAX(s.high), MIN(s.low), '
+                           '(array_agg(s.close ORDER BY s.start DESC))[1], '
+                           'SUM(s.amount), SUM(s.volume), SUM(s.count) '
+                           'FROM unnest(%s::varchar[]) AS p(pair) '
+                           'CROSS JOIN LATERAL (SELECT * FROM absortium_candle AS s '
+                           'WHERE s.pair = p.pair AND s.resolution = %s AND s.start >= COALESCE('
+                           '(SELECT MAX(t.start) FROM absortium_candle AS t '
+                           'WHERE t.pair = p.pair AND t.resolution = %s), \'-infinity\') '
+                           'ORDER BY s.start '
+                           'LIMIT %s) AS s '
+                           'GROUP BY s.pair, period_start '
+                           'ON CONFLICT (pair, resolution, start) DO UPDATE '
+                           'SET open = EXCLUDED.open, '
+                           'high = EXCLUDED.high, '
+                           'low = EXCLUDED.low, '
+                           'close = EXCLUDED.close, '
+                           'amount = EXCLUDED.amount, '
+                           'volume = EXCLUDED.volume, '
+                           'count = EXCLUDED.count',
+                           [target, seconds, seconds, constants.AVAILABLE_CURRENCY_PAIRS, source, target, batch])
+
+    @staticmethod
+    def rollup_all():
+        resolutions = constants.CANDLE_RESOLUTIONS
+        for (source, _), (target, seconds) in zip(resolutions, resolutions[1:]):
+            Candle.rollup(source, target, seconds)
+
+    @staticmethod
+    def stats(since):
+        """
+            Max/min price and volume of the every pair which has 1m candles started not earlier than 'since'.
+        """
+        rows = Candle.objects.filter(resolution=constants.CANDLE_1M, start__gte=since) \
+            .values('pair') \
+            .annotate(high_max=models.Max('high'), low_min=models.Min('low'), volume_sum=models.Sum('volume'))
+
+        return {row['pair']: (row['high_max'], row['low_min'], row['volume_sum']) for row in rows}
+
 
 class Deposit(models.Model):
     created = models.DateTimeField(auto_now_add=True)
@@ -234,8 +704,19 @@ class Withdrawal(models.Model):
             raise NotEnoughMoneyError("Not enough money for withdrawal")
 
 
+def align(moment, seconds):
+    """
+        Start of the period with the given length which contains the moment, periods are counted from the epoch.
+    """
+    return datetime.fromtimestamp(int(moment.timestamp()) // seconds * seconds, tz=utc)
+
+
 class MarketInfo(models.Model):
-    created = models.DateTimeField(auto_now_add=True)
+    """
+    Snapshot of the pair market, written every run of the 'calculate_market_info' task. Old snapshots are downsampled
+    (see 'MarketInfo.downsample'), so the table doesn't grow with the time at the full resolution.
+    """
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
 
     rate = models.DecimalField(max_digits=constants.MAX_DIGITS,
                                decimal_places=constants.DECIMAL_PLACES)
@@ -253,3 +734,73 @@ class MarketInfo(models.Model):
 
     class Meta:
         ordering = ('-created',)
+        index_together = [('pair', 'created')]
+
+    @staticmethod
+    def downsample(now, batch=constants.MARKET_INFO_RETENTION_BATCH_SIZE):
+        """
+            Delete snapshots which are older than the retention age except of the last snapshot of the pair in every
+            period (see 'MARKET_INFO_RETENTION'), return count of the deleted snapshots. Snapshots are walked by the
+            ranges of about 'batch' snapshots, every range is deleted with the separate statement.
+
+            Every level is started from the boundary which was reached by the previous run (see 'DownsampleMark'),
+            older snapshots are already one per period, so the cost of the run doesn't depend on the table age.
+        """
+        deleted = 0
+
+        for hours, seconds in constants.MARKET_INFO_RETENTION:
+            # Only the periods which are completely older than the age are downsampled
+            cutoff = align(now - timedelta(hours=hours), seconds)
+
+            lower = DownsampleMark.objects.filter(seconds=seconds).values_list('boundary', flat=True).first()
+            if lower is None:
+                lower = MarketInfo.objects.filter(created__lt=cutoff).aggregate(models.Min('created'))['created__min']
+
+            while lower is not None and lower < cutoff:
+                lower = align(lower, seconds)
+
+                # Range is ended at the start of the period of the snapshot which is 'batch' snapshots later
+                later = list(MarketInfo.objects.filter(created__gte=lower, created__lt=cutoff)
+                             .order_by('created').values_list('created', flat=True)[batch:batch + 1])
+
+                upper = max(align(later[0], seconds), lower + timedelta(seconds=seconds)) if later else cutoff
+                upper = min(upper, cutoff)
+
+                with connection.cursor() as cursor:
+                    cursor.execute('DELETE FROM absortium_marketinfo '
+                                   'WHERE created >= %s AND created < %s AND id NOT IN ('
+                                   'SELECT DISTINCT ON (pair, floor(extract(epoch FROM created) / %s)) id '
+                                   'FROM absortium_marketinfo '
+                                   'WHERE created >= %s AND created < %s '
+                                   'ORDER BY pair, floor(extract(epoch FROM created) / %s), created DESC, id DESC)',
+                                   [lower, upper, seconds, lower, upper, seconds])
+                    deleted += cursor.rowcount
+
+                DownsampleMark.objects.update_or_create(seconds=seconds, defaults={'boundary': upper})
+                lower = upper
+
+        return deleted
+
+
+class DownsampleMark(models.Model):
+    """
+    Boundary up to which market info snapshots are downsampled to one per period of the given length (seconds), see
+    'MarketInfo.downsample'.
+    """
+
+    seconds = models.IntegerField(unique=True)
+
+    boundary = models.DateTimeField()
+
+
+class Publication(models.Model):
+    """
+    Outbox of the websocket publications: publications are written in the same transaction as the changes they
+    describe and are sent to the router by the dispatcher (see 'crossbarhttp/outbox.py').
+    """
+
+    topic = models.CharField(max_length=100)
+
+    data = models.TextField()
+
+    created = models.DateTimeField(auto_now_add=True)
@@ -1,8 +1,12 @@
+import decimal
+from collections import OrderedDict
+
 from django.contrib.auth.models import User, Group
-from rest_framework import serializers
+from rest_framework import serializers, ISO_8601
+from rest_framework.settings import api_settings
 
 from absortium import constants
-from absortium.model.models import Account, Order, Deposit, Withdrawal, MarketInfo
+from absortium.model.models import Account, Order, Deposit, Withdrawal, MarketInfo, Candle
 from absortium.utils import calculate_total_or_amount
 from core.serializer.fields import MyChoiceField
 from core.utils.logging import getPrettyLogger
@@ -12,15 +16,24 @@ __author__ = 'andrew.shvv@gmail.com'
 logger = getPrettyLogger(__name__)
 
 
-
 class AccountSerializer(serializers.ModelSerializer):
     currency = MyChoiceField(choices=constants.AVAILABLE_CURRENCIES)
 
+    # Snapshot plus the journal entries which are not folded yet
+    amount = serializers.DecimalField(source='balance',
+                                      max_digits=constants.ACCOUNT_MAX_DIGITS,
+                                      decimal_places=constants.DECIMAL_PLACES,
+                                      read_only=True)
+    frozen = serializers.DecimalField(source='frozen_balance',
+                                      max_digits=constants.ACCOUNT_MAX_DIGITS,
+                                      decimal_places=constants.DECIMAL_PLACES,
+                                      read_only=True)
+
     class Meta:
         lookup_field = 'currency'
         model = Account
-        fields = ('pk', 'address', 'currency', 'amount')
-        read_only_fields = ('address', 'amount')
+        fields = ('pk', 'address', 'currency', 'amount', 'frozen')
+        read_only_fields = ('address', 'amount', 'frozen')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -110,3 +123,109 @@ class MarketInfoSerializer(serializers.ModelSerializer):
     class Meta:
         model = MarketInfo
         fields = ('rate', 'rate_24h_max', 'rate_24h_min', 'volume_24h', 'pair')
+
+
+class CandleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Candle
+        fields = ('pair', 'resolution', 'start', 'open', 'high', 'low', 'close', 'amount', 'volume', 'count')
+
+
+def compile_field(name, field):
+    """
+        Turn the DRF field into (name, attribute, lookup, formatter): the attribute of the instance, the key of the
+        'values()' row and the function which gives the same representation as the field. Formatter is inlined only
+        for the fields whose 'to_representation' is not overridden, otherwise the field itself is used.
+    """
+
+    def inherits(cls):
+        return isinstance(field, cls) and type(field).to_representation is cls.to_representation
+
+    attribute = lookup = field.source
+
+    if inherits(serializers.DecimalField) and not getattr(field, 'localize', False) and \
+            getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        exponent = decimal.Decimal('.1') ** field.decimal_places
+        context = decimal.getcontext().copy()
+        context.prec = field.max_digits
+
+        def formatter(value):
+            if not isinstance(value, decimal.Decimal):
+                value = decimal.Decimal(str(value).strip())
+            return '{0:f}'.format(value.quantize(exponent, context=context))
+
+    elif inherits(serializers.DateTimeField) and \
+            str(getattr(field, 'format', api_settings.DATETIME_FORMAT)).lower() == ISO_8601:
+        def formatter(value):
+            if isinstance(value, str):
+                return value
+
+            value = value.isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+
+    elif inherits(serializers.ChoiceField):
+        choices = field.choice_strings_to_values
+
+        def formatter(value):
+            return choices.get(str(value), value)
+
+    elif inherits(serializers.CharField):
+        formatter = str
+
+    elif inherits(serializers.IntegerField):
+        formatter = int
+
+    else:
+        formatter = field.to_representation
+
+    return name, attribute, lookup, formatter
+
+
+class FastSerializer():
+    """
+        Output only counterpart of the model serializer for the hot paths (task results, websocket publications,
+        lists). Fields of the serializer are compiled once, so the representation is the plain attribute access
+        plus preformatted values, and it is equal to 'serializer_class(instance).data'.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._fields = None
+
+    @property
+    def fields(self):
+        # Compiled on the first use, DRF builds model fields only after apps are loaded
+        if self._fields is None:
+            self._fields = [compile_field(name, field)
+                            for name, field in self.serializer_class().fields.items() if not field.write_only]
+        return self._fields
+
+    def serialize(self, instance):
+        data = OrderedDict()
+
+        for name, attribute, _, formatter in self.fields:
+            value = getattr(instance, attribute)
+            data[name] = None if value is None else formatter(value)
+
+        return data
+
+    def serialize_many(self, instances):
+        return [self.serialize(instance) for instance in instances]
+
+    def serialize_values(self, queryset):
+        """
+            Serialize queryset from the 'values()' rows without model instances, fields should be model fields.
+        """
+        fields = self.fields
+        rows = queryset.values(*[lookup for _, _, lookup, _ in fields])
+
+        return [OrderedDict((name, None if row[lookup] is None else formatter(row[lookup]))
+                            for name, _, lookup, formatter in fields) for row in rows]
+
+
+order_serializer = FastSerializer(OrderSerializer)
+account_serializer = FastSerializer(AccountSerializer)
+market_info_serializer = FastSerializer(MarketInfoSerializer)
+candle_serializer = FastSerializer(CandleSerializer)
@@ -44,15 +44,27 @@ CELERY_BROKER = 'amqp://guest@docker.celery.broker//'
 CELERY_RESULT_BACKEND = 'redis://docker.celery.backend'
 
 ROUTER_URL = "http://docker.router:8080/publish"
+
+# Publications are written to the outbox table and sent to the router by 'dispatchpublications' command.
+ROUTER_OUTBOX = True
 ETHWALLET_URL = "http://docker.ethwallet:3000/"
 
+# Deposit, withdrawal and account tasks; order tasks have their own queue for every pair,
+# see absortium/celery/routers.py
 CELERY_DEFAULT_QUEUE = 'absortium'
 CELERY_QUEUES = (
     Queue('absortium', Exchange('absortium'), routing_key='absortium'),
 )
+CELERY_ROUTES = ('absortium.celery.routers.PairRouter',)
 
 MODE = get_attr_from_module(__name__, 'MODE')
 
+# Matching engine which is used for searching the counter-orders:
+#   'sql' - select counter-orders from db one by one.
+#   'book' - take counter-orders from the resident order book (absortium.engine.book), requires that all
+#   orders of the pair are processed by one worker process - the only consumer of the pair queue.
+MATCHING_ENGINE = 'sql'
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -107,6 +119,18 @@ CELERYBEAT_SCHEDULE = {
         'task': 'absortium.celery.tasks.pregenerate_accounts',
         'schedule': timedelta(seconds=20)
     },
+    'fold-balances-every-5-seconds': {
+        'task': 'absortium.celery.tasks.fold_balances',
+        'schedule': timedelta(seconds=5)
+    },
+    'rollup-candles-every-10-seconds': {
+        'task': 'absortium.celery.tasks.rollup_candles',
+        'schedule': timedelta(seconds=10)
+    },
+    'downsample-market-info-every-10-minutes': {
+        'task': 'absortium.celery.tasks.downsample_market_info',
+        'schedule': timedelta(minutes=10)
+    },
 }
 
 WSGI_APPLICATION = 'wsgi.application'
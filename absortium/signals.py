@@ -2,11 +2,12 @@
     In order to avoid cycle import problem we should separate models and signals
 """
 from absortium.celery import tasks
-from absortium.crossbarhttp import get_crossbar_client
-from absortium.model.models import Order, MarketInfo
-from absortium.serializers import MarketInfoSerializer, OrderSerializer
+from absortium.crossbarhttp import get_crossbar_client, publishment
+from absortium.engine import book
+from absortium.model.flush import orders_flushed, trades_flushed
+from absortium.model.models import Order, MarketInfo, Trade, PriceLevel, Candle
+from absortium.serializers import market_info_serializer, order_serializer
 from django.contrib.auth import get_user_model
-from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch.dispatcher import receiver
 
@@ -37,51 +38,76 @@ def user_post_save(sender, instance, *args, **kwargs):
         tasks.create_account.delay(**context)
 
 
+def history_notification(trade):
+    """
+        Both completed orders of the trade are published to the history topics of their types.
+    """
+    client = get_crossbar_client()
+
+    for order in (trade.maker, trade.taker):
+        topic = constants.TOPIC_HISTORY.format(pair=order.pair, type=order.type)
+        client.publish(topic, **order_serializer.serialize(order))
+
+
+def offers_notification(level):
+    """
+        Send websocket notification to the router if offers is changed.
+    """
+    topic = constants.TOPIC_OFFERS.format(pair=level.pair, type=level.type)
+
+    publishment = {
+        "amount": str(level.amount),
+        "total": str(level.total),
+        "pair": level.pair,
+        "type": level.type,
+        "price": str(level.price)
+    }
+
+    client = get_crossbar_client()
+    client.publish(topic, **publishment)
+
+
 @receiver(post_save, sender=Order, dispatch_uid="order_post_save")
 def order_post_save(sender, instance, *args, **kwargs):
     """
         Create or change offer object if order object is received and saved.
     """
+    order = instance
+    book.sync(order)
 
-    def history_notification(order):
-        if order.status == constants.ORDER_COMPLETED:
-            serializer = OrderSerializer(order)
-            publishment = serializer.data
-
-            topic = constants.TOPIC_HISTORY.format(pair=order.pair, type=order.type)
+    # Block numbers offers publications if they are not inside of the another block
+    with publishment.atomic():
+        for level in PriceLevel.apply([order]):
+            offers_notification(level)
 
-            client = get_crossbar_client()
-            client.publish(topic, **publishment)
 
-    def offers_notification(order):
-        """
-            Send websocket notification to the router if offers is changed.
-        """
+@receiver(orders_flushed, sender=Order, dispatch_uid="orders_flushed")
+def order_flushed(sender, orders, *args, **kwargs):
+    """
+        The same as 'order_post_save' but for all orders which were written by one flush, levels are changed with
+        one statement and offers notification is sent only once for every changed price level.
+    """
+    for order in orders:
+        book.sync(order)
 
-        orders = Order.objects.filter(Q(status=constants.ORDER_INIT) | Q(status=constants.ORDER_PENDING),
-                                      pair=order.pair,
-                                      type=order.type,
-                                      price=order.price)
+    with publishment.atomic():
+        for level in PriceLevel.apply(orders):
+            offers_notification(level)
 
-        amount = sum((offer.amount for offer in orders))
-        total = sum((offer.total for offer in orders))
 
-        topic = constants.TOPIC_OFFERS.format(pair=order.pair, type=order.type)
+@receiver(post_save, sender=Trade, dispatch_uid="trade_post_save")
+def trade_post_save(sender, instance, created, *args, **kwargs):
+    if created:
+        Candle.apply([instance])
+        history_notification(instance)
 
-        publishment = {
-            "amount": str(amount),
-            "total": str(total),
-            "pair": order.pair,
-            "type": order.type,
-            "price": str(order.price)
-        }
 
-        client = get_crossbar_client()
-        client.publish(topic, **publishment)
+@receiver(trades_flushed, sender=Trade, dispatch_uid="trades_flushed")
+def trade_flushed(sender, trades, *args, **kwargs):
+    Candle.apply(trades)
 
-    order = instance
-    history_notification(order)
-    offers_notification(order)
+    for trade in trades:
+        history_notification(trade)
 
 
 @receiver(post_save, sender=MarketInfo, dispatch_uid="market_info_post_save")
@@ -90,8 +116,7 @@ def market_info_post_save(sender, instance, *args, **kwargs):
         Send websocket notification to the router if offer is changed.
     """
     info = instance
-    serializer = MarketInfoSerializer(info)
-    publishment = serializer.data
+    publishment = market_info_serializer.serialize(info)
 
     client = get_crossbar_client()
     client.publish(constants.TOPIC_MARKET_INFO, **publishment)
@@ -4,7 +4,9 @@ import time
 from decimal import Decimal
 
 from absortium import celery_app
+from absortium.engine import book
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import override_settings
 from rest_framework.status import HTTP_200_OK
 from rest_framework.test import APITestCase, APIClient, APITransactionTestCase
@@ -87,7 +89,8 @@ class AbsoritumLiveTest(APITransactionTestCase,
 
 
 @override_settings(CELERY_EAGER_PROPAGATES_EXCEPTIONS=True,
-                   CELERY_ALWAYS_EAGER=True)
+                   CELERY_ALWAYS_EAGER=True,
+                   ROUTER_OUTBOX=False)
 class AbsoritumUnitTest(AbsortiumTestMixin,
                         CreateAccountMixin,
                         CreateDepositMixin,
@@ -102,6 +105,10 @@ class AbsoritumUnitTest(AbsortiumTestMixin,
                         APITestCase):
     def setUp(self):
         super().setUp()
+        # Db is rolled back after every test, so resident books should be rebuilt and cached snapshots dropped as well.
+        book.clear()
+        cache.clear()
+
         self.mock_router()
         self.mock_bitcoin_client()
         self.mock_ethereum_client()
@@ -163,8 +163,8 @@ class AccuracyTest(AbsoritumLiveTest):
 
     def check_accounts(self, contexts):
         for user, context in contexts.items():
-            btc_account_amount = Account.objects.get(pk=context['btc']['pk']).amount
-            eth_account_amount = Account.objects.get(pk=context['eth']['pk']).amount
+            btc_account_amount = Account.objects.get(pk=context['btc']['pk']).balance
+            eth_account_amount = Account.objects.get(pk=context['eth']['pk']).balance
 
             logger.debug(u"User pk: {} \n"
                          u"Account amount : {} BTC\n"
@@ -1,9 +1,9 @@
 __author__ = 'andrew.shvv@gmail.com'
 
-from celery.task import Task
 from django.db import connection
 from mock import patch
 
+from absortium.celery import base
 from core.utils.logging import getPrettyLogger
 
 logger = getPrettyLogger(__name__)
@@ -24,7 +24,7 @@ class CeleryMockMixin():
         self._celery_patcher.stop()
 
 
-class DBTask(Task):
+class DBTask(base.DBTask):
     abstract = True
 
     def on_retry(self, exc, task_id, args, kwargs, einfo):
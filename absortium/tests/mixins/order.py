@@ -65,6 +65,33 @@ class CreateOrderMixin():
 
         return order
 
+    def create_orders(self,
+                      orders,
+                      continue_on_error=None,
+                      user=None,
+                      with_checks=True,
+                      debug=False):
+        if continue_on_error is None:
+            data = orders
+        else:
+            data = {
+                'orders': orders,
+                'continue_on_error': continue_on_error
+            }
+
+        if user:
+            self.client.force_authenticate(user)
+
+        response = self.client.post('/api/orders/batch/', data=data, format='json')
+
+        if debug:
+            logger.debug(response.content)
+
+        if with_checks:
+            self.assertIn(response.status_code, [HTTP_201_CREATED, HTTP_204_NO_CONTENT])
+
+        return response
+
     def cancel_order(self,
                      pk,
                      user=None,
@@ -83,6 +110,38 @@ class CreateOrderMixin():
 
         self.assertIn(response.status_code, [HTTP_200_OK, HTTP_204_NO_CONTENT])
 
+    def cancel_orders(self,
+                      pair=None,
+                      order_type=None,
+                      price_min=None,
+                      price_max=None,
+                      user=None,
+                      debug=False):
+        data = {}
+
+        if pair:
+            data['pair'] = pair
+
+        if order_type:
+            data['type'] = order_type
+
+        if price_min:
+            data['price_min'] = price_min
+
+        if price_max:
+            data['price_max'] = price_max
+
+        if user:
+            self.client.force_authenticate(user)
+
+        response = self.client.post('/api/orders/cancel/', data=data, format='json')
+
+        if debug:
+            logger.debug(response.content)
+
+        self.assertIn(response.status_code, [HTTP_200_OK, HTTP_204_NO_CONTENT])
+        return response.json()
+
     def update_order(self,
                      pk,
                      amount=None,
@@ -0,0 +1,188 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import SimpleTestCase, override_settings
+
+from absortium import constants
+from absortium.engine import book
+from absortium.engine.book import OrderBook, BookOrder
+from absortium.model.models import Account, Order
+from absortium.tests.base import AbsoritumUnitTest
+from core.utils.logging import getLogger
+
+__author__ = 'andrew.shvv@gmail.com'
+
+logger = getLogger(__name__)
+
+
+class OrderBookTest(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = OrderBook(constants.PAIR_BTC_ETH)
+        self.pk = 0
+
+    def add(self, order_type, price, amount, owner_id=1, created=None):
+        self.pk += 1
+        self.book.add(BookOrder(pk=self.pk,
+                                owner_id=owner_id,
+                                type=order_type,
+                                price=Decimal(price),
+                                amount=Decimal(amount),
+                                created=created if created is not None else self.pk))
+        return self.pk
+
+    def candidates(self, order_type, price, amount, owner_id=2):
+        order = Order(type=order_type,
+                      price=Decimal(price),
+                      amount=Decimal(amount),
+                      pair=constants.PAIR_BTC_ETH,
+                      owner_id=owner_id)
+        return self.book.candidates(order)
+
+    def test_price_priority(self):
+        expensive = self.add(constants.ORDER_SELL, price="0.7", amount="1")
+        cheap = self.add(constants.ORDER_SELL, price="0.5", amount="1")
+        self.add(constants.ORDER_SELL, price="0.9", amount="1")
+
+        self.assertEqual(self.candidates(constants.ORDER_BUY, price="0.8", amount="5"), [cheap, expensive])
+
+        low = self.add(constants.ORDER_BUY, price="0.1", amount="1")
+        high = self.add(constants.ORDER_BUY, price="0.3", amount="1")
+        self.assertEqual(self.candidates(constants.ORDER_SELL, price="0.1", amount="5"), [high, low])
+
+    def test_time_priority(self):
+        second = self.add(constants.ORDER_SELL, price="1", amount="1", created=2)
+        first = self.add(constants.ORDER_SELL, price="1", amount="1", created=1)
+
+        self.assertEqual(self.candidates(constants.ORDER_BUY, price="1", amount="2"), [first, second])
+
+    def test_only_needed_amount(self):
+        first = self.add(constants.ORDER_SELL, price="1", amount="1")
+        second = self.add(constants.ORDER_SELL, price="1", amount="1")
+        self.add(constants.ORDER_SELL, price="1", amount="1")
+
+        self.assertEqual(self.candidates(constants.ORDER_BUY, price="1", amount="1.5"), [first, second])
+
+    def test_skip_own_orders(self):
+        self.add(constants.ORDER_SELL, price="1", amount="1", owner_id=2)
+        other = self.add(constants.ORDER_SELL, price="1", amount="1", owner_id=1)
+
+        self.assertEqual(self.candidates(constants.ORDER_BUY, price="1", amount="2", owner_id=2), [other])
+
+    def test_remove(self):
+        pk = self.add(constants.ORDER_SELL, price="1", amount="1")
+        self.book.remove(pk)
+
+        self.assertEqual(self.candidates(constants.ORDER_BUY, price="1", amount="1"), [])
+        self.assertEqual(self.book.sides[constants.ORDER_SELL].prices, [])
+
+
+class EngineTest(AbsoritumUnitTest):
+    """
+        Check that resident order book produces the same fills as selecting counter-orders from the db.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        User = get_user_model()
+        self.first_maker = User(username="first_maker")
+        self.first_maker.save()
+
+        self.second_maker = User(username="second_maker")
+        self.second_maker.save()
+
+        self.taker = self.user
+
+        for user in [self.first_maker, self.second_maker, self.taker]:
+            self.make_deposit(self.get_account('btc', user), amount="1000.0")
+            self.make_deposit(self.get_account('eth', user), amount="1000.0")
+
+    def run_scenario(self, engine, scenario):
+        sid = transaction.savepoint()
+        book.clear()
+
+        with override_settings(MATCHING_ENGINE=engine):
+            scenario()
+
+        orders = [(order.owner.username, order.type, order.price, order.amount, order.total, order.status)
+                  for order in Order.objects.order_by('pk')]
+
+        accounts = sorted([(account.owner.username, account.currency, account.balance, account.frozen_balance)
+                           for account in Account.objects.filter(owner__isnull=False)])
+
+        transaction.savepoint_rollback(sid)
+        book.clear()
+
+        return orders, accounts
+
+    def check_scenario(self, scenario):
+        sql = self.run_scenario(constants.MATCHING_ENGINE_SQL, scenario)
+        resident = self.run_scenario(constants.MATCHING_ENGINE_BOOK, scenario)
+
+        self.assertEqual(sql, resident)
+
+    def order(self, user, order_type, price, amount):
+        return self.create_order(user=user,
+                                 order_type=order_type,
+                                 price=price,
+                                 amount=amount,
+                                 with_checks=False)
+
+    def test_sweep(self):
+        def scenario():
+            self.order(self.first_maker, constants.ORDER_SELL, price="0.5", amount="3")
+            self.order(self.second_maker, constants.ORDER_SELL, price="0.6", amount="2")
+            self.order(self.first_maker, constants.ORDER_SELL, price="0.7", amount="4")
+            self.order(self.second_maker, constants.ORDER_SELL, price="0.9", amount="1")
+
+            self.order(self.taker, constants.ORDER_BUY, price="0.75", amount="8")
+
+        self.check_scenario(scenario)
+
+    def test_sell_sweep(self):
+        def scenario():
+            self.order(self.first_maker, constants.ORDER_BUY, price="0.5", amount="3")
+            self.order(self.second_maker, constants.ORDER_BUY, price="0.5", amount="2")
+            self.order(self.first_maker, constants.ORDER_BUY, price="0.4", amount="4")
+
+            self.order(self.taker, constants.ORDER_SELL, price="0.4", amount="6")
+            self.order(self.taker, constants.ORDER_SELL, price="0.45", amount="6")
+
+        self.check_scenario(scenario)
+
+    def test_skip_own_orders(self):
+        def scenario():
+            self.order(self.taker, constants.ORDER_SELL, price="0.5", amount="1")
+            self.order(self.first_maker, constants.ORDER_SELL, price="0.6", amount="1")
+
+            self.order(self.taker, constants.ORDER_BUY, price="0.6", amount="1")
+
+        self.check_scenario(scenario)
+
+    def test_cancel_and_update(self):
+        def scenario():
+            canceled = self.order(self.first_maker, constants.ORDER_SELL, price="0.5", amount="1")
+            updated = self.order(self.second_maker, constants.ORDER_SELL, price="0.9", amount="1")
+            self.order(self.first_maker, constants.ORDER_SELL, price="0.6", amount="1")
+
+            self.cancel_order(pk=canceled['pk'], user=self.first_maker)
+            self.update_order(pk=updated['pk'], price="0.55", amount="1", user=self.second_maker)
+
+            self.order(self.taker, constants.ORDER_BUY, price="0.6", amount="1.5")
+
+        self.check_scenario(scenario)
+
+    def test_lock_and_unlock(self):
+        def scenario():
+            locked = self.order(self.first_maker, constants.ORDER_SELL, price="0.5", amount="1")
+            self.order(self.second_maker, constants.ORDER_SELL, price="0.6", amount="1")
+
+            self.lock_order(pk=locked['pk'], user=self.first_maker)
+            self.order(self.taker, constants.ORDER_BUY, price="0.6", amount="0.5")
+
+            self.order(self.taker, constants.ORDER_BUY, price="0.5", amount="1")
+            self.unlock_order(pk=locked['pk'], user=self.first_maker)
+
+        self.check_scenario(scenario)
@@ -0,0 +1,121 @@
+from decimal import Decimal as D
+
+from django.contrib.auth import get_user_model
+from freezegun import freeze_time
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
+
+from absortium import constants
+from absortium.celery import tasks
+from absortium.model.models import Candle
+from absortium.tests.base import AbsoritumUnitTest
+from core.utils.logging import getLogger
+
+__author__ = "andrew.shvv@gmail.com"
+
+logger = getLogger(__name__)
+
+# 2012-01-14 00:00:00 UTC
+DAY_START = 1326499200
+
+
+class CandleTest(AbsoritumUnitTest):
+    def setUp(self):
+        super().setUp()
+
+        User = get_user_model()
+        self.some_user = User(username="some_user")
+        self.some_user.save()
+
+        self.make_deposit(self.get_account("btc", self.user), amount="999999.0")
+        self.make_deposit(self.get_account("eth", self.some_user), amount="999999.0")
+
+        self.trade("2012-01-14 00:00:10", price="1.0", total="1.0")
+        self.trade("2012-01-14 00:00:50", price="2.0", total="3.0")
+        self.trade("2012-01-14 00:01:30", price="0.5", total="1.0")
+        self.trade("2012-01-14 00:07:00", price="3.0", total="3.0")
+
+    def trade(self, time, price, total):
+        with freeze_time(time):
+            self.create_order(user=self.user, order_type=constants.ORDER_BUY, total=total, price=price, status="init")
+            self.create_order(user=self.some_user, order_type=constants.ORDER_SELL, total=total, price=price)
+
+    def get_candles(self, resolution):
+        candles = Candle.objects.filter(pair=constants.PAIR_BTC_ETH, resolution=resolution).order_by('start')
+        return [(c.start.minute, c.open, c.high, c.low, c.close, c.volume, c.count) for c in candles]
+
+    def request_candles(self, **params):
+        params.setdefault('pair', constants.PAIR_BTC_ETH)
+
+        response = self.client.get('/api/candles/', data=params, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return response.json()
+
+    def test_trades(self):
+        self.assertEqual(self.get_candles(constants.CANDLE_1M), [
+            (0, 1, 2, 1, 2, 4, 2),
+            (1, D("0.5"), D("0.5"), D("0.5"), D("0.5"), 1, 1),
+            (7, 3, 3, 3, 3, 3, 1),
+        ])
+
+    def test_rollup(self):
+        tasks.rollup_candles.delay()
+
+        self.assertEqual(self.get_candles(constants.CANDLE_5M), [
+            (0, 1, 2, D("0.5"), D("0.5"), 5, 3),
+            (5, 3, 3, 3, 3, 3, 1),
+        ])
+        self.assertEqual(self.get_candles(constants.CANDLE_1H), [(0, 1, 3, D("0.5"), 3, 8, 4)])
+        self.assertEqual(self.get_candles(constants.CANDLE_1D), [(0, 1, 3, D("0.5"), 3, 8, 4)])
+
+        # Only the last periods are recalculated, candle of the new trade is added to them
+        self.trade("2012-01-14 00:08:00", price="4.0", total="4.0")
+        tasks.rollup_candles.delay()
+
+        self.assertEqual(self.get_candles(constants.CANDLE_5M), [
+            (0, 1, 2, D("0.5"), D("0.5"), 5, 3),
+            (5, 3, 4, 3, 4, 7, 2),
+        ])
+        self.assertEqual(self.get_candles(constants.CANDLE_1D), [(0, 1, 4, D("0.5"), 4, 12, 5)])
+
+    def test_api(self):
+        tasks.rollup_candles.delay()
+
+        candles = self.request_candles(resolution=constants.CANDLE_5M)
+        self.assertEqual([D(candle['close']) for candle in candles], [D("0.5"), 3])
+        self.assertEqual(candles[0]['resolution'], constants.CANDLE_5M)
+
+        candles = self.request_candles(resolution=constants.CANDLE_5M, **{'from': DAY_START + 5 * 60})
+        self.assertEqual([D(candle['close']) for candle in candles], [3])
+
+        candles = self.request_candles(resolution=constants.CANDLE_5M, to=DAY_START + 4 * 60)
+        self.assertEqual([D(candle['close']) for candle in candles], [D("0.5")])
+
+        # 1m by default
+        self.assertEqual(len(self.request_candles()), 3)
+
+    def test_rollup_batch(self):
+        self.trade("2012-01-14 00:08:00", price="4.0", total="4.0")
+
+        # Every run takes not more than three 1m candles, the cut period is recalculated by the next run
+        Candle.rollup(constants.CANDLE_1M, constants.CANDLE_5M, 5 * 60, batch=3)
+        self.assertEqual(self.get_candles(constants.CANDLE_5M), [
+            (0, 1, 2, D("0.5"), D("0.5"), 5, 3),
+            (5, 3, 3, 3, 3, 3, 1),
+        ])
+
+        Candle.rollup(constants.CANDLE_1M, constants.CANDLE_5M, 5 * 60, batch=3)
+        self.assertEqual(self.get_candles(constants.CANDLE_5M), [
+            (0, 1, 2, D("0.5"), D("0.5"), 5, 3),
+            (5, 3, 4, 3, 4, 7, 2),
+        ])
+
+    def test_malformed(self):
+        for params in [{'resolution': '2m'}, {'from': 'yesterday'}, {'to': 'tomorrow'}]:
+            params['pair'] = constants.PAIR_BTC_ETH
+
+            response = self.client.get('/api/candles/', data=params, format='json')
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+        # Pair is required
+        response = self.client.get('/api/candles/', data={}, format='json')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
@@ -1,7 +1,15 @@
 __author__ = "andrew.shvv@gmail.com"
 
+import threading
+import mock
+
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase
+
 from absortium.crossbarhttp import publishment
-from absortium.crossbarhttp.client import get_crossbar_client
+from absortium.crossbarhttp.client import Client, get_crossbar_client, set_crossbar_client
+from absortium.management.commands.publishbenchmark import Router
+from absortium.model.models import BookSequence
 
 from core.utils.logging import getLogger
 from absortium.tests.base import AbsoritumUnitTest
@@ -39,3 +47,86 @@ class PublishmentsTest(AbsoritumUnitTest):
             self.assertEqual(self.get_publishments("sometopic"), None)
 
         self.assertNotEqual(self.get_publishments("sometopic"), None)
+
+    def test_publishments_coalesced(self):
+        """
+            Only the last state of the offers level is published, other publishments are appended.
+        """
+        with publishment.atomic():
+            client = get_crossbar_client()
+            client.publish("offers_btc_eth_buy", price="1", amount="1")
+            client.publish("offers_btc_eth_buy", price="2", amount="1")
+            client.publish("offers_btc_eth_buy", price="1", amount="2")
+            client.publish("history_btc_eth_buy", price="1", amount="1")
+            client.publish("history_btc_eth_buy", price="1", amount="1")
+
+            with publishment.atomic():
+                get_crossbar_client().publish("offers_btc_eth_buy", price="2", amount="0")
+
+        self.assertEqual(self.get_publishments("offers_btc_eth_buy"), [{'price': "1", 'amount': "2"},
+                                                                       {'price': "2", 'amount': "0"}])
+        self.assertEqual(len(self.get_publishments("history_btc_eth_buy")), 2)
+
+    def test_router_failure(self):
+        """
+            Router failure after the commit doesn't fail the block, offers are numbered before the commit.
+        """
+        client_before = get_crossbar_client()
+        set_crossbar_client(FailingClient())
+
+        try:
+            with publishment.atomic():
+                get_crossbar_client().publish("offers_btc_eth_buy", pair="btc_eth", price="1", amount="1")
+        finally:
+            set_crossbar_client(client_before)
+
+        self.assertEqual(BookSequence.current("btc_eth"), 1)
+
+    def test_sequence_failure(self):
+        """
+            Failure of the numbering rolls back the changes of the block.
+        """
+        with mock.patch.object(BookSequence, 'next', side_effect=OperationalError("Statement timeout")):
+            with self.assertRaises(OperationalError):
+                with publishment.atomic():
+                    BookSequence(pair="eth_btc", sequence=100).save()
+                    get_crossbar_client().publish("offers_btc_eth_buy", pair="btc_eth", price="1", amount="1")
+
+        self.assertEqual(BookSequence.current("eth_btc"), 0)
+        self.assertEqual(self.get_publishments("offers_btc_eth_buy"), None)
+
+
+class FailingClient():
+    def publish(self, topic, **publishment):
+        raise Exception("Router is not available")
+
+
+class ClientTest(SimpleTestCase):
+    def setUp(self):
+        self.router = Router()
+        threading.Thread(target=self.router.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.router.shutdown()
+        self.router.server_close()
+
+    def test_threads(self):
+        """
+            One client is shared by the threads: every publication gets its own sequence number.
+        """
+        client = Client(self.router.url, key="key", secret="secret")
+        ids = []
+
+        def run():
+            for _ in range(50):
+                ids.append(client.publish("sometopic", text="sometext"))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(ids), list(range(1, 201)))
+        self.assertEqual(client.sequence, 201)
+        self.assertEqual(client.publish_many([("sometopic", {"text": "sometext"})] * 2), [201, 202])
@@ -1,4 +1,5 @@
 from absortium import constants
+from absortium.model.models import Trade
 from django.contrib.auth import get_user_model
 
 from core.utils.logging import getLogger
@@ -52,6 +53,27 @@ class HistoryTest(AbsoritumUnitTest):
         self.assertEqual(len(self.get_orders_history(order_type=constants.ORDER_SELL)), 2)
         self.assertEqual(len(self.get_orders_history(order_type=constants.ORDER_BUY)), 2)
 
+    def test_history_from_trades(self):
+        """
+            Check that history rows are the maker and taker orders of the trades.
+        """
+        self.create_order(order_type=constants.ORDER_BUY, price="1", amount="1", status="init")
+
+        self.client.force_authenticate(self.some_user)
+        self.create_order(order_type=constants.ORDER_SELL, price="1", amount="1", status="completed")
+
+        trade = Trade.objects.get()
+        history = self.get_orders_history()
+        self.assertEqual(sorted(order['pk'] for order in history), sorted([trade.maker_id, trade.taker_id]))
+
+        sells = self.get_orders_history(order_type=constants.ORDER_SELL)
+        self.assertEqual([order['pk'] for order in sells], [trade.taker_id])
+        self.assertEqual(sells[0]['status'], constants.ORDER_COMPLETED)
+
+        # Completed order without the trade is not in the history
+        Trade.objects.all().delete()
+        self.assertEqual(self.get_orders_history(), [])
+
     def test_history_notifications(self):
         """
             Check that we get only orders which belong to the user.
@@ -63,3 +85,21 @@ class HistoryTest(AbsoritumUnitTest):
 
         self.assertEqual(len(self.get_publishments('history_btc_eth_sell')), 1)
         self.assertEqual(len(self.get_publishments('history_btc_eth_buy')), 1)
+
+    def test_trade(self):
+        self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="2", status="init")
+
+        self.client.force_authenticate(self.some_user)
+        taker = self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount="1", status="completed")
+
+        trade = Trade.objects.get()
+        self.assertEqual(trade.side, constants.ORDER_SELL)
+        self.assertEqual(trade.taker_id, taker['pk'])
+        self.assertEqual(trade.maker.owner, self.user)
+        self.assertEqual(trade.price, self.to_dec("0.5"))
+        self.assertEqual(trade.amount, self.to_dec("1"))
+        self.assertEqual(trade.total, self.to_dec("0.5"))
+
+        # Both completed orders of the trade are published in the order shape
+        self.assertEqual(self.get_publishment('history_btc_eth_sell')['pk'], trade.taker_id)
+        self.assertEqual(self.get_publishment('history_btc_eth_buy')['pk'], trade.maker_id)
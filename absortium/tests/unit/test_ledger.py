@@ -0,0 +1,108 @@
+from decimal import Decimal as D
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from absortium import constants
+from absortium.celery import tasks
+from absortium.model import ledger
+from absortium.model.models import Account, BalanceEntry
+from absortium.tests.base import AbsoritumUnitTest
+from core.utils.logging import getLogger
+
+__author__ = "andrew.shvv@gmail.com"
+
+logger = getLogger(__name__)
+
+
+class LedgerTest(AbsoritumUnitTest):
+    def setUp(self):
+        super().setUp()
+
+        self.make_deposit(self.get_account("btc"), amount="10.0")
+        self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="2", status=constants.ORDER_INIT)
+
+        User = get_user_model()
+        self.some_user = User(username="some_user")
+        self.some_user.save()
+
+        self.client.force_authenticate(self.some_user)
+        self.make_deposit(self.get_account("eth"), amount="10.0")
+
+        # 'some_user' is the taker, accounts of the maker are not locked
+        self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount="1")
+
+    def get_db_account(self, currency, user=None):
+        return Account.objects.get(owner=user or self.user, currency=currency)
+
+    def test_journal(self):
+        self.assertEqual(BalanceEntry.objects.filter(account__owner=self.user).count(), 2)
+        self.assertEqual(BalanceEntry.objects.filter(account__owner=self.some_user).count(), 0)
+
+        # Snapshot of the maker account is not changed by the match
+        btc = self.get_db_account("btc")
+        self.assertEqual(btc.amount, D("9.0"))
+        self.assertEqual(btc.frozen, D("1.0"))
+
+        self.assertEqual(btc.balance, D("9.0"))
+        self.assertEqual(btc.frozen_balance, D("0.5"))
+
+        self.client.force_authenticate(self.user)
+        account = self.get_account("btc")
+        self.assertEqual(D(account['amount']), D("9.0"))
+        self.assertEqual(D(account['frozen']), D("0.5"))
+        self.check_account_amount(self.get_account("eth"), amount="1.0")
+
+        self.assertEqual(ledger.check(), [])
+
+    def test_fold_on_lock(self):
+        self.client.force_authenticate(self.user)
+        self.create_order(order_type=constants.ORDER_BUY, price="0.1", amount="1", status=constants.ORDER_INIT)
+
+        self.assertEqual(BalanceEntry.objects.filter(account__owner=self.user).count(), 0)
+
+        btc = self.get_db_account("btc")
+        self.assertEqual(btc.amount, D("8.9"))
+        self.assertEqual(btc.frozen, D("0.6"))
+        self.assertEqual(self.get_db_account("eth").amount, D("1.0"))
+
+        self.assertEqual(ledger.check(), [])
+
+    def test_fold_balances(self):
+        tasks.fold_balances.apply().get()
+
+        self.assertEqual(BalanceEntry.objects.count(), 0)
+
+        btc = self.get_db_account("btc")
+        self.assertEqual(btc.amount, D("9.0"))
+        self.assertEqual(btc.frozen, D("0.5"))
+        self.assertEqual(self.get_db_account("eth").amount, D("1.0"))
+
+        self.assertEqual(ledger.check(), [])
+
+    def test_mismatch(self):
+        eth = self.get_db_account("eth")
+        Account.update(pk=eth.pk, amount=eth.amount + 1)
+
+        mismatches = ledger.check()
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(mismatches[0]['pk'], eth.pk)
+        self.assertEqual(mismatches[0]['expected_amount'], D("1.0"))
+
+        self.assertEqual(ledger.check(owner_ids=[self.some_user.pk]), [])
+
+    def test_list(self):
+        self.client.force_authenticate(self.user)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/accounts/', format='json')
+
+        # Journal of all accounts is summed with one select
+        journal = [query for query in context.captured_queries if 'absortium_balanceentry' in query['sql']]
+        self.assertEqual(len(journal), 1)
+
+        accounts = {account['currency']: account for account in response.json()}
+        self.assertEqual(D(accounts['btc']['amount']), D("9.0"))
+        self.assertEqual(D(accounts['btc']['frozen']), D("0.5"))
+        self.assertEqual(D(accounts['eth']['amount']), D("1.0"))
@@ -1,8 +1,11 @@
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from freezegun import freeze_time
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
 
 from absortium import constants
 from absortium.celery import tasks
+from absortium.model.models import Candle, MarketInfo
 from absortium.tests.base import AbsoritumUnitTest
 from core.utils.logging import getLogger
 
@@ -198,3 +201,96 @@ class MarketInfoTest(AbsoritumUnitTest):
         self.assertEqual(self.to_dec(p["volume_24h"]), 2.0)
         self.assertEqual(self.to_dec(p["rate_24h_max"]), 1.0)
         self.assertEqual(self.to_dec(p["rate_24h_min"]), 1.0)
+
+    def test_candles(self):
+        self.make_deposit(self.get_account("btc", self.user), amount="999999.0")
+        self.make_deposit(self.get_account("eth", self.some_user), amount="999999.0")
+
+        with freeze_time("2012-01-14 00:00:10"):
+            self.create_order(user=self.user, order_type=constants.ORDER_BUY, total="1.0", price="1.0", status="init")
+            self.create_order(user=self.some_user, order_type=constants.ORDER_SELL, total="1.0", price="1.0")
+
+        with freeze_time("2012-01-14 00:00:50"):
+            self.create_order(user=self.user, order_type=constants.ORDER_BUY, total="3.0", price="2.0", status="init")
+            self.create_order(user=self.some_user, order_type=constants.ORDER_SELL, total="3.0", price="2.0")
+
+        # Both trades are in one minute candle
+        candle = Candle.objects.get(pair=constants.PAIR_BTC_ETH, resolution=constants.CANDLE_1M)
+        self.assertEqual(candle.count, 2)
+        self.assertEqual(candle.high, 2)
+        self.assertEqual(candle.low, 1)
+        self.assertEqual(candle.volume, 4)
+
+        with freeze_time("2012-01-15 00:00:00"):
+            tasks.calculate_market_info.delay()
+            last_info = self.get_market_info()
+
+            # Both orders of every trade are counted, as before the candles
+            self.assertEqual(self.to_dec(last_info["volume_24h"]), 8.0)
+            self.assertEqual(self.to_dec(last_info["rate_24h_max"]), 2.0)
+            self.assertEqual(self.to_dec(last_info["rate_24h_min"]), 1.0)
+
+        # Candle is not counted once it is started out of the window
+        with freeze_time("2012-01-15 00:00:01"):
+            tasks.calculate_market_info.delay()
+            last_info = self.get_market_info()
+
+            self.assertEqual(self.to_dec(last_info["volume_24h"]), 0.0)
+
+    def create_infos(self, *times):
+        for time in times:
+            with freeze_time(time):
+                MarketInfo(pair=constants.PAIR_BTC_ETH, rate=1, rate_24h_max=1, rate_24h_min=1, volume_24h=1).save()
+
+    def get_info_times(self):
+        return [info.created.strftime("%Y-%m-%d %H:%M") for info in MarketInfo.objects.order_by('created')]
+
+    def test_downsample(self):
+        self.create_infos("2012-01-10 00:00:00", "2012-01-10 00:20:00", "2012-01-10 00:40:00", "2012-01-10 01:10:00",
+                          "2012-01-11 23:50:00")
+
+        # The last snapshot of the every hour is kept, the recent ones are not touched
+        with freeze_time("2012-01-12 00:00:00"):
+            deleted = tasks.downsample_market_info.delay().get()
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(self.get_info_times(), ["2012-01-10 00:40", "2012-01-10 01:10", "2012-01-11 23:50"])
+
+        # The last snapshot of the every day is kept, snapshots are walked by one
+        with freeze_time("2012-02-20 00:00:00"):
+            deleted = MarketInfo.downsample(timezone.now(), batch=1)
+
+        self.assertEqual(deleted, 1)
+        self.assertEqual(self.get_info_times(), ["2012-01-10 01:10", "2012-01-11 23:50"])
+
+    def test_downsample_from_mark(self):
+        self.create_infos("2012-01-10 00:00:00", "2012-01-10 00:20:00")
+
+        with freeze_time("2012-01-12 00:00:00"):
+            self.assertEqual(MarketInfo.downsample(timezone.now()), 1)
+
+        # Next run is started from the boundary reached by the previous one, older snapshots are not walked again
+        self.create_infos("2012-01-10 00:30:00", "2012-01-11 00:10:00", "2012-01-11 00:20:00")
+
+        with freeze_time("2012-01-12 02:00:00"):
+            self.assertEqual(MarketInfo.downsample(timezone.now()), 1)
+
+        self.assertEqual(self.get_info_times(), ["2012-01-10 00:20", "2012-01-10 00:30", "2012-01-11 00:20"])
+
+    def test_time_range(self):
+        self.create_infos("2012-01-10 00:00:00", "2012-01-10 00:00:20", "2012-01-10 00:00:40")
+
+        # 2012-01-10 00:00:00 UTC
+        start = 1326153600
+
+        response = self.client.get('/api/marketinfo/', data={'from': start + 10, 'to': start + 40}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.json()), 2)
+
+        response = self.client.get('/api/marketinfo/', data={'to': start + 30, 'count': 1}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.json()), 1)
+
+        for count in [0, constants.MARKET_INFO_MAX_COUNT + 1]:
+            response = self.client.get('/api/marketinfo/', data={'count': count}, format='json')
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
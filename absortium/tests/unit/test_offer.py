@@ -2,8 +2,10 @@ import decimal
 import random
 
 from django.contrib.auth import get_user_model
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST
 
 from absortium import constants
+from absortium.model.models import Order, PriceLevel
 from absortium.tests.base import AbsoritumUnitTest
 from core.utils.logging import getLogger
 
@@ -111,7 +113,11 @@ class OfferTest(AbsoritumUnitTest):
         self.create_order(user=self.user, order_type=constants.ORDER_BUY, status=constants.ORDER_COMPLETED)
 
         self.assertEqual(len(self.get_publishments("offers_btc_eth_sell")), 2)
-        self.assertEqual(len(self.get_publishments("offers_btc_eth_buy")), 2)
+
+        # Order was added to the level and removed from it by the same task, only the last state is published
+        buy = self.get_publishments("offers_btc_eth_buy")
+        self.assertEqual(len(buy), 1)
+        self.assertEqual(decimal.Decimal(buy[0]['amount']), 0)
 
     def test_update_order(self):
         order = self.create_order(order_type=constants.ORDER_SELL, amount="1.0", price="1.0",
@@ -123,6 +129,123 @@ class OfferTest(AbsoritumUnitTest):
         self.cancel_order(order['pk'])
         self.check_offers_empty()
 
+    def check_levels(self):
+        """
+            Levels are equal to the levels calculated from the open orders.
+        """
+        levels = {}
+        for order in Order.objects.filter(status__in=constants.ORDER_OPEN_STATUSES):
+            level = levels.setdefault((order.pair, order.type, order.price), [0, 0, 0])
+            level[0] += order.amount
+            level[1] += order.total
+            level[2] += 1
+
+        self.assertEqual({(level.pair, level.type, level.price): [level.amount, level.total, level.order_count]
+                          for level in PriceLevel.objects.all()}, levels)
+
+    def test_levels(self):
+        first = self.create_order(order_type=constants.ORDER_BUY, amount="2", price="1", status=constants.ORDER_INIT)
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="1", status=constants.ORDER_INIT)
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="0.5", status=constants.ORDER_INIT)
+        self.check_levels()
+
+        self.client.force_authenticate(self.some_user)
+        self.create_order(order_type=constants.ORDER_SELL, amount="1", price="1")
+        self.check_levels()
+
+        self.client.force_authenticate(self.user)
+        self.update_order(pk=first['pk'], price="0.5", amount="1")
+        self.check_levels()
+
+        self.cancel_orders()
+        self.check_levels()
+        self.assertEqual(PriceLevel.objects.count(), 0)
+
+    def get_sequences(self):
+        publishments = self.get_publishments("offers_btc_eth_buy") + self.get_publishments("offers_btc_eth_sell")
+        return sorted(publishment['sequence'] for publishment in publishments)
+
+    def get_snapshot(self):
+        response = self.client.get('/api/offers/snapshot/', data={'pair': constants.PAIR_BTC_ETH}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return response.json()
+
+    def test_sequence(self):
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="1", status=constants.ORDER_INIT)
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="2", status=constants.ORDER_INIT)
+
+        self.client.force_authenticate(self.some_user)
+        self.create_order(order_type=constants.ORDER_SELL, amount="1", price="3", status=constants.ORDER_INIT)
+        self.create_order(order_type=constants.ORDER_SELL, amount="2", price="1")
+
+        # sell level of the taker and two buy levels
+        sequences = self.get_sequences()
+        self.assertEqual(sequences, list(range(1, 7)))
+
+        snapshot = self.get_snapshot()
+        self.assertEqual(snapshot['sequence'], 6)
+        self.assertEqual(snapshot['buy'], [])
+        self.assertEqual([(decimal.Decimal(level['price']), decimal.Decimal(level['amount']))
+                          for level in snapshot['sell']], [(3, 1)])
+
+    def test_snapshot_cache(self):
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="1", status=constants.ORDER_INIT)
+
+        snapshot = self.get_snapshot()
+        self.assertEqual(snapshot['sequence'], 1)
+
+        # Snapshot is not rebuilt while the sequence is the same
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_snapshot(), snapshot)
+
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="1", status=constants.ORDER_INIT)
+
+        snapshot = self.get_snapshot()
+        self.assertEqual(snapshot['sequence'], 2)
+        self.assertEqual(decimal.Decimal(snapshot['buy'][0]['amount']), 2)
+
+    def test_depth(self):
+        for price in ["1", "2", "3"]:
+            self.create_order(order_type=constants.ORDER_BUY, amount="1", price=price, status=constants.ORDER_INIT)
+
+        self.client.force_authenticate(self.some_user)
+        for price in ["4", "5", "6"]:
+            self.create_order(order_type=constants.ORDER_SELL, amount="1", price=price, status=constants.ORDER_INIT)
+
+        response = self.client.get('/api/offers/', data={'pair': constants.PAIR_BTC_ETH, 'depth': 2}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        # Best two levels of the every side, in the order of price
+        self.assertEqual([(offer['type'], decimal.Decimal(offer['price'])) for offer in response.json()],
+                         [(constants.ORDER_BUY, 2), (constants.ORDER_BUY, 3),
+                          (constants.ORDER_SELL, 4), (constants.ORDER_SELL, 5)])
+
+        for depth in [0, constants.OFFERS_MAX_DEPTH + 1, "a"]:
+            response = self.client.get('/api/offers/', data={'depth': depth}, format='json')
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_not_modified(self):
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="1", status=constants.ORDER_INIT)
+
+        data = {'pair': constants.PAIR_BTC_ETH}
+        response = self.client.get('/api/offers/', data=data, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.client.get('/api/offers/', data=data, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+        # Other depth is the other representation
+        response = self.client.get('/api/offers/', data=dict(data, depth=1), format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        self.create_order(order_type=constants.ORDER_BUY, amount="1", price="1", status=constants.ORDER_INIT)
+
+        response = self.client.get('/api/offers/', data=data, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(decimal.Decimal(response.json()[0]['amount']), 2)
+
     def test_malformed_pair(self):
         malformed_pair = "asdasd907867t67g"
         with self.assertRaises(AssertionError):
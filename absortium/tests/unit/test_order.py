@@ -1,8 +1,17 @@
+import mock
 from django.contrib.auth import get_user_model
-from rest_framework.status import HTTP_404_NOT_FOUND
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
 
 from absortium import constants
+from absortium.model.locks import get_opposites
+from absortium.model.models import Account, BalanceEntry, Order
+from absortium.serializers import OrderSerializer
 from absortium.tests.base import AbsoritumUnitTest
+from core.serializer.fields import MyChoiceField
 from core.utils.logging import getLogger
 
 __author__ = "andrew.shvv@gmail.com"
@@ -150,6 +159,24 @@ class CreateTest(BaseTest):
         self.check_account_amount(self.primary_btc_account, amount="2.0")
         self.check_account_amount(self.primary_eth_account, amount="16.0")
 
+    def test_sweep_more_than_batch(self):
+        """
+            Create more opposite orders than one select claims, all of them should be processed
+        """
+        n = constants.ORDER_MATCHING_BATCH_SIZE + 2
+
+        for _ in range(n):
+            self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="1", status=constants.ORDER_INIT)
+
+        self.client.force_authenticate(self.some_user)
+        self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount=str(n))
+        self.check_account_amount(self.some_btc_account, amount=str(0.5 * n))
+        self.assertEqual(len(self.get_orders(constants.ORDER_SELL)), n)
+
+        self.client.force_authenticate(self.user)
+        self.check_account_amount(self.primary_eth_account, amount=str(n))
+        self.assertEqual(len(self.get_orders(constants.ORDER_BUY)), n)
+
     def test_same_account(self):
         """
             Create opposite orders on the same account
@@ -508,6 +535,151 @@ class UpdateTest(BaseTest):
             self.update_order(pk=order['pk'], amount="2.0")
 
 
+class BatchTest(BaseTest):
+    def order(self, order_type=constants.ORDER_BUY, price="0.5", amount="1", pair=constants.PAIR_BTC_ETH):
+        return {
+            'type': order_type,
+            'price': price,
+            'amount': amount,
+            'pair': pair
+        }
+
+    def test_batch(self):
+        response = self.create_orders([self.order(price="0.1"), self.order(price="0.2"), self.order(price="0.3")])
+
+        results = response.json()
+        self.assertEqual(len(results), 3)
+
+        for result in results:
+            self.assertEqual(result['history'][-1]['status'], constants.ORDER_INIT)
+
+        self.assertEqual(len(self.get_orders(constants.ORDER_BUY)), 3)
+        self.check_account_amount(self.primary_btc_account, amount="9.4")
+
+    def test_batch_matching(self):
+        self.client.force_authenticate(self.some_user)
+        self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount="3", status=constants.ORDER_INIT)
+
+        # Every order of the batch should see the fills of the previous ones
+        self.client.force_authenticate(self.user)
+        response = self.create_orders([self.order(amount="1"), self.order(amount="1"), self.order(amount="2")])
+
+        statuses = [result['history'][-1]['status'] for result in response.json()]
+        self.assertEqual(statuses, [constants.ORDER_COMPLETED, constants.ORDER_COMPLETED, constants.ORDER_PENDING])
+
+        # Remainder of the last order is still frozen
+        self.check_account_amount(self.primary_eth_account, amount="3")
+        self.check_account_amount(self.primary_btc_account, amount="8.0")
+
+    def test_not_enough_money(self):
+        response = self.create_orders([self.order(amount="10"), self.order(amount="11")], with_checks=False)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+        # Nothing should be created
+        self.assertEqual(len(self.get_orders()), 0)
+        self.check_account_amount(self.primary_btc_account, amount="10.0")
+
+    def test_continue_on_error(self):
+        response = self.create_orders([self.order(amount="10"), self.order(amount="11"), self.order(price="abc")],
+                                      continue_on_error=True)
+
+        results = response.json()
+        self.assertIn('history', results[0])
+        self.assertEqual(results[1]['error_id'], constants.ERROR_NOT_ENOUGH_MONEY)
+        self.assertEqual(results[2]['error_id'], constants.ERROR_VALIDATION)
+
+        self.assertEqual(len(self.get_orders()), 1)
+        self.check_account_amount(self.primary_btc_account, amount="5.0")
+
+    def test_different_pairs(self):
+        response = self.create_orders([self.order(), self.order(pair="eth_btc")], with_checks=False)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_validation(self):
+        # Every order is validated before the batch is enqueued
+        response = self.create_orders([self.order(), self.order(price="0.0001", amount="0.0001")], with_checks=False)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.get_orders()), 0)
+
+
+class MassCancelTest(BaseTest):
+    def test_cancel_all(self):
+        self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="2", status=constants.ORDER_INIT)
+        self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="4", status=constants.ORDER_INIT)
+        locked = self.create_order(order_type=constants.ORDER_BUY, price="0.4", amount="1", status=constants.ORDER_INIT)
+        self.lock_order(pk=locked['pk'])
+        self.check_account_amount(self.primary_btc_account, amount="6.6")
+
+        self.publishments_flush()
+        orders = self.cancel_orders()
+
+        self.assertEqual(len(orders), 3)
+        for order in orders:
+            self.assertEqual(order['status'], constants.ORDER_CANCELED)
+
+        self.check_account_amount(self.primary_btc_account, amount="10.0")
+
+        # One publication per price level
+        offers = self.get_publishments("offers_btc_eth_buy")
+        self.assertEqual(len(offers), 2)
+        for offer in offers:
+            self.assertEqual(self.to_dec(offer['amount']), 0)
+
+    def test_cancel_all_pairs(self):
+        # There is only one pair yet, add the reversed one to cancel the orders of several pairs by the chord
+        pairs = [constants.PAIR_BTC_ETH, 'eth_btc']
+        pair_field = MyChoiceField(choices=pairs, default=constants.PAIR_BTC_ETH)
+
+        with mock.patch.object(constants, 'AVAILABLE_CURRENCY_PAIRS', pairs), \
+             mock.patch.dict(OrderSerializer._declared_fields, {'pair': pair_field}):
+            self.client.force_authenticate(self.user)
+            self.make_deposit(self.primary_eth_account, amount="5.0")
+
+            self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="2", status=constants.ORDER_INIT)
+            self.create_order(order_type=constants.ORDER_BUY, price="0.4", amount="5", status=constants.ORDER_INIT)
+            self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="4", pair='eth_btc',
+                              status=constants.ORDER_INIT)
+            self.check_account_amount(self.primary_btc_account, amount="7.0")
+            self.check_account_amount(self.primary_eth_account, amount="3.0")
+
+            orders = self.cancel_orders()
+
+            self.assertEqual(sorted([order['pair'] for order in orders]),
+                             [constants.PAIR_BTC_ETH, constants.PAIR_BTC_ETH, 'eth_btc'])
+            for order in orders:
+                self.assertEqual(order['status'], constants.ORDER_CANCELED)
+
+            self.assertFalse(Order.objects.filter(owner=self.user).exclude(status=constants.ORDER_CANCELED).exists())
+            self.check_account_amount(self.primary_btc_account, amount="10.0")
+            self.check_account_amount(self.primary_eth_account, amount="5.0")
+
+    def test_cancel_filters(self):
+        self.create_order(order_type=constants.ORDER_BUY, price="0.1", amount="1", status=constants.ORDER_INIT)
+        self.create_order(order_type=constants.ORDER_BUY, price="0.2", amount="1", status=constants.ORDER_INIT)
+        self.create_order(order_type=constants.ORDER_BUY, price="0.3", amount="1", status=constants.ORDER_INIT)
+
+        orders = self.cancel_orders(pair=constants.PAIR_BTC_ETH, order_type=constants.ORDER_BUY,
+                                    price_min="0.15", price_max="0.3")
+        self.assertEqual(sorted([order['price'] for order in orders]), ["0.20000000", "0.30000000"])
+
+        self.assertEqual(len(self.cancel_orders(order_type=constants.ORDER_SELL)), 0)
+        self.check_account_amount(self.primary_btc_account, amount="9.9")
+
+    def test_cancel_only_own_orders(self):
+        self.create_order(order_type=constants.ORDER_BUY, price="0.1", amount="1", status=constants.ORDER_INIT)
+
+        self.client.force_authenticate(self.some_user)
+        self.assertEqual(len(self.cancel_orders()), 0)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(len(self.cancel_orders()), 1)
+
+    def test_malformed(self):
+        for data in [{'pair': 1}, {'pair': ['btc_eth']}, {'type': {'buy': True}}, {'price_min': 'abc'}]:
+            response = self.client.post('/api/orders/cancel/', data=data, format='json')
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+
 class NotificationTest(BaseTest):
     def test_notification(self):
         self.create_order(order_type=constants.ORDER_BUY, total="5.0", price="0.5", status=constants.ORDER_INIT)
@@ -525,3 +697,139 @@ class NotificationTest(BaseTest):
 
         self.assertEqual(len(self.get_publishments("history_btc_eth_sell")), 2)
         self.assertEqual(len(self.get_publishments("history_btc_eth_buy")), 2)
+
+
+class IndexTest(BaseTest):
+    """
+        Tables in tests are tiny, so sequential scan is forbidden in order to check that planner is able to use index.
+    """
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql, params)
+            return "\n".join([row[0] for row in cursor.fetchall()])
+
+    def test_matching_query(self):
+        for order_type, index in [(constants.ORDER_BUY, 'absortium_order_open_sell_idx'),
+                                  (constants.ORDER_SELL, 'absortium_order_open_buy_idx')]:
+            order = Order(type=order_type, price="1.0", pair=constants.PAIR_BTC_ETH, owner_id=self.user.pk)
+            sql, params = get_opposites(order).query()
+
+            plan = self.explain(sql, params)
+            self.assertNotIn("Seq Scan", plan)
+            self.assertIn(index, plan)
+
+    def test_offers_query(self):
+        for order_type, index in [(constants.ORDER_BUY, 'absortium_order_open_buy_idx'),
+                                  (constants.ORDER_SELL, 'absortium_order_open_sell_idx')]:
+            queryset = Order.objects.filter(Q(status=constants.ORDER_INIT) | Q(status=constants.ORDER_PENDING),
+                                            pair=constants.PAIR_BTC_ETH,
+                                            type=order_type,
+                                            price="1.0")
+            sql, params = queryset.query.sql_with_params()
+
+            plan = self.explain(sql, params)
+            self.assertNotIn("Seq Scan", plan)
+            self.assertIn(index, plan)
+
+
+class FlushTest(BaseTest):
+    def test_sweep_statements(self):
+        """
+            Fills of the one matching pass are written at once: every locked account is updated once, changes of the
+            counterparty accounts are appended to the journal with one insert, new orders are inserted with one insert
+            and changed orders are updated with one update.
+        """
+        n = 5
+
+        for _ in range(n):
+            self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="1", status=constants.ORDER_INIT)
+
+        self.publishments_flush()
+        self.client.force_authenticate(self.some_user)
+
+        with CaptureQueriesContext(connection) as context:
+            self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount=str(n))
+
+        queries = [query['sql'] for query in context.captured_queries]
+
+        account_updates = [sql for sql in queries if sql.startswith('UPDATE "absortium_account"')]
+        entry_inserts = [sql for sql in queries if sql.startswith('INSERT INTO "absortium_balanceentry"')]
+        order_inserts = [sql for sql in queries if sql.startswith('INSERT INTO "absortium_order"')]
+        order_updates = [sql for sql in queries if sql.startswith('UPDATE absortium_order') or
+                         sql.startswith('UPDATE "absortium_order"')]
+
+        # some_user btc and eth accounts
+        self.assertEqual(len(account_updates), 2)
+
+        # primary btc and eth accounts
+        self.assertEqual(len(entry_inserts), 1)
+        self.assertEqual(BalanceEntry.objects.count(), 2)
+
+        # taker order and then all fractions
+        self.assertEqual(len(order_inserts), 2)
+        self.assertEqual(len(order_updates), 1)
+
+        self.check_account_amount(self.some_btc_account, amount=str(0.5 * n))
+        self.assertEqual(len(self.get_orders(constants.ORDER_SELL)), n)
+
+        self.client.force_authenticate(self.user)
+        self.check_account_amount(self.primary_eth_account, amount=str(n))
+
+    def test_counterparty_accounts_select(self):
+        """
+            Accounts of the all counterparty orders of the batch are selected at once.
+        """
+        n = 5
+
+        for _ in range(n):
+            self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="1", status=constants.ORDER_INIT)
+
+        self.client.force_authenticate(self.some_user)
+
+        with CaptureQueriesContext(connection) as context:
+            self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount=str(n))
+
+        account_selects = [query['sql'] for query in context.captured_queries
+                           if query['sql'].startswith('SELECT') and 'FROM "absortium_account"' in query['sql']]
+
+        # lock of the taker accounts and one select of the counterparty accounts
+        self.assertEqual(len(account_selects), 2)
+        self.assertIn('ORDER BY "absortium_account"."id" ASC FOR UPDATE', account_selects[0])
+
+    def test_offers_notification_once_per_level(self):
+        n = 5
+
+        for _ in range(n):
+            self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="1", status=constants.ORDER_INIT)
+
+        self.publishments_flush()
+        self.client.force_authenticate(self.some_user)
+        self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount=str(n))
+
+        # publication when order is created is replaced by the one after flush
+        self.assertEqual(len(self.get_publishments("offers_btc_eth_sell")), 1)
+        self.assertEqual(len(self.get_publishments("offers_btc_eth_buy")), 1)
+
+
+class SplitTest(SimpleTestCase):
+    def test_clone(self):
+        order = Order(pk=1, type=constants.ORDER_BUY, pair=constants.PAIR_BTC_ETH, price="0.5", amount="2", total="1",
+                      owner_id=1)
+        order._state.adding = False
+        order.from_account = Account(pk=1, currency=constants.BTC)
+        order.to_account = Account(pk=2, currency=constants.ETH)
+        order.link = Order(pk=2)
+
+        fraction = order.clone()
+
+        self.assertIsNone(fraction.pk)
+        self.assertTrue(fraction._state.adding)
+        self.assertIsNot(fraction._state, order._state)
+        self.assertIs(fraction.from_account, order.from_account)
+        self.assertIs(fraction.to_account, order.to_account)
+        self.assertFalse(hasattr(fraction, Order._meta.get_field('link').get_cache_name()))
+
+        fraction.amount = "1"
+        self.assertEqual(order.amount, "2")
@@ -0,0 +1,115 @@
+import json
+from datetime import timedelta
+
+from django.utils import timezone
+
+from absortium import constants
+from absortium.celery import tasks
+from absortium.crossbarhttp import client as crossbar
+from absortium.crossbarhttp import outbox, publishment
+from absortium.crossbarhttp.client import set_crossbar_client
+from absortium.engine import book
+from absortium.model.models import Order, Publication
+from absortium.tests.base import AbsoritumUnitTest
+from core.utils.logging import getLogger
+
+__author__ = "andrew.shvv@gmail.com"
+
+logger = getLogger(__name__)
+
+
+class RouterClient():
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.published = []
+
+    def publish(self, topic, **publishment):
+        if self.failures.get(topic):
+            self.failures[topic] -= 1
+            raise Exception("Router is not available")
+
+        self.published.append((topic, publishment['n']))
+
+
+class FailingOutboxClient(outbox.OutboxClient):
+    def publish_many(self, publications):
+        raise Exception("Statement timeout")
+
+
+class OutboxTest(AbsoritumUnitTest):
+    def setUp(self):
+        super().setUp()
+        self.client_before = crossbar.client
+        set_crossbar_client(outbox.OutboxClient())
+
+    def tearDown(self):
+        set_crossbar_client(self.client_before)
+        super().tearDown()
+
+    def publish(self, topic, n):
+        crossbar.get_crossbar_client().publish(topic, n=n)
+
+    def test_transaction(self):
+        with publishment.atomic():
+            self.publish("a", 1)
+            self.assertEqual(Publication.objects.count(), 0)
+
+        try:
+            with publishment.atomic():
+                self.publish("a", 2)
+                Publication(topic="b", data=json.dumps({'n': 1})).save()
+
+                raise Exception("Something wrong!")
+        except Exception:
+            pass
+
+        self.assertEqual([(p.topic, json.loads(p.data)) for p in Publication.objects.order_by('pk')],
+                         [("a", {'n': 1})])
+
+    def test_dispatch(self):
+        for topic, n in [("a", 1), ("b", 1), ("a", 2), ("b", 2)]:
+            self.publish(topic, n)
+
+        router = RouterClient(failures={"a": 1})
+
+        self.assertEqual(outbox.dispatch(router), (2, 1))
+        self.assertEqual(router.published, [("b", 1), ("b", 2)])
+
+        # Later publication of the topic waits for the failed one
+        self.assertEqual(outbox.dispatch(router), (2, 0))
+        self.assertEqual(router.published, [("b", 1), ("b", 2), ("a", 1), ("a", 2)])
+        self.assertEqual(Publication.objects.count(), 0)
+
+    def test_drop(self):
+        self.publish("a", 1)
+        self.publish("a", 2)
+
+        router = RouterClient(failures={"a": 100})
+
+        # Publication is retried until it is too old
+        self.assertEqual(outbox.dispatch(router), (0, 1))
+
+        later = timezone.now() + timedelta(seconds=constants.OUTBOX_MAX_AGE)
+        self.assertEqual(outbox.dispatch(router, now=later), (2, 0))
+        self.assertEqual(Publication.objects.count(), 0)
+
+    def test_backoff(self):
+        self.assertEqual(outbox.backoff(0), constants.OUTBOX_IDLE_SLEEP)
+        self.assertEqual(outbox.backoff(1), 2 * constants.OUTBOX_IDLE_SLEEP)
+        self.assertEqual(outbox.backoff(1000), constants.OUTBOX_MAX_SLEEP)
+
+    def test_book_on_failure(self):
+        set_crossbar_client(self.client_before)
+        self.make_deposit(self.get_account("btc"), amount="10.0")
+
+        book.get_book(constants.PAIR_BTC_ETH)
+        set_crossbar_client(FailingOutboxClient())
+
+        data = {'type': constants.ORDER_BUY, 'price': "0.5", 'amount': "1", 'pair': constants.PAIR_BTC_ETH}
+        with self.assertRaises(Exception):
+            tasks.create_order.apply(kwargs={'data': data, 'user_pk': self.user.pk}).get()
+
+        # Order is rolled back together with the publications, so the book which has seen it is dropped
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertNotIn(constants.PAIR_BTC_ETH, book.books)
+        self.assertEqual(len(book.get_book(constants.PAIR_BTC_ETH)), 0)
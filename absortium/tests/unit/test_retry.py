@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase
+
+from absortium import constants
+from absortium.celery.base import Contention, backoff
+from core.utils.logging import getLogger
+
+__author__ = "andrew.shvv@gmail.com"
+
+logger = getLogger(__name__)
+
+
+class RetryTest(SimpleTestCase):
+    def test_backoff(self):
+        lowest = [backoff(retry, rand=lambda: 0) for retry in range(10)]
+        highest = [backoff(retry, rand=lambda: 1) for retry in range(10)]
+
+        self.assertEqual(lowest[0], constants.CELERY_RETRY_COUNTDOWN / 2)
+        self.assertEqual(highest[0], constants.CELERY_RETRY_COUNTDOWN)
+        self.assertEqual(lowest[1], constants.CELERY_RETRY_COUNTDOWN)
+
+        # Grows until the cap
+        self.assertEqual(lowest, sorted(lowest))
+        self.assertEqual(highest[-1], constants.CELERY_RETRY_MAX_COUNTDOWN)
+        self.assertEqual(backoff(1000, rand=lambda: 1), constants.CELERY_RETRY_MAX_COUNTDOWN)
+
+    def test_contention(self):
+        self.assertEqual(backoff(0, score=1, rand=lambda: 1), 2 * constants.CELERY_RETRY_COUNTDOWN)
+
+        maximum = backoff(0, score=constants.CELERY_CONTENTION_MAX_SCORE, rand=lambda: 1)
+        self.assertEqual(backoff(0, score=1000, rand=lambda: 1), maximum)
+
+    def test_contention_decay(self):
+        contention = Contention(half_life=10)
+        self.assertEqual(contention.get('btc_eth', now=0), 0)
+
+        contention.add('btc_eth', now=0)
+        contention.add('btc_eth', now=0)
+        self.assertEqual(contention.get('btc_eth', now=0), 2)
+        self.assertEqual(contention.get('btc_eth', now=10), 1)
+        self.assertEqual(contention.get('eth_btc', now=10), 0)
+
+        contention.add('btc_eth', now=10)
+        self.assertEqual(contention.get('btc_eth', now=20), 1)
@@ -0,0 +1,49 @@
+from django.test import SimpleTestCase
+
+from absortium import constants
+from absortium.celery.routers import PairRouter, get_pair_queue, get_task_pair
+from core.utils.logging import getLogger
+
+__author__ = 'andrew.shvv@gmail.com'
+
+logger = getLogger(__name__)
+
+
+class PairRouterTest(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.router = PairRouter()
+
+    def route(self, task, **kwargs):
+        return self.router.route_for_task('absortium.celery.tasks.{}'.format(task), args=(), kwargs=kwargs)
+
+    def test_create_order(self):
+        route = self.route('create_order', data={'pair': constants.PAIR_BTC_ETH}, user_pk=1)
+        self.assertEqual(route['queue'], get_pair_queue(constants.PAIR_BTC_ETH))
+
+    def test_default_pair(self):
+        route = self.route('create_order', data={}, user_pk=1)
+        self.assertEqual(route['queue'], get_pair_queue(constants.PAIR_BTC_ETH))
+
+    def test_existent_order(self):
+        for task in ['cancel_order', 'update_order', 'lock_order', 'unlock_order', 'approve_order']:
+            route = self.route(task, order_pk=1, pair=constants.PAIR_BTC_ETH)
+            self.assertEqual(route['queue'], get_pair_queue(constants.PAIR_BTC_ETH))
+
+    def test_malformed_pair(self):
+        self.assertIsNone(self.route('create_order', data={'pair': '(*YGV*T^C%D'}, user_pk=1))
+
+    def test_not_order_tasks(self):
+        for task in ['do_deposit', 'do_withdrawal', 'create_account']:
+            self.assertIsNone(self.route(task, data={}, user_pk=1))
+
+    def test_mass_cancel(self):
+        route = self.route('cancel_orders', user_pk=1, pair=constants.PAIR_BTC_ETH, filters={})
+        self.assertEqual(route['queue'], get_pair_queue(constants.PAIR_BTC_ETH))
+
+    def test_task_pair(self):
+        self.assertEqual(get_task_pair('absortium.celery.tasks.create_order', {'data': {}}), constants.PAIR_BTC_ETH)
+
+        # Tasks of the default queue don't have the pair, even if it is defaulted from their data
+        for task in ['do_deposit', 'do_withdrawal', 'create_account', 'fold_balances']:
+            self.assertIsNone(get_task_pair('absortium.celery.tasks.{}'.format(task), {'data': {}}))
@@ -0,0 +1,67 @@
+from decimal import Decimal as D
+
+from django.contrib.auth import get_user_model
+from rest_framework.renderers import JSONRenderer
+
+from absortium import constants
+from absortium.celery import tasks
+from absortium.model.models import Account, Order, MarketInfo
+from absortium.serializers import \
+    AccountSerializer, \
+    OrderSerializer, \
+    MarketInfoSerializer, \
+    account_serializer, \
+    order_serializer, \
+    market_info_serializer
+from absortium.tests.base import AbsoritumUnitTest
+from core.utils.logging import getLogger
+
+__author__ = "andrew.shvv@gmail.com"
+
+logger = getLogger(__name__)
+
+
+class FastSerializerTest(AbsoritumUnitTest):
+    def setUp(self):
+        super().setUp()
+
+        self.make_deposit(self.get_account("btc"), amount="10.0")
+        self.create_order(order_type=constants.ORDER_BUY, price="0.5", amount="2", status=constants.ORDER_INIT)
+
+        User = get_user_model()
+        self.some_user = User(username="some_user")
+        self.some_user.save()
+
+        self.client.force_authenticate(self.some_user)
+        self.make_deposit(self.get_account("eth"), amount="10.0")
+        self.create_order(order_type=constants.ORDER_SELL, price="0.5", amount="1")
+
+        tasks.calculate_market_info.delay()
+
+    def check_parity(self, serializer_class, fast, instances, values=None):
+        render = JSONRenderer().render
+
+        self.assertTrue(instances)
+        for instance in instances:
+            data = serializer_class(instance).data
+            self.assertEqual(render(fast.serialize(instance)), render(data))
+            self.assertEqual(list(fast.serialize(instance).items()), list(data.items()))
+
+        if values is not None:
+            self.assertEqual(render(fast.serialize_values(values)), render(serializer_class(values, many=True).data))
+
+    def test_order(self):
+        self.check_parity(OrderSerializer, order_serializer, list(Order.objects.all()), Order.objects.all())
+
+    def test_order_not_saved(self):
+        # Not quantized decimals and empty 'created' of the order which is not written yet
+        order = Order(price=D("0.123456789"), amount=D("1.5"), total=D(3), type=constants.ORDER_SELL,
+                      pair=constants.PAIR_BTC_ETH, status=constants.ORDER_INIT)
+        self.check_parity(OrderSerializer, order_serializer, [order])
+
+    def test_market_info(self):
+        self.check_parity(MarketInfoSerializer, market_info_serializer, list(MarketInfo.objects.all()),
+                          MarketInfo.objects.all())
+
+    def test_account(self):
+        self.check_parity(AccountSerializer, account_serializer, list(Account.objects.all()))
@@ -10,6 +10,7 @@ from absortium.views import \
     DepositViewSet, \
     MarketInfoSet, \
     HistoryViewSet, \
+    CandleViewSet, \
     btc_notification_handler, \
     eth_notification_handler
 
@@ -23,6 +24,7 @@ router.register(prefix=r"withdrawals", viewset=WithdrawalViewSet, base_name="Wit
 router.register(prefix=r"offers", viewset=OfferViewSet, base_name="Offers")
 router.register(prefix=r"marketinfo", viewset=MarketInfoSet, base_name="MarketInfo")
 router.register(prefix=r"history", viewset=HistoryViewSet, base_name="History")
+router.register(prefix=r"candles", viewset=CandleViewSet, base_name="Candles")
 
 urlpatterns = [
     url(r"^api/", include(router.urls)),
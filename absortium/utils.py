@@ -1,8 +1,10 @@
 import decimal
+from datetime import datetime
 from decimal import Decimal
 from random import choice
 from string import printable
 
+from django.utils.timezone import utc
 from rest_framework.exceptions import ValidationError
 
 from absortium import constants
@@ -46,6 +48,9 @@ def retry(exceptions=(), times=1):
 def get_field(data, name, choices, throw=True):
     value = data.get(name)
     if value:
+        if not isinstance(value, str):
+            raise ValidationError("Value not in the '{}'".format(choices))
+
         value = value.lower()
 
         if value in choices:
@@ -59,6 +64,20 @@ def get_field(data, name, choices, throw=True):
             return None
 
 
+def get_timestamp(data, name):
+    """
+        Datetime from the unix timestamp (seconds) field, None if field is not specified.
+    """
+    value = data.get(name)
+    if value is None:
+        return None
+
+    try:
+        return datetime.fromtimestamp(int(value), tz=utc)
+    except (ValueError, OverflowError, OSError):
+        raise ValidationError("'{}' should be unix timestamp".format(name))
+
+
 def calculate_total_or_amount(data):
     amount = data.get('amount')
     total = data.get('total')
@@ -1,11 +1,13 @@
+import decimal
 import json
 
+from celery import chord
+from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db.models import Q
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import quote_etag, parse_etags
 from rest_framework import mixins, viewsets
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, list_route
 from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.status import HTTP_201_CREATED, HTTP_200_OK
@@ -14,18 +16,25 @@ from absortium import constants
 from absortium.celery import tasks
 from absortium.mixins.celery import \
     CreateCeleryMixin, \
+    BatchCreateCeleryMixin, \
+    MassCancelCeleryMixin, \
     DestroyCeleryMixin, \
     ApproveCeleryMixin, \
     UpdateCeleryMixin, \
     LockCeleryMixin
-from absortium.model.models import Order, Account, MarketInfo
+from absortium.model.models import Order, Account, MarketInfo, PriceLevel, BookSequence, Candle, Trade
 from absortium.serializers import \
     AccountSerializer, \
     OrderSerializer, \
     DepositSerializer, \
     WithdrawSerializer, \
-    MarketInfoSerializer
-from absortium.utils import get_field
+    MarketInfoSerializer, \
+    CandleSerializer, \
+    account_serializer, \
+    order_serializer, \
+    market_info_serializer, \
+    candle_serializer
+from absortium.utils import get_field, get_timestamp
 from core.utils.logging import getPrettyLogger
 
 __author__ = 'andrew.shvv@gmail.com'
@@ -33,37 +42,113 @@ __author__ = 'andrew.shvv@gmail.com'
 logger = getPrettyLogger(__name__)
 
 
+def cached_response(request, key, version, build):
+    """
+        Serve the response which is built by 'build' from the cache until 'version' is changed, answer with 304 if
+        client already has this version.
+    """
+    etag = quote_etag("{}:{}".format(key, version))
+
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        cached = cache.get(key)
+
+        if cached is None or cached[0] != version:
+            cached = (version, json.dumps(build(), cls=DjangoJSONEncoder))
+            cache.set(key, cached, constants.OFFERS_CACHE_TIMEOUT)
+
+        response = HttpResponse(cached[1], content_type="application/json")
+
+    response['ETag'] = etag
+    return response
+
+
 class OfferViewSet(viewsets.GenericViewSet):
     """
     This view should return a list of all offers
     by the given currencies.
+
+    Offers are changed only when the book sequence of the pair is changed, so it is used as the version of the cached
+    responses and as the ETag.
     """
 
     serializer_class = OrderSerializer
-    queryset = Order.objects.filter(Q(status=constants.ORDER_INIT) | Q(status=constants.ORDER_PENDING))
+    queryset = PriceLevel.objects.all()
     permission_classes = ()
     authentication_classes = ()
 
-    def filter_queryset(self, queryset):
+    def get_depth(self):
+        depth = self.request.GET.get('depth')
+        if depth is None:
+            return None
+
+        try:
+            depth = int(depth)
+        except ValueError:
+            raise ValidationError("'depth' should be integer")
+
+        if not 0 < depth <= constants.OFFERS_MAX_DEPTH:
+            raise ValidationError("'depth' should be between 1 and {}".format(constants.OFFERS_MAX_DEPTH))
+
+        return depth
+
+    def list(self, request, *args, **kwargs):
+        pair = get_field(self.request.GET, 'pair', constants.AVAILABLE_CURRENCY_PAIRS, throw=False)
+        order_type = get_field(self.request.GET, 'type', constants.AVAILABLE_ORDER_TYPES, throw=False)
+        depth = self.get_depth()
+
+        pairs = [pair] if pair is not None else constants.AVAILABLE_CURRENCY_PAIRS
+        order_types = [order_type] if order_type is not None else constants.AVAILABLE_ORDER_TYPES
+
+        sequences = dict(BookSequence.objects.filter(pair__in=pairs).values_list('pair', 'sequence'))
+        version = ",".join(["{}.{}".format(p, sequences.get(p, 0)) for p in sorted(pairs)])
+
+        def build():
+            offers = []
+
+            for p in sorted(pairs):
+                for t in sorted(order_types):
+                    levels = self.get_queryset().filter(pair=p, type=t).values("price", "type", "pair", "amount",
+                                                                               "total")
+
+                    if depth is None:
+                        offers.extend(levels.order_by('price'))
+                    elif t == constants.ORDER_SELL:
+                        # Best levels: the lowest sell prices and the highest buy prices
+                        offers.extend(levels.order_by('price')[:depth])
+                    else:
+                        offers.extend(reversed(list(levels.order_by('-price')[:depth])))
+
+            return offers
+
+        key = constants.OFFERS_CACHE_KEY.format(pair=pair or 'all', type=order_type or 'all', depth=depth or 'all')
+        return cached_response(request, key, version, build)
+
+    @list_route(methods=['get'])
+    def snapshot(self, request, *args, **kwargs):
         """
-            This method used for filter origin offers queryset by the given pair/type currency.
+            Offers of the pair with the sequence of the last offers publication they reflect.
         """
-        fields = {}
-
         pair = get_field(self.request.GET, 'pair', constants.AVAILABLE_CURRENCY_PAIRS, throw=False)
-        if pair is not None:
-            fields.update(pair=pair)
+        pair = pair or constants.PAIR_BTC_ETH
 
-        order_type = get_field(self.request.GET, 'type', constants.AVAILABLE_ORDER_TYPES, throw=False)
-        if order_type is not None:
-            fields.update(type=order_type)
+        def build():
+            sequence, levels = PriceLevel.snapshot(pair)
 
-        return queryset.filter(**fields)
+            snapshot = {
+                'pair': pair,
+                'sequence': sequence,
+            }
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        queryset = queryset.values("price", "type", "pair").annotate(amount=Sum('amount'), total=Sum('total'))
-        return HttpResponse(json.dumps(list(queryset), cls=DjangoJSONEncoder), content_type="application/json")
+            for order_type in constants.AVAILABLE_ORDER_TYPES:
+                snapshot[order_type] = [{'price': level.price, 'amount': level.amount, 'total': level.total}
+                                        for level in levels if level.type == order_type]
+
+            return snapshot
+
+        key = constants.OFFERS_SNAPSHOT_CACHE_KEY.format(pair=pair)
+        return cached_response(request, key, BookSequence.current(pair), build)
 
 
 def init_account(pk_name="accounts_pk"):
@@ -97,6 +182,20 @@ class AccountViewSet(CreateCeleryMixin,
     def get_queryset(self):
         return self.request.user.accounts.all()
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        accounts = list(queryset) if page is None else page
+
+        # Balance is the snapshot plus the journal, journal of all accounts is summed with one select
+        Account.load_pending(accounts)
+
+        if page is not None:
+            return self.get_paginated_response(account_serializer.serialize_many(accounts))
+
+        return Response(account_serializer.serialize_many(accounts))
+
     def create_in_celery(self, request, *args, **kwargs):
         context = {
             "data": request.data,
@@ -150,6 +249,8 @@ class WithdrawalViewSet(CreateCeleryMixin,
 
 
 class OrderViewSet(CreateCeleryMixin,
+                   BatchCreateCeleryMixin,
+                   MassCancelCeleryMixin,
                    DestroyCeleryMixin,
                    ApproveCeleryMixin,
                    UpdateCeleryMixin,
@@ -186,7 +287,13 @@ class OrderViewSet(CreateCeleryMixin,
         return super().retrieve(request, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(order_serializer.serialize_many(page))
+
+        return Response(order_serializer.serialize_values(queryset))
 
     def create_in_celery(self, request, *args, **kwargs):
         context = {
@@ -196,38 +303,137 @@ class OrderViewSet(CreateCeleryMixin,
 
         return tasks.create_order.delay(**context)
 
+    def batch_in_celery(self, request, *args, **kwargs):
+        """
+            Batch is either list of orders or {"orders": [...], "continue_on_error": true/false}.
+        """
+        data = request.data
+
+        if isinstance(data, list):
+            orders = data
+            continue_on_error = False
+        else:
+            orders = data.get('orders')
+            continue_on_error = bool(data.get('continue_on_error', False))
+
+        if not isinstance(orders, list) or not orders or not all(isinstance(order, dict) for order in orders):
+            raise ValidationError("You should specify list of orders")
+
+        if len(orders) > constants.ORDER_BATCH_MAX_SIZE:
+            raise ValidationError("Batch can't contain more than {} orders".format(constants.ORDER_BATCH_MAX_SIZE))
+
+        pairs = set(str(order.get('pair', constants.PAIR_BTC_ETH)).lower() for order in orders)
+        if len(pairs) != 1:
+            raise ValidationError("All orders of the batch should have the same pair")
+
+        pair = pairs.pop()
+        if pair not in constants.AVAILABLE_CURRENCY_PAIRS:
+            raise ValidationError("Value not in the '{}'".format(constants.AVAILABLE_CURRENCY_PAIRS))
+
+        # Every order is validated before the batch is enqueued, task gets the errors of the invalid ones
+        errors = []
+        for order in orders:
+            try:
+                tasks.batch_order(order, pair)
+                errors.append(None)
+            except ValidationError as e:
+                errors.append(tasks.batch_error(e))
+
+        if not continue_on_error and any(errors):
+            raise ValidationError([error['error'] if error else {} for error in errors])
+
+        context = {
+            "data": orders,
+            "errors": errors,
+            "user_pk": request.user.pk,
+            "pair": pair,
+            "continue_on_error": continue_on_error,
+        }
+
+        return tasks.create_orders.delay(**context)
+
     def update_in_celery(self, request, *args, **kwargs):
+        order = self.get_object()
         context = {
             "data": request.data,
-            "order_pk": self.get_object().pk,
+            "order_pk": order.pk,
+            "pair": order.pair,
         }
 
         return tasks.update_order.delay(**context)
 
     def approve_in_celery(self, request, *args, **kwargs):
+        order = self.get_object()
         context = {
-            "order_pk": self.get_object().pk,
+            "order_pk": order.pk,
+            "pair": order.pair,
         }
 
         return tasks.approve_order.delay(**context)
 
     def destroy_in_celery(self, request, *args, **kwargs):
+        order = self.get_object()
         context = {
-            "order_pk": self.get_object().pk,
+            "order_pk": order.pk,
+            "pair": order.pair,
         }
 
         return tasks.cancel_order.delay(**context)
 
+    def cancel_in_celery(self, request, *args, **kwargs):
+        """
+            Cancel all open orders of the user, optionally only of the given pair/type and in the price range
+            [price_min, price_max].
+        """
+        data = request.data
+
+        pair = get_field(data, 'pair', constants.AVAILABLE_CURRENCY_PAIRS, throw=False)
+        order_type = get_field(data, 'type', constants.AVAILABLE_ORDER_TYPES, throw=False)
+
+        filters = {
+            'type': order_type
+        }
+
+        for name in ['price_min', 'price_max']:
+            value = data.get(name)
+
+            if value is not None:
+                try:
+                    value = decimal.Decimal(value)
+                except decimal.InvalidOperation:
+                    raise ValidationError("'{}' field should be decimal serializable".format(name))
+
+                if not value.is_finite():
+                    raise ValidationError("'{}' field should be decimal serializable".format(name))
+
+                filters[name] = str(value)
+
+        context = {
+            "user_pk": request.user.pk,
+            "filters": filters,
+        }
+
+        if pair is not None:
+            return tasks.cancel_orders.delay(pair=pair, **context)
+
+        # Every pair is canceled in the queue of the pair
+        header = [tasks.cancel_orders.s(pair=pair, **context) for pair in constants.AVAILABLE_CURRENCY_PAIRS]
+        return chord(header)(tasks.join_results.s())
+
     def lock_in_celery(self, request, *args, **kwargs):
+        order = self.get_object()
         context = {
-            "order_pk": self.get_object().pk,
+            "order_pk": order.pk,
+            "pair": order.pair,
         }
 
         return tasks.lock_order.delay(**context)
 
     def unlock_in_celery(self, request, *args, **kwargs):
+        order = self.get_object()
         context = {
-            "order_pk": self.get_object().pk,
+            "order_pk": order.pk,
+            "pair": order.pair,
         }
 
         return tasks.unlock_order.delay(**context)
@@ -235,30 +441,50 @@ class OrderViewSet(CreateCeleryMixin,
 
 class HistoryViewSet(viewsets.GenericViewSet,
                      mixins.ListModelMixin):
+    """
+    Completed orders, read from the trades: every trade gives its maker and taker orders (both are completed by the
+    match), 'type' leaves only the orders of this type - one per trade.
+    """
     serializer_class = OrderSerializer
-    queryset = Order.objects.all()
+    queryset = Trade.objects.select_related('maker', 'taker')
     permission_classes = ()
     authentication_classes = ()
 
     def filter_queryset(self, queryset):
         """
-            This method used for filter origin orders queryset by the given pair/type currency.
+            This method used for filter trades queryset by the given pair.
         """
-        fields = {'status': constants.ORDER_COMPLETED}
+        fields = {}
 
         pair = get_field(self.request.GET, 'pair', constants.AVAILABLE_CURRENCY_PAIRS, throw=False)
         if pair is not None:
             fields.update(pair=pair)
 
+        return queryset.filter(**fields)
+
+    def get_orders(self, trades):
         order_type = get_field(self.request.GET, 'type', constants.AVAILABLE_ORDER_TYPES, throw=False)
-        if order_type is not None:
-            fields.update(type=order_type)
 
-        return queryset.filter(**fields)
+        return [order for trade in trades for order in (trade.maker, trade.taker)
+                if order_type is None or order.type == order_type]
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(order_serializer.serialize_many(self.get_orders(page)))
+
+        return Response(order_serializer.serialize_many(self.get_orders(queryset)))
 
 
 class MarketInfoSet(mixins.ListModelMixin,
                     viewsets.GenericViewSet):
+    """
+    Market info snapshots, the latest first. 'from'/'to' are unix timestamps (seconds) which bound the creation time,
+    both are inclusive. 'count' - how many snapshots to return (1 by default, MARKET_INFO_MAX_COUNT if the time range
+    is given), not more than MARKET_INFO_MAX_COUNT, to get the older ones use 'to'.
+    """
     serializer_class = MarketInfoSerializer
     queryset = MarketInfo.objects.all()
     permission_classes = ()
@@ -271,19 +497,62 @@ class MarketInfoSet(mixins.ListModelMixin,
         if pair is not None:
             fields.update(pair=pair)
 
+        start = get_timestamp(self.request.GET, 'from')
+        if start is not None:
+            fields.update(created__gte=start)
+
+        end = get_timestamp(self.request.GET, 'to')
+        if end is not None:
+            fields.update(created__lte=end)
+
         try:
-            count = self.request.GET.get('count', 1)
+            default = 1 if start is None and end is None else constants.MARKET_INFO_MAX_COUNT
+            count = self.request.GET.get('count', default)
             count = int(count)
         except ValueError:
             raise ValidationError("You should specify valid 'count' field")
 
-        if count == 0:
-            objs = self.get_queryset().filter(**fields)
+        if not 0 < count <= constants.MARKET_INFO_MAX_COUNT:
+            raise ValidationError("'count' should be between 1 and {}".format(constants.MARKET_INFO_MAX_COUNT))
+
+        objs = self.get_queryset().filter(**fields)[:count]
+
+        return Response(market_info_serializer.serialize_values(objs))
+
+
+class CandleViewSet(viewsets.GenericViewSet):
+    """
+    Candles of the pair with the given resolution (1m by default). 'from'/'to' are unix timestamps (seconds) which
+    bound the start of the candles, both are inclusive. Not more than CANDLES_MAX_COUNT candles are returned: the
+    first ones after 'from' if it is given, otherwise the last ones before 'to'.
+    """
+
+    serializer_class = CandleSerializer
+    queryset = Candle.objects.all()
+    permission_classes = ()
+    authentication_classes = ()
+
+    def list(self, request, *args, **kwargs):
+        pair = get_field(self.request.GET, 'pair', constants.AVAILABLE_CURRENCY_PAIRS)
+        resolution = get_field(self.request.GET, 'resolution', constants.AVAILABLE_CANDLE_RESOLUTIONS, throw=False)
+
+        candles = self.get_queryset().filter(pair=pair, resolution=resolution or constants.CANDLE_1M)
+
+        start = get_timestamp(self.request.GET, 'from')
+        if start is not None:
+            candles = candles.filter(start__gte=start)
+
+        end = get_timestamp(self.request.GET, 'to')
+        if end is not None:
+            candles = candles.filter(start__lte=end)
+
+        if start is not None:
+            candles = candle_serializer.serialize_values(candles.order_by('start')[:constants.CANDLES_MAX_COUNT])
         else:
-            objs = self.get_queryset().filter(**fields)[:count]
+            candles = candle_serializer.serialize_values(candles.order_by('-start')[:constants.CANDLES_MAX_COUNT])
+            candles.reverse()
 
-        serializer = self.get_serializer(objs, many=True)
-        return Response(serializer.data)
+        return Response(candles)
 
 
 @api_view(http_method_names=['POST'])